@@ -1,16 +1,39 @@
 # -*- coding: utf-8 -*-
 
+import os
+import struct
+import threading
+
 from bson import BSON
+from twisted.python import log
 
 from lib import database
-from lib.common import retrieve_key, cast_type
+from lib.database import on_abort
+from lib.dbstate import state_version
+from lib.common import retrieve_key
 from lib.service import ServiceProvider
 from lib import bdb_helpers
+from lib.cursor import open_cursor
+from lib.journal_archive import JournalArchive
+from lib.journal_codec import JournalCodec
 
 
 class ActionError(Exception): pass
 
 
+class ActionMeta(type):
+    """
+    Metaclass of actions: fields declared in FIELDS are stored in slots,
+      so actions carry no per-instance dict.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        if not namespace.has_key("__slots__"):
+            namespace["__slots__"] = tuple(key for key, type in
+                                           namespace.get("FIELDS", ()))
+        return type.__new__(mcs, name, bases, namespace)
+
+
 class Action(object):
     """
     Class represent single elementary action.
@@ -20,46 +43,160 @@ class Action(object):
       is applyable.
     Subclasses should implement following methods:
       _do_apply - for performing actual action
-      (optional) _current_dbstate - for retrieving current database state.
-        Default method allows applying action on any state.
+      (optional) _current_dbstate - for retrieving current database state,
+        keyword argument version is dbstate format version to retrieve
+        state of (see lib.dbstate). Default method allows applying action
+        on any state.
+    Registered subclasses should define following attributes:
+      ACTION_ID - unique numeric action type id used in compact format,
+        must never change once actions are journaled
+      FIELDS - tuple of (key, type) of data fields added by the class,
+        fields of base classes come first in serialized action.
+
+    Action is serialized either to bson document {"name", "data"}
+      or to compact format: header (magic, version), action id,
+      mask of None fields and non-None fields in schema order
+      (int as 8-byte signed, str as 4-byte length and bytes).
+    Compact header never matches the beginning of bson document
+      (4th byte of bson length is zero for documents less than 16M).
+    Mixins of actions should define empty __slots__.
     """
 
+    __metaclass__ = ActionMeta
+
+    ACTION_ID = None
+    FIELDS = (("dbstate", str),)
+
+    FORMAT_BSON = "bson"
+    FORMAT_COMPACT = "compact"
+    FORMATS = (FORMAT_BSON, FORMAT_COMPACT)
+
+    COMPACT_MAGIC = "ACT"
+    COMPACT_VERSION = "\x01"
+    COMPACT_HEADER = COMPACT_MAGIC + COMPACT_VERSION
+    COMPACT_HEADER_SIZE = len(COMPACT_HEADER)
+    COMPACT_PREFIX = struct.Struct(">HI")
+    COMPACT_INT = struct.Struct(">q")
+    COMPACT_STR_LEN = struct.Struct(">I")
+    COMPACT_MAX_FIELDS = 32
+    COMPACT_TYPES = (str, int)
+
+    # filled on registration
+    _schema = ()
+    _schema_keys = ()
+    _state_slots = ()
+
     registered_actions = {}
+    registered_action_ids = {}
+    # bson is understood by every peer, compact format is enabled
+    #   by configuration when all nodes are able to read it
+    serialize_format = FORMAT_BSON
 
     @classmethod
     def register_action(cls, act_cls):
+        act_id = act_cls.__dict__.get("ACTION_ID", None)
+        if act_id is None:
+            raise ActionError("Unable to register action '{0}': "
+                              "ACTION_ID required".format(act_cls.__name__))
+        if cls.registered_action_ids.has_key(act_id):
+            raise ActionError("Unable to register action '{0}': ACTION_ID {1} "
+                              "already used by '{2}'".format(act_cls.__name__, act_id,
+                              cls.registered_action_ids[act_id].__name__))
+
+        act_cls._schema = cls._make_schema(act_cls)
+        act_cls._schema_keys = tuple(key for key, type in act_cls._schema)
+        act_cls._state_slots = cls._make_state_slots(act_cls)
         cls.registered_actions[act_cls.__name__] = act_cls
+        cls.registered_action_ids[act_id] = act_cls
         return act_cls
 
+    @classmethod
+    def _make_schema(cls, act_cls):
+        schema = []
+        for klass in reversed(act_cls.__mro__):
+            for key, type in klass.__dict__.get("FIELDS", ()):
+                if not type in cls.COMPACT_TYPES:
+                    raise ActionError("Unable to register action '{0}': unsupported "
+                                      "type of field '{1}'".format(act_cls.__name__, key))
+                schema.append((key, type))
+
+        if len(schema) > cls.COMPACT_MAX_FIELDS:
+            raise ActionError("Unable to register action '{0}': "
+                              "too many fields".format(act_cls.__name__))
+
+        return tuple(schema)
+
+    @classmethod
+    def _make_state_slots(cls, act_cls):
+        """
+        Returns slots which are not fields: they are not serialized
+          and initialized to None when action is unserialized as trusted.
+        """
+
+        slots = []
+        for klass in act_cls.__mro__:
+            for key in klass.__dict__.get("__slots__", ()):
+                if (not key in act_cls._schema_keys and not key in slots and
+                        not key.startswith("__")):
+                    slots.append(key)
+        return tuple(slots)
+
+    @classmethod
+    def set_serialize_format(cls, format):
+        if not format in cls.FORMATS:
+            raise ActionError("Unknown action format '{0}'".format(format))
+        Action.serialize_format = format
+
     @classmethod
     def construction_failure(cls, msg):
         raise ActionError("Unable to construct action: " + str(msg))
 
     @classmethod
     def required_data_by_key(cls, action_data, key, type):
-        value = retrieve_key(action_data, key, failure_func=cls.construction_failure,
-                             failure_msg="wrong action data: {0} required".format(key))
+        try:
+            value = action_data[key]
+        except KeyError:
+            cls.construction_failure("wrong action data: {0} required".format(key))
 
-        return cast_type(value, type, failure_func=cls.construction_failure,
-                             failure_msg="wrong action data: bad value "
-                                         "'{0}'".format(value))
+        if isinstance(value, type):
+            return value
+
+        try:
+            return type(value)
+        except:
+            cls.construction_failure("wrong action data: bad value "
+                                     "'{0}'".format(value))
 
     @classmethod
     def optional_data_by_key(cls, action_data, key, type, default):
-        do_typecast = [True]
-        def not_found(_):
-            do_typecast[0] = False
+        if not key in action_data:
+            return default
+
+        value = action_data[key]
+        if isinstance(value, type):
+            return value
 
-        value = retrieve_key(action_data, key,
-                             failure_func=not_found,
-                             default=default)
+        try:
+            return type(value)
+        except:
+            return default
 
-        if do_typecast[0]:
-            value = cast_type(value, type, default=default)
-        return value
+    @classmethod
+    def is_compact(cls, string):
+        return (len(string) >= cls.COMPACT_HEADER_SIZE and
+                string[:3] == cls.COMPACT_MAGIC and string[3] != "\x00")
 
     @classmethod
-    def unserialize(cls, string):
+    def unserialize(cls, string, trusted=False):
+        """
+        Construct action from serialized string of any format.
+        Trusted strings (own journal, authenticated peers) in compact format
+          are not revalidated: fields are assigned as is.
+        """
+
+        if cls.is_compact(string):
+            return cls._unserialize_compact(string, trusted)
+
         action_data = BSON.decode(BSON(string))
 
         name = cls.required_data_by_key(action_data, "name", str)
@@ -71,18 +208,108 @@ class Action(object):
 
         return act_cls(**data)
 
-    def serialize(self):
+    @classmethod
+    def _unserialize_compact(cls, string, trusted):
+        if string[3] != cls.COMPACT_VERSION:
+            cls.construction_failure("unknown compact format version "
+                                     "'{0}'".format(ord(string[3])))
+
+        try:
+            act_id, none_mask = cls.COMPACT_PREFIX.unpack_from(string,
+                                                               cls.COMPACT_HEADER_SIZE)
+        except struct.error:
+            cls.construction_failure("truncated action")
+
+        act_cls = retrieve_key(cls.registered_action_ids, act_id,
+                               failure_func=cls.construction_failure,
+                               failure_msg="unknown action id '{0}'".format(act_id))
+
+        offset = cls.COMPACT_HEADER_SIZE + cls.COMPACT_PREFIX.size
+        int_unpack = cls.COMPACT_INT.unpack_from
+        int_size = cls.COMPACT_INT.size
+        len_unpack = cls.COMPACT_STR_LEN.unpack_from
+        len_size = cls.COMPACT_STR_LEN.size
+
+        data = {}
+        try:
+            for i, (key, type) in enumerate(act_cls._schema):
+                if none_mask & (1 << i):
+                    data[key] = None
+                elif type is int:
+                    data[key] = int_unpack(string, offset)[0]
+                    offset += int_size
+                else:
+                    length = len_unpack(string, offset)[0]
+                    offset += len_size
+                    data[key] = string[offset:offset + length]
+                    offset += length
+        except struct.error:
+            cls.construction_failure("truncated action")
+
+        if offset != len(string):
+            cls.construction_failure("malformed action '{0}'".format(act_cls.__name__))
+
+        if trusted:
+            act = act_cls.__new__(act_cls)
+            for key in act_cls._state_slots:
+                setattr(act, key, None)
+            for key, value in data.iteritems():
+                setattr(act, key, value)
+            return act
+        else:
+            # absent keys take defaults or fail validation
+            for key in [key for key, value in data.iteritems() if value is None]:
+                del data[key]
+            return act_cls(**data)
+
+    def serialize(self, format=None):
         name = self.name()
         if not self.registered_actions.has_key(name):
             raise ActionError("Unable to serialize action: action '{0}' "
                               "is not registered".format(name))
 
+        if format is None:
+            format = self.serialize_format
+
+        if format == self.FORMAT_COMPACT:
+            return self._serialize_compact()
+
         action_data = {
             "name": name,
-            "data": self.__dict__
+            "data": self.data()
         }
         return BSON.encode(action_data)
 
+    def _serialize_compact(self):
+        int_pack = self.COMPACT_INT.pack
+        len_pack = self.COMPACT_STR_LEN.pack
+
+        parts = []
+        none_mask = 0
+        for i, (key, type) in enumerate(self._schema):
+            value = getattr(self, key, None)
+            if value is None:
+                none_mask |= 1 << i
+            elif type is int:
+                parts.append(int_pack(value))
+            else:
+                if isinstance(value, unicode):
+                    value = value.encode("utf-8")
+                elif not isinstance(value, str):
+                    value = str(value)
+                parts.append(len_pack(len(value)))
+                parts.append(value)
+
+        prefix = self.COMPACT_PREFIX.pack(self.ACTION_ID, none_mask)
+        return "".join([self.COMPACT_HEADER, prefix] + parts)
+
+    def data(self):
+        """
+        Returns action data as dict.
+        """
+
+        return dict((key, getattr(self, key, None)) for key in self._schema_keys)
+
     def __init__(self, **kwargs):
         self.dbstate = kwargs.get("dbstate", None)
 
@@ -93,7 +320,14 @@ class Action(object):
         return str(self)
 
     def apply(self, database, txn):
-        cur_dbstate = self._current_dbstate(database, txn)
+        # aborted transaction may be retried with the same action,
+        #   so state set by apply is reset on abort
+        on_abort(txn, self._restore_state, self._save_state())
+
+        # action of peer is compared with state of format the peer had
+        #   active, several formats are maintained while cluster changes it
+        version = None if self.dbstate is None else state_version(self.dbstate)
+        cur_dbstate = self._current_dbstate(database, txn, version=version)
 
         if (self.dbstate is None) or (self.dbstate == cur_dbstate):
             self._do_apply(database, txn)
@@ -105,10 +339,18 @@ class Action(object):
         if self.dbstate is None:
             self.dbstate = cur_dbstate
 
+    def _save_state(self):
+        return (self.dbstate, [getattr(self, key, None) for key in self._state_slots])
+
+    def _restore_state(self, state):
+        self.dbstate, values = state
+        for key, value in zip(self._state_slots, values):
+            setattr(self, key, value)
+
     def _do_apply(self, database, txn):
         assert 0, "Action do method is not implemented"
 
-    def _current_dbstate(self, database, txn):
+    def _current_dbstate(self, database, txn, **kwargs):
         return self.dbstate
 
     def __str__(self):
@@ -119,6 +361,17 @@ class Action(object):
 class journal(object):
     """
     Class used to manage journal records.
+    Records are stored under fixed-width big-endian position keys,
+      so btree order is the same as position order.
+    Journal head position is kept in memory and advanced on commit,
+      the sequence remains the durable source of position. Other processes
+      writing the same journal are observed by refresh_position call.
+    Old records may be moved into append-only segment files (archive)
+      if archive_dir is configured, reads go to the archive transparently.
+    Records are compressed if compress option is set, reads always
+      accept both compressed and plain records.
+    Index of positions by touched zone, segment and arena is maintained
+      alongside the journal.
     """
 
     DATABASES = {
@@ -127,48 +380,226 @@ class journal(object):
             "flags": 0,
             "open_flags": database.bdb.DB_CREATE,
             "seq_spec": {database.Database.SEQUENCE_KEY: 1}
+        },
+
+        # stores resource index key => position key
+        "action_index": {
+            "type": database.bdb.DB_BTREE,
+            "flags": database.bdb.DB_DUP|database.bdb.DB_DUPSORT,
+            "open_flags": database.bdb.DB_CREATE
         }
     }
 
+    POSITION_FORMAT = ">Q"
+    POSITION_KEY_SIZE = struct.calcsize(POSITION_FORMAT)
+
+    # stores journal keys format version
+    KEY_FORMAT_KEY = "_fmt"
+    KEY_FORMAT_VERSION = "1"
+    MIGRATION_BATCH_SIZE = 1000
+
+    # stores index format version
+    INDEX_VERSION_KEY = "_idx"
+    INDEX_VERSION = "1"
+    INDEX_DELIMITER = " "
+    INDEX_ZONE_PREFIX = "z"
+    INDEX_SEGMENT_PREFIX = "s"
+    INDEX_ARENA_PREFIX = "a"
+
+    ARCHIVE_LIVE_WINDOW_DEFAULT = 100000
+    ARCHIVE_SEGMENT_SIZE_DEFAULT = 10000
+
     def __init__(self, sp, *args, **kwargs):
         db = sp.get("database")
+        self._database = db
         self._dbpool = database.DatabasePool(self.DATABASES,
                                              db.dbenv(),
-                                             db.dbfile())
+                                             db.dbfile(),
+                                             tuning=db.tuning(),
+                                             layout=db.layout())
+        self._migrate_keys()
+
+        self._codec = JournalCodec(compress=kwargs.get("compress", False),
+                                   level=kwargs.get("compress_level", 6))
+
+        # compact format should be enabled only when all nodes
+        #   of cluster understand it, bson is always readable
+        Action.set_serialize_format(kwargs.get("action_format",
+                                               Action.FORMAT_BSON))
+
+        archive_dir = kwargs.get("archive_dir", None)
+        if archive_dir is None:
+            self._archive = None
+        else:
+            archive_dir = os.path.join(db.dbenv_homedir(), archive_dir)
+            self._archive = JournalArchive(archive_dir)
+        self._archive_live_window = kwargs.get("archive_live_window",
+                                               self.ARCHIVE_LIVE_WINDOW_DEFAULT)
+        self._archive_segment_size = kwargs.get("archive_segment_size",
+                                                self.ARCHIVE_SEGMENT_SIZE_DEFAULT)
+
+        self._position = None
+        self._position_lock = threading.Lock()
+        self.refresh_position()
+
+        self._build_index()
 
     def dbpool(self):
         return self._dbpool
 
+    @classmethod
+    def _make_key(cls, pos):
+        return struct.pack(cls.POSITION_FORMAT, pos)
+
+    @classmethod
+    def _parse_key(cls, key):
+        if len(key) != cls.POSITION_KEY_SIZE:
+            return None
+        return struct.unpack(cls.POSITION_FORMAT, key)[0]
+
+    def _migrate_keys(self):
+        """
+        One-time conversion of decimal string keys (old format)
+          into ordered binary keys.
+        """
+
+        adb = self.dbpool().action.dbhandle()
+        if adb.get(self.KEY_FORMAT_KEY, None) == self.KEY_FORMAT_VERSION:
+            return
+
+        log.msg("Migrating action journal to ordered position keys")
+
+        migrated = 0
+        while True:
+            with self._database.transaction() as txn:
+                number = self._migrate_keys_batch(adb, txn)
+            migrated += number
+            if number < self.MIGRATION_BATCH_SIZE:
+                break
+
+        with self._database.transaction() as txn:
+            adb.put(self.KEY_FORMAT_KEY, self.KEY_FORMAT_VERSION, txn)
+
+        log.msg("Action journal migrated: {0} records converted".format(migrated))
+
+    def _migrate_keys_batch(self, adb, txn):
+        legacy = []
+
+        # binary keys start with zero bytes, decimal ones -- with digits,
+        #   so all old keys are placed together after the new ones
+        with open_cursor(adb, txn) as c:
+            try:
+                kv = c.set_range("0")
+            except database.bdb.DBNotFoundError:
+                kv = None
+
+            while kv and len(legacy) < self.MIGRATION_BATCH_SIZE:
+                if kv[0].isdigit():
+                    legacy.append(kv)
+                kv = c.next()
+
+        for key, act_dump in legacy:
+            adb.put(self._make_key(int(key)), act_dump, txn)
+            adb.delete(key, txn)
+
+        return len(legacy)
+
     def record_action(self, act, txn=None, pos=None):
-        self.record_action_dump(act.serialize(), txn, pos)
+        self.record_action_dump(act.serialize(), txn, pos, act=act)
 
-    def record_action_dump(self, act_dump, txn=None, pos=None):
+    def record_action_dump(self, act_dump, txn=None, pos=None, act=None):
         adb = self.dbpool().action.dbhandle()
 
         if not pos is None:
             # reset sequence generator if position given
-            bdb_helpers.delete(adb, database.Database.SEQUENCE_KEY, txn)
+            self.dbpool().action.reset_sequence(pos, txn=txn)
 
-        # initial value will be ignored if sequence already exists
-        seq = self.dbpool().action.sequence(initial=pos, txn=txn)
-        newid = seq.get(1, txn)
-        seq.close()
+        newid = self.dbpool().action.allocate(txn=txn)
+        adb.put(self._make_key(newid), self._codec.encode(act_dump), txn)
+        self._index_action(newid, act_dump, txn, act)
+
+        if pos is None:
+            database.on_commit(txn, self._advance_position, newid)
+        else:
+            database.on_commit(txn, self._set_position, newid)
 
-        adb.put(str(newid), act_dump, txn)
+    def record_action_dumps(self, act_dumps, txn=None):
+        """
+        Record several actions reserving range of positions at once.
+        """
+
+        if not act_dumps:
+            return
+
+        adb = self.dbpool().action.dbhandle()
+
+        first_id = self.dbpool().action.allocate(number=len(act_dumps), txn=txn)
+        for newid, act_dump in enumerate(act_dumps, first_id):
+            adb.put(self._make_key(newid), self._codec.encode(act_dump), txn)
+            self._index_action(newid, act_dump, txn)
+
+        database.on_commit(txn, self._advance_position,
+                           first_id + len(act_dumps) - 1)
+
+    def _advance_position(self, pos):
+        with self._position_lock:
+            if self._position is None or pos > self._position:
+                self._position = pos
+
+    def _set_position(self, pos):
+        with self._position_lock:
+            self._position = pos
+
+    def refresh_position(self):
+        """
+        Reread journal head position from the sequence.
+        Should be called when journal may be changed by another process.
+        """
 
-    def get_position(self, txn=None):
         seq = self.dbpool().action.sequence()
         pos = seq.stat().get("last_value", None)
         seq.close()
-        return pos
+
+        if not pos is None:
+            # never move head back: concurrent commit may be already observed
+            self._advance_position(pos)
+        return self._position
+
+    def get_position(self, txn=None):
+        return self._position
 
     def get_by_position(self, pos, txn=None):
         adb = self.dbpool().action.dbhandle()
-        return adb.get(str(pos), None, txn)
+        act = adb.get(self._make_key(pos), None, txn)
+        if act is None and not self._archive is None:
+            act = self._archive.get(pos)
+        return self._codec.decode(act)
+
+    def _get_live_range(self, from_pos, to_pos, txn=None):
+        """
+        Returns list of (position, record) from the journal database
+          with from_pos <= position <= to_pos.
+        """
 
-    def get_since_position(self, pos, number=None, txn=None):
         res = []
         adb = self.dbpool().action.dbhandle()
+
+        # service keys (sequence, format) are sorted after all position keys
+        last_key = self._make_key(to_pos)
+
+        with open_cursor(adb, txn) as c:
+            try:
+                kv = c.set_range(self._make_key(from_pos))
+            except database.bdb.DBNotFoundError:
+                kv = None
+
+            while kv and kv[0] <= last_key:
+                res.append((self._parse_key(kv[0]), kv[1]))
+                kv = c.next()
+
+        return res
+
+    def get_since_position(self, pos, number=None, txn=None):
         cur_pos = self.get_position(txn)
 
         if number is None:
@@ -176,16 +607,367 @@ class journal(object):
         else:
             last_pos = min(cur_pos, pos + number)
 
-        for key in range(pos + 1, last_pos + 1):
-            act = adb.get(str(key), None, txn)
+        if last_pos <= pos:
+            return []
+
+        records = []
+        if not self._archive is None:
+            first_live = self._get_first_live_position(txn)
+            if first_live is None or pos + 1 < first_live:
+                if not first_live is None:
+                    archive_last = min(last_pos, first_live - 1)
+                else:
+                    archive_last = last_pos
+                records = self._archive.get_range(pos + 1, archive_last)
+                if records:
+                    pos = records[-1][0]
+
+        if pos < last_pos:
+            records += self._get_live_range(pos + 1, last_pos, txn)
+
+        return [{"action": self._codec.decode(act), "position": act_pos}
+                for act_pos, act in records]
+
+    def _get_first_live_position(self, txn=None):
+        adb = self.dbpool().action.dbhandle()
+
+        with open_cursor(adb, txn) as c:
+            kv = c.first()
+
+        if not kv:
+            return None
+        return self._parse_key(kv[0])
+
+    def get_first_position(self, txn=None):
+        if not self._archive is None:
+            pos = self._archive.first_position()
+            if not pos is None:
+                return pos
+        return self._get_first_live_position(txn)
+
+    def _delete_live(self, pos, number=None, txn=None):
+        """
+        Delete records with positions less than pos from the journal database.
+        Returns list of deleted (position, record).
+        """
+
+        adb = self.dbpool().action.dbhandle()
+        bound_key = self._make_key(pos)
+        deleted = []
+
+        with open_cursor(adb, txn) as c:
+            kv = c.first()
+            while kv and kv[0] < bound_key:
+                if not number is None and len(deleted) >= number:
+                    break
+                c.delete()
+                deleted.append((self._parse_key(kv[0]), kv[1]))
+                kv = c.next()
+
+        return deleted
+
+    def truncate(self, pos, number=None, txn=None):
+        """
+        Delete journal records with positions less than pos.
+        At most number records deleted from the journal database
+          if number is given, archive segments are removed entirely.
+        Returns number of deleted records.
+        """
+
+        if not self._archive is None:
+            # segments are dropped entirely, records of the segment
+            #   holding pos are kept in archive and stay indexed
+            segments = self._archive.segments_below(pos)
+            for first, last in segments:
+                self._unindex_segment(first, last, txn)
+
+            if segments:
+                # removed files could not be restored on abort
+                database.on_commit(txn, self._archive.drop_below,
+                                   segments[-1][1] + 1)
+
+        deleted = self._delete_live(pos, number, txn)
+        for act_pos, act_dump in deleted:
+            self._unindex_action(act_pos, self._codec.decode(act_dump), txn)
+
+        return len(deleted)
+
+    def _unindex_segment(self, first, last, txn):
+        """
+        Remove index entries of archive segment [first, last].
+        """
+
+        keys = self._archive.segment_keys(first, last)
+        if keys is None:
+            # segment archived without index keys
+            for act_pos, act_dump in self._archive.get_range(first, last):
+                self._unindex_action(act_pos, self._codec.decode(act_dump), txn)
+            return
+
+        idb = self.dbpool().action_index.dbhandle()
+        last_key = self._make_key(last)
+
+        with open_cursor(idb, txn) as c:
+            for key in keys:
+                try:
+                    kv = c.get(key, self._make_key(first),
+                               database.bdb.DB_GET_BOTH_RANGE)
+                except database.bdb.DBNotFoundError:
+                    kv = None
+
+                while kv and kv[1] <= last_key:
+                    c.delete()
+                    kv = c.get('', '', database.bdb.DB_NEXT_DUP)
+
+    def archive_enabled(self):
+        return not self._archive is None
+
+    def archive_path(self):
+        if self._archive is None:
+            return None
+        return self._archive.path()
+
+    def archive(self):
+        """
+        Move the oldest segment of records outside of live window
+          from the journal database into archive.
+        Returns number of archived records.
+        """
+
+        if self._archive is None:
+            return 0
+
+        archive_last = self._archive.last_position()
+        if not archive_last is None:
+            # records may be left in database if previous run was interrupted
+            #   after segment written
+            with self._database.transaction() as txn:
+                self._delete_live(archive_last + 1, txn=txn)
+
+        head = self.get_position()
+        first_live = self._get_first_live_position()
+        if head is None or first_live is None:
+            return 0
+
+        last = min(head - self._archive_live_window,
+                   first_live + self._archive_segment_size - 1)
+        if last - first_live + 1 < self._archive_segment_size:
+            return 0
+
+        with self._database.transaction() as txn:
+            records = self._get_live_range(first_live, last, txn)
+
+        if not records:
+            return 0
+
+        keys = set()
+        for pos, act_dump in records:
+            act = self._unserialize_for_index(pos, self._codec.decode(act_dump), None)
             if not act is None:
-                res.append({"action": act, "position": key})
+                keys.update(self._index_keys(act))
 
-        return res
+        self._archive.append(records, sorted(keys))
+
+        with self._database.transaction() as txn:
+            self._delete_live(records[-1][0] + 1, txn=txn)
+
+        log.msg("Journal records [{0}, {1}] archived".format(records[0][0],
+                                                             records[-1][0]))
+        return len(records)
 
     def position_exists(self, pos, txn=None):
         adb = self.dbpool().action.dbhandle()
-        return adb.exists(str(pos), txn)
+        if adb.exists(self._make_key(pos), txn):
+            return True
+        return not self._archive is None and not self._archive.get(pos) is None
+
+    def _build_index(self):
+        """
+        One-time indexing of records journaled before index was introduced.
+        """
+
+        adb = self.dbpool().action.dbhandle()
+        if adb.get(self.INDEX_VERSION_KEY, None) == self.INDEX_VERSION:
+            return
+
+        log.msg("Building action journal index")
+
+        pos = self.get_first_position()
+        if not pos is None:
+            pos -= 1
+            while True:
+                with self._database.transaction() as txn:
+                    records = self.get_since_position(pos, self.MIGRATION_BATCH_SIZE,
+                                                      txn)
+                    for rec in records:
+                        self._index_action(rec["position"], rec["action"], txn)
+
+                if not records:
+                    break
+                pos = records[-1]["position"]
+
+        with self._database.transaction() as txn:
+            adb.put(self.INDEX_VERSION_KEY, self.INDEX_VERSION, txn)
+
+        log.msg("Action journal index built")
+
+    def zone_index_key(self, zone):
+        return self.INDEX_DELIMITER.join([self.INDEX_ZONE_PREFIX, zone])
+
+    def segment_index_key(self, arena, segment):
+        return self.INDEX_DELIMITER.join([self.INDEX_SEGMENT_PREFIX, arena, segment])
+
+    def arena_index_key(self, arena):
+        return self.INDEX_DELIMITER.join([self.INDEX_ARENA_PREFIX, arena])
+
+    def _index_keys(self, act):
+        """
+        Returns index keys of resources touched by action: zone for zone
+          and record actions, segment and arena for structural actions.
+        """
+
+        keys = []
+        arena = getattr(act, "arena", None)
+        segment = getattr(act, "segment", None)
+        zone = getattr(act, "zone", None)
+
+        if not zone is None:
+            keys.append(self.zone_index_key(zone))
+
+        if not arena is None:
+            if not segment is None:
+                keys.append(self.segment_index_key(arena, segment))
+            if zone is None:
+                keys.append(self.arena_index_key(arena))
+
+        target = getattr(act, "target", None)
+        if not target is None:
+            keys.append(self.arena_index_key(target))
+
+        return keys
+
+    def _unserialize_for_index(self, pos, act_dump, act):
+        if not act is None:
+            return act
+
+        try:
+            return Action.unserialize(act_dump, trusted=True)
+        except:
+            log.err("Unable to index journal record at position {0}".format(pos))
+            return None
+
+    def _index_action(self, pos, act_dump, txn, act=None):
+        act = self._unserialize_for_index(pos, act_dump, act)
+        if act is None:
+            return
+
+        idb = self.dbpool().action_index.dbhandle()
+        pos_key = self._make_key(pos)
+        for key in self._index_keys(act):
+            try:
+                idb.put(key, pos_key, txn, database.bdb.DB_NODUPDATA)
+            except database.bdb.DBKeyExistError:
+                # already indexed (rebuild after restart)
+                pass
+
+    def _unindex_action(self, pos, act_dump, txn):
+        act = self._unserialize_for_index(pos, act_dump, None)
+        if act is None:
+            return
+
+        idb = self.dbpool().action_index.dbhandle()
+        pos_key = self._make_key(pos)
+        for key in self._index_keys(act):
+            bdb_helpers.delete_pair(idb, key, pos_key, txn)
+
+    def get_index_positions(self, key, from_pos=0, to_pos=None, txn=None):
+        """
+        Returns sorted positions of records touching resource with index key
+          with from_pos < position <= to_pos.
+        """
+
+        res = []
+        idb = self.dbpool().action_index.dbhandle()
+
+        with open_cursor(idb, txn) as c:
+            kv = c.get(key, self._make_key(from_pos + 1), database.bdb.DB_GET_BOTH_RANGE)
+            while kv:
+                pos = self._parse_key(kv[1])
+                if not to_pos is None and pos > to_pos:
+                    break
+                res.append(pos)
+                kv = c.get('', '', database.bdb.DB_NEXT_DUP)
+
+        return res
+
+    def get_history(self, key, from_pos=0, to_pos=None, txn=None):
+        """
+        Returns records touching resource with index key
+          with from_pos < position <= to_pos.
+        """
+
+        res = []
+        for pos in self.get_index_positions(key, from_pos, to_pos, txn):
+            act = self.get_by_position(pos, txn)
+            if not act is None:
+                res.append({"action": act, "position": pos})
+        return res
+
+    def get_zone_history(self, zone, from_pos=0, to_pos=None, txn=None):
+        return self.get_history(self.zone_index_key(zone), from_pos, to_pos, txn)
+
+    def get_zone_diff(self, zone, from_pos=0, to_pos=None, txn=None):
+        """
+        Returns net changes of zone between positions:
+          added and deleted lists of {"name", "data"} action descriptions.
+        Add and delete actions of the same resource cancel each other.
+        """
+
+        # identity => [net counter, last action]
+        changes = {}
+        order = []
+
+        for rec in self.get_zone_history(zone, from_pos, to_pos, txn):
+            act = Action.unserialize(rec["action"], trusted=True)
+            name = act.name()
+
+            if name.startswith("Add"):
+                step = 1
+                del_name = "Del" + name[3:]
+            elif name.startswith("Del"):
+                step = -1
+                del_name = name
+            else:
+                continue
+
+            # identity is built from delete action data:
+            #   add action may contain additional data (ttl etc)
+            del_cls = Action.registered_actions.get(del_name, None)
+            if del_cls is None:
+                continue
+
+            data = act.data()
+            identity_data = del_cls(**data).data()
+            identity_data.pop("dbstate", None)
+            identity = (del_name, tuple(sorted(identity_data.items())))
+
+            if not changes.has_key(identity):
+                changes[identity] = [0, None]
+                order.append(identity)
+
+            changes[identity][0] += step
+            data.pop("dbstate", None)
+            changes[identity][1] = {"name": name, "data": data}
+
+        res = {"added": [], "deleted": []}
+        for identity in order:
+            counter, desc = changes[identity]
+            if counter > 0:
+                res["added"].append(desc)
+            elif counter < 0:
+                res["deleted"].append(desc)
+
+        return res
 
 
 # vim:sts=4:ts=4:sw=4:expandtab:
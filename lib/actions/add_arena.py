@@ -11,6 +11,9 @@ __all__ = ['AddArena']
 
 @Action.register_action
 class AddArena(Action, Dbstate):
+    ACTION_ID = 1
+    FIELDS = (('arena', str), ('key', str))
+
     def __init__(self, **kwargs):
         super(AddArena, self).__init__(**kwargs)
         self.arena = self.required_data_by_key(kwargs, 'arena', str)
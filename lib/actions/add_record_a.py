@@ -9,6 +9,8 @@ __all__ = ['AddRecord_A']
 
 @Action.register_action
 class AddRecord_A(RecordAction):
+    ACTION_ID = 7
+    FIELDS = (('host', str), ('ip', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
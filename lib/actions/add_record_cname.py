@@ -9,6 +9,8 @@ __all__ = ['AddRecord_CNAME']
 
 @Action.register_action
 class AddRecord_CNAME(RecordAction):
+    ACTION_ID = 11
+    FIELDS = (('host', str), ('domain', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,8 @@ __all__ = ['AddRecord_DNAME']
 
 @Action.register_action
 class AddRecord_DNAME(RecordAction):
+    ACTION_ID = 13
+    FIELDS = (('zone_dst', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,8 @@ __all__ = ['AddRecord_MX']
 
 @Action.register_action
 class AddRecord_MX(RecordAction):
+    ACTION_ID = 15
+    FIELDS = (('domain', str), ('priority', int), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add MX record {}: {reason}"
     PRIORITY_DEFAULT = 20
 
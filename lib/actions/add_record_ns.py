@@ -9,6 +9,8 @@ __all__ = ['AddRecord_NS']
 
 @Action.register_action
 class AddRecord_NS(RecordAction):
+    ACTION_ID = 17
+    FIELDS = (('domain', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
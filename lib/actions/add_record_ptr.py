@@ -9,6 +9,8 @@ __all__ = ['AddRecord_PTR']
 
 @Action.register_action
 class AddRecord_PTR(RecordAction):
+    ACTION_ID = 9
+    FIELDS = (('host', str), ('domain', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,10 @@ __all__ = ['AddRecord_SOA']
 
 @Action.register_action
 class AddRecord_SOA(RecordAction):
+    ACTION_ID = 19
+    FIELDS = (('primary_ns', str), ('resp_person', str), ('serial', int),
+              ('refresh', int), ('retry', int), ('expire', int), ('minimum', int),
+              ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,9 @@ __all__ = ['AddRecord_SRV']
 
 @Action.register_action
 class AddRecord_SRV(RecordAction):
+    ACTION_ID = 21
+    FIELDS = (('priority', int), ('weight', int), ('service', str), ('port', int),
+              ('domain', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
     PRIORITY_DEFAULT = 10
     WEIGHT_DEFAULT = 1
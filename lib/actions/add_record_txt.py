@@ -9,6 +9,8 @@ __all__ = ['AddRecord_TXT']
 
 @Action.register_action
 class AddRecord_TXT(RecordAction):
+    ACTION_ID = 23
+    FIELDS = (('text', str), ('ttl', int))
     ERROR_MSG_TEMPLATE = "unable to add record {}: {reason}"
 
     def __init__(self, **kwargs):
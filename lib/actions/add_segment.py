@@ -11,6 +11,8 @@ __all__ = ['AddSegment']
 
 @Action.register_action
 class AddSegment(Action, Dbstate):
+    ACTION_ID = 3
+    FIELDS = (('arena', str), ('segment', str))
     ERROR_MSG_TEMPLATE = "unable to add segment {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -18,8 +20,8 @@ class AddSegment(Action, Dbstate):
         self.arena = self.required_data_by_key(kwargs, 'arena', str)
         self.segment = self.required_data_by_key(kwargs, 'segment', str)
 
-    def _current_dbstate(self, database, txn):
-        return self.get_arena(self.arena, database, txn)
+    def _current_dbstate(self, database, txn, **kwargs):
+        return self.get_arena(self.arena, database, txn, **kwargs)
 
     def _do_apply(self, database, txn):
         adb = database.dbpool().arena.dbhandle()
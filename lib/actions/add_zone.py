@@ -12,6 +12,8 @@ __all__ = ['AddZone']
 
 @Action.register_action
 class AddZone(Action, Dbstate):
+    ACTION_ID = 5
+    FIELDS = (('arena', str), ('segment', str), ('zone', str))
     ERROR_MSG_TEMPLATE = "unable to add zone {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -20,8 +22,8 @@ class AddZone(Action, Dbstate):
         self.segment = self.required_data_by_key(kwargs, 'segment', str)
         self.zone = self.required_data_by_key(kwargs, 'zone', str)
 
-    def _current_dbstate(self, database, txn):
-        return self.get_segment(self.arena, self.segment, database, txn)
+    def _current_dbstate(self, database, txn, **kwargs):
+        return self.get_segment(self.arena, self.segment, database, txn, **kwargs)
 
     def _do_apply(self, database, txn):
         adb = database.dbpool().arena.dbhandle()
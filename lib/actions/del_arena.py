@@ -12,6 +12,9 @@ __all__ = ['DelArena']
 
 @Action.register_action
 class DelArena(Action, Dbstate):
+    ACTION_ID = 2
+    FIELDS = (('arena', str),)
+
     def __init__(self, **kwargs):
         super(DelArena, self).__init__(**kwargs)
         self.arena = self.required_data_by_key(kwargs, 'arena', str)
@@ -19,8 +22,8 @@ class DelArena(Action, Dbstate):
         if self.arena == ADMIN_ARENA_NAME:
             raise ActionError("arena name '{}' is not allowed".format(self.arena))
 
-    def _current_dbstate(self, database, txn):
-        return self.get_global(database, txn)
+    def _current_dbstate(self, database, txn, **kwargs):
+        return self.get_global(database, txn, **kwargs)
 
     def _do_apply(self, database, txn):
         adb = database.dbpool().arena.dbhandle()
@@ -38,8 +41,7 @@ class DelArena(Action, Dbstate):
             raise ActionError("unable to delete arena {}: "
                               "arena doesn't exist".format(self.desc()))
 
-        self.del_arena(self.arena, database, txn)
-        self.update_global(database, txn)
+        self.remove_arena(self.arena, database, txn)
 
     def desc(self):
         return "{{arena='{}'}}".format(self.arena)
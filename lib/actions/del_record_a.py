@@ -9,6 +9,8 @@ __all__ = ['DelRecord_A']
 
 @Action.register_action
 class DelRecord_A(RecordAction):
+    ACTION_ID = 8
+    FIELDS = (('host', str), ('ip', str))
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,8 @@ __all__ = ['DelRecord_CNAME']
 
 @Action.register_action
 class DelRecord_CNAME(RecordAction):
+    ACTION_ID = 12
+    FIELDS = (('host', str), ('domain', str))
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,8 @@ __all__ = ['DelRecord_DNAME']
 
 @Action.register_action
 class DelRecord_DNAME(RecordAction):
+    ACTION_ID = 14
+    FIELDS = (('zone_dst', str),)
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
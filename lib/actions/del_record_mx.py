@@ -9,6 +9,8 @@ __all__ = ['DelRecord_MX']
 
 @Action.register_action
 class DelRecord_MX(RecordAction):
+    ACTION_ID = 16
+    FIELDS = (('domain', str),)
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
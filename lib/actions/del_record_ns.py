@@ -9,6 +9,8 @@ __all__ = ['DelRecord_NS']
 
 @Action.register_action
 class DelRecord_NS(RecordAction):
+    ACTION_ID = 18
+    FIELDS = (('domain', str),)
     ERROR_MSG_TEMPLATE = "unable to delete NS record {}: {reason}"
 
     def __init__(self, **kwargs):
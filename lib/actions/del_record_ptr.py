@@ -9,6 +9,8 @@ __all__ = ['DelRecord_PTR']
 
 @Action.register_action
 class DelRecord_PTR(RecordAction):
+    ACTION_ID = 10
+    FIELDS = (('host', str), ('domain', str))
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,7 @@ __all__ = ['DelRecord_SOA']
 
 @Action.register_action
 class DelRecord_SOA(RecordAction):
+    ACTION_ID = 20
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -9,6 +9,8 @@ __all__ = ['DelRecord_SRV']
 
 @Action.register_action
 class DelRecord_SRV(RecordAction):
+    ACTION_ID = 22
+    FIELDS = (('service', str), ('port', int), ('domain', str))
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
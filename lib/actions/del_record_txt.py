@@ -9,6 +9,8 @@ __all__ = ['DelRecord_TXT']
 
 @Action.register_action
 class DelRecord_TXT(RecordAction):
+    ACTION_ID = 24
+    FIELDS = (('text', str),)
     ERROR_MSG_TEMPLATE = "unable to delete record {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -11,6 +11,8 @@ __all__ = ['DelSegment']
 
 @Action.register_action
 class DelSegment(Action, Dbstate):
+    ACTION_ID = 4
+    FIELDS = (('arena', str), ('segment', str))
     ERROR_MSG_TEMPLATE = "unable to delete segment {}: {reason}"
 
     def __init__(self, **kwargs):
@@ -18,8 +20,8 @@ class DelSegment(Action, Dbstate):
         self.arena = self.required_data_by_key(kwargs, 'arena', str)
         self.segment = self.required_data_by_key(kwargs, 'segment', str)
 
-    def _current_dbstate(self, database, txn):
-        return self.get_arena(self.arena, database, txn)
+    def _current_dbstate(self, database, txn, **kwargs):
+        return self.get_arena(self.arena, database, txn, **kwargs)
 
     def _do_apply(self, database, txn):
         adb = database.dbpool().arena.dbhandle()
@@ -37,8 +39,7 @@ class DelSegment(Action, Dbstate):
         else:
             raise ActionError(self._make_error_msg("segment doesn't exist"))
 
-        self.del_segment(self.arena, self.segment, database, txn)
-        self.update_arena(self.arena, database, txn)
+        self.remove_segment(self.arena, self.segment, database, txn)
 
     def _make_error_msg(self, reason):
         return self.ERROR_MSG_TEMPLATE.format(self.desc(), reason=reason)
@@ -12,20 +12,22 @@ __all__ = ['DelZone']
 
 @Action.register_action
 class DelZone(Action, Dbstate):
+    ACTION_ID = 6
+    FIELDS = (('zone', str),)
     ERROR_MSG_TEMPLATE = "unable to delete zone {}: {reason}"
 
     def __init__(self, **kwargs):
         super(DelZone, self).__init__(**kwargs)
         self.zone = self.required_data_by_key(kwargs, 'zone', str)
 
-    def _current_dbstate(self, database, txn):
+    def _current_dbstate(self, database, txn, **kwargs):
         zdb = database.dbpool().dns_zone.dbhandle()
         arena_segment = zdb.get(reorder(self.zone), None, txn)
         if arena_segment:
             as_list = arena_segment.split(' ', 1)
             if len(as_list) == 2:
                 arena, segment = as_list
-                return self.get_segment(arena, segment, database, txn)
+                return self.get_segment(arena, segment, database, txn, **kwargs)
             else:
                 return None
         else:
@@ -48,12 +50,12 @@ class DelZone(Action, Dbstate):
         bdb_helpers.delete_pair(szdb, arena_segment, self.zone, txn)
         zdb.delete(zone_rname, txn)
 
-        self.del_zone(self.zone, database, txn)
-
         as_list = arena_segment.split(' ', 1)
         if len(as_list) == 2:
             arena, segment = as_list
-            self.update_segment(arena, segment, database, txn)
+            self.remove_zone(self.zone, arena, segment, database, txn)
+        else:
+            self.del_zone(self.zone, database, txn)
 
     def _make_error_msg(self, reason):
         return self.ERROR_MSG_TEMPLATE.format(self.desc(), reason=reason)
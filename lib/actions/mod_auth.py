@@ -9,6 +9,9 @@ __all__ = ['ModAuth']
 
 @Action.register_action
 class ModAuth(Action):
+    ACTION_ID = 25
+    FIELDS = (('target', str), ('key', str))
+
     def __init__(self, **kwargs):
         super(ModAuth, self).__init__(**kwargs)
         self.target = self.required_data_by_key(kwargs, 'target', str)
@@ -2,6 +2,7 @@
 
 from lib import database
 from lib import bdb_helpers
+from lib import record_index
 from lib.action import Action, ActionError
 from lib.dbstate import Dbstate
 from lib.common import reorder, split
@@ -16,23 +17,31 @@ class RecordAction(Action, Dbstate):
       * _is_record_equal -- record equality checker
     """
 
+    FIELDS = (('zone', str),)
+    # record_id is not a field: it is not serialized
+    __slots__ = ('zone', 'record_id')
+
     TTL_DEFAULT = 100
     ERROR_MSG_TEMPLATE = "An error occured in action {}: {reason}"
 
     def __init__(self, **kwargs):
         super(RecordAction, self).__init__(**kwargs)
         self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        # id of created record, known after apply
+        self.record_id = None
 
-    def _current_dbstate(self, database, txn):
-        return self.get_zone(self.zone, database, txn)
+    def _current_dbstate(self, database, txn, **kwargs):
+        return self.get_zone(self.zone, database, txn, **kwargs)
 
     def _create_rec(self, database, txn, host, ttl, rec_data, add_host=False):
         zdb = database.dbpool().dns_zone.dbhandle()
         self._check_zone(zdb, txn)
 
+        added = []
         if add_host:
             xdb = database.dbpool().dns_xfr.dbhandle()
-            self._add_host(xdb, txn, host)
+            if self._add_host(xdb, txn, host):
+                added.append(self.xfr_element(host))
 
         ddb = database.dbpool().dns_data.dbhandle()
         zddb = database.dbpool().zone_dns_data.dbhandle()
@@ -43,25 +52,28 @@ class RecordAction(Action, Dbstate):
             if self._is_record_equal(rlist):
                 raise ActionError(self._make_error_msg("record already exist"))
 
-        seq = database.dbpool().sequence.sequence("dns_data", txn=txn)
-        newid = seq.get(1, txn)
-        seq.close()
+        newid = database.dbpool().sequence.allocate("dns_data", txn=txn)
 
         raw_rec = " ".join([str(newid), "@", str(ttl), rec_data])
         ddb.put(dkey, raw_rec, txn)
+        record_index.add(database, raw_rec, dkey, txn)
+        self.record_id = newid
+        added.append(self.record_element(dkey, raw_rec))
 
         if not bdb_helpers.pair_exists(zddb, self.zone, dkey, txn):
             zddb.put(self.zone, dkey, txn)
 
-        self.update_zone(self.zone, database, txn)
+        self.change_zone(self.zone, database, txn, added=added)
 
     def _delete_rec(self, database, txn, host, del_host=False):
         zdb = database.dbpool().dns_zone.dbhandle()
         self._check_zone(zdb, txn)
 
+        removed = []
         if del_host:
             xdb = database.dbpool().dns_xfr.dbhandle()
-            self._del_host(xdb, txn, host)
+            if self._del_host(xdb, txn, host):
+                removed.append(self.xfr_element(host))
 
         ddb = database.dbpool().dns_data.dbhandle()
         zddb = database.dbpool().zone_dns_data.dbhandle()
@@ -73,6 +85,8 @@ class RecordAction(Action, Dbstate):
             if self._is_record_equal(rlist):
                 found = True
                 bdb_helpers.delete_pair(ddb, dkey, rec, txn)
+                record_index.remove(database, rec, txn)
+                removed.append(self.record_element(dkey, rec))
 
         if not found:
             raise ActionError(self._make_error_msg("record doesn't exist"))
@@ -80,7 +94,7 @@ class RecordAction(Action, Dbstate):
         if not ddb.exists(dkey, txn):
             bdb_helpers.delete_pair(zddb, self.zone, dkey, txn)
 
-        self.update_zone(self.zone, database, txn)
+        self.change_zone(self.zone, database, txn, removed=removed)
 
     def _check_zone(self, zdb, txn):
         zone_rname = reorder(self.zone)
@@ -91,11 +105,15 @@ class RecordAction(Action, Dbstate):
         hosts = bdb_helpers.get_all(xdb, self.zone, txn)
         if not host in hosts:
             xdb.put(self.zone, host, txn)
+            return True
+        return False
 
     def _del_host(self, xdb, txn, host):
         hosts = bdb_helpers.get_all(xdb, self.zone, txn)
         if host in hosts:
             bdb_helpers.delete_pair(xdb, self.zone, host, txn)
+            return True
+        return False
 
     def _make_error_msg(self, reason):
         return self.ERROR_MSG_TEMPLATE.format(self.desc(), reason=reason)
@@ -8,6 +8,9 @@ from lib.action import Action, ActionError
 from lib.network.sync.peer import Peer
 from lib.network.sync.protocol import SyncServerFactory
 from lib.common import retrieve_key
+from lib.bdb_helpers import delete
+from lib.dbstate import Dbstate, supported_versions
+from lib.db_durability import WORKLOAD_REPLICATION
 
 from twisted.internet import threads, reactor, task, endpoints
 from twisted.python import log
@@ -19,11 +22,37 @@ class SyncAppError(Exception): pass
 class SyncApp(object):
     ACTIONS_BATCH_SIZE = 50
 
+    RETENTION_PERIOD_DEFAULT = 60.0
+    RETENTION_WINDOW_DEFAULT = 10000
+    RETENTION_BATCH_SIZE_DEFAULT = 1000
+    ARCHIVE_PERIOD_DEFAULT = 60.0
+    DBSTATE_NEGOTIATION_PERIOD_DEFAULT = 60.0
+    STATS_PERIOD_DEFAULT = 3600.0
+
     DATABASES = {
+        # stores peer name => our position on that peer
         "peer": {
             "type": database.bdb.DB_BTREE,
             "flags": 0,
             "open_flags": database.bdb.DB_CREATE
+        },
+
+        # stores peer name => peer position on this server
+        #   (last position peer sent in pull request)
+        "peer_ack": {
+            "type": database.bdb.DB_BTREE,
+            "flags": 0,
+            "open_flags": database.bdb.DB_CREATE
+        },
+
+        # stores peer name => dbstate format of peer
+        #   "<active> <switch position or -> <maintained> ..."
+        #   (sent in pull request), and server name => switch position
+        #   (journal position after which actions have states of active format)
+        "peer_dbstate": {
+            "type": database.bdb.DB_BTREE,
+            "flags": 0,
+            "open_flags": database.bdb.DB_CREATE
         }
     }
 
@@ -45,9 +74,40 @@ class SyncApp(object):
         self._peers = {}
         self._dbpool = database.DatabasePool(self.DATABASES,
                                              self._database.dbenv(),
-                                             self._database.dbfile())
+                                             self._database.dbfile(),
+                                             tuning=self._database.tuning(),
+                                             layout=self._database.layout())
 
         self._pull_period = cfg.get('pull_period', 10.0)
+
+        retention = cfg.get('journal_retention', {})
+        self._retention_enabled = retention.get('enabled', False)
+        self._retention_period = retention.get('period',
+                                               self.RETENTION_PERIOD_DEFAULT)
+        self._retention_window = retention.get('window',
+                                               self.RETENTION_WINDOW_DEFAULT)
+        self._retention_batch_size = retention.get('batch_size',
+                                                   self.RETENTION_BATCH_SIZE_DEFAULT)
+        self._truncate_in_progress = False
+
+        self._archive_period = cfg.get('journal_archive_period',
+                                       self.ARCHIVE_PERIOD_DEFAULT)
+        self._archive_in_progress = False
+
+        self._dbstate_negotiation_period = cfg.get('dbstate_negotiation_period',
+                                    self.DBSTATE_NEGOTIATION_PERIOD_DEFAULT)
+        self._dbstate_negotiation_in_progress = False
+        # dbstate format version cluster should switch to,
+        #   format is not changed if unset
+        self._dbstate_format = cfg.get('dbstate_format', None)
+        if not self._dbstate_format is None and \
+           not self._dbstate_format in supported_versions():
+            raise self.cfg_failure("unsupported dbstate_format {0}".format(
+                                   self._dbstate_format))
+
+        # runtime statistics of the process are logged with this period
+        self._stats_period = cfg.get('stats_period', self.STATS_PERIOD_DEFAULT)
+
         transport_encrypt = cfg.get('transport-encrypt', True)
 
         # initialize server endpoint data
@@ -163,6 +223,40 @@ class SyncApp(object):
         l = task.LoopingCall(self.pull)
         l.start(self._pull_period)
 
+    def start_truncate(self):
+        if self._retention_enabled:
+            l = task.LoopingCall(self.truncate_journal)
+            l.start(self._retention_period)
+
+    def start_archive(self):
+        if self._action_journal.archive_enabled():
+            l = task.LoopingCall(self.archive_journal)
+            l.start(self._archive_period)
+
+    def start_dbstate_negotiation(self):
+        if self._dbstate_format is None:
+            return
+        l = task.LoopingCall(self.negotiate_dbstate)
+        l.start(self._dbstate_negotiation_period)
+
+    def start_stats_report(self):
+        l = task.LoopingCall(self.report_stats)
+        l.start(self._stats_period, now=False)
+
+    def report_stats(self):
+        """
+        Log runtime statistics of sync process, they are not seen
+          by other processes sharing the database.
+        """
+
+        stats = self._database.retry_stats()
+        log.msg("Transaction retries: {0}".format(", ".join(
+                ["{0}={1}".format(k, stats[k]) for k in sorted(stats)])))
+
+        profiler = self._database.profiler()
+        if not profiler is None:
+            profiler.report()
+
     def make_service(self):
         return Peer.make_service(self._endpoint_data, self._client_connected)
 
@@ -232,17 +326,26 @@ class SyncApp(object):
 
 
     def _client_pull_request_handler(self, position, peer):
-        d = threads.deferToThread(self._do_retrieve_actions, position, peer)
+        dbstate_format = peer.server.service.dbstate_format
+        d = threads.deferToThread(self._do_retrieve_actions, position, peer,
+                                  dbstate_format)
         d.addCallback(self._actions_retrieved, position, peer)
         d.addErrback(self._errback, "Error while retrieving actions for peer "
                                     "'{0}' from position {1}".format(
                                     peer.name, position))
 
-    def _do_retrieve_actions(self, position, peer):
+    def _do_retrieve_actions(self, position, peer, dbstate_format):
         log.msg("Retrieving actions for peer '{0}' from position {1}".format(
                 peer.name, position))
 
-        with self._database.transaction() as txn:
+        padb = self._dbpool.peer_ack.dbhandle()
+        pddb = self._dbpool.peer_dbstate.dbhandle()
+
+        with self._database.transaction(workload=WORKLOAD_REPLICATION) as txn:
+            # peer has all actions up to this position
+            padb.put(peer.name, str(position), txn)
+            pddb.put(peer.name, self._format_dbstate_info(dbstate_format), txn)
+
             cur_pos = self._action_journal.get_position(txn)
             if cur_pos == position:
                 return (cur_pos, [])
@@ -282,12 +385,234 @@ class SyncApp(object):
 
 
 
+    def truncate_journal(self):
+        """
+        Initiate deletion of journal records already pulled by all peers.
+        Method do not blocks.
+        """
+
+        if self._truncate_in_progress:
+            return
+
+        self._truncate_in_progress = True
+
+        def done(res):
+            self._truncate_in_progress = False
+            return res
+
+        d = threads.deferToThread(self._do_truncate_journal)
+        d.addBoth(done)
+        d.addErrback(self._errback, "Error while truncating action journal")
+
+    def archive_journal(self):
+        """
+        Initiate moving old journal records into archive segments.
+        Method do not blocks.
+        """
+
+        if self._archive_in_progress:
+            return
+
+        self._archive_in_progress = True
+
+        def done(res):
+            self._archive_in_progress = False
+            return res
+
+        d = threads.deferToThread(self._action_journal.archive)
+        d.addBoth(done)
+        d.addErrback(self._errback, "Error while archiving action journal")
+
+    def _get_min_ack_position(self):
+        """
+        Blocking call to DB, should be called from thread pool.
+        Returns the lowest position pulled by configured peers or None
+          if some peer has never sent pull request.
+        """
+
+        padb = self._dbpool.peer_ack.dbhandle()
+
+        min_pos = None
+        for pname in self._peers:
+            pos = padb.get(pname, None)
+            if pos is None:
+                return None
+
+            pos = int(pos)
+            if min_pos is None or pos < min_pos:
+                min_pos = pos
+
+        return min_pos
+
+    def _do_truncate_journal(self):
+        """
+        Blocking call to DB, should be called from thread pool.
+        """
+
+        min_pos = self._get_min_ack_position()
+        if min_pos is None:
+            log.msg("Journal truncation skipped: not all peers acknowledged position")
+            return 0
+
+        bound = min_pos - self._retention_window
+        if bound <= 0:
+            return 0
+
+        deleted = 0
+        while True:
+            with self._database.transaction() as txn:
+                number = self._action_journal.truncate(bound,
+                                                       self._retention_batch_size,
+                                                       txn)
+            deleted += number
+            if number < self._retention_batch_size:
+                break
+
+        if deleted:
+            log.msg("Journal truncated below position {0}: {1} records deleted".format(
+                    bound, deleted))
+
+        return deleted
+
+    @staticmethod
+    def _format_dbstate_info(info):
+        """
+        Serialize dbstate format info sent in pull request,
+          peers without it have only format 1.
+        """
+
+        if info is None:
+            info = {}
+        position = info.get("position", None)
+        return " ".join([str(info.get("active", 1)),
+                         "-" if position is None else str(position)] +
+                        [str(v) for v in info.get("maintained", [1])])
+
+    @staticmethod
+    def _parse_dbstate_info(value):
+        values = value.split()
+        return {
+            "active": int(values[0]),
+            "position": None if values[1] == "-" else int(values[1]),
+            "maintained": [int(v) for v in values[2:]]
+        }
+
+    def _dbstate_switch_position(self, txn=None):
+        pddb = self._dbpool.peer_dbstate.dbhandle()
+        position = pddb.get(self._name, None, txn)
+        return None if position is None else int(position)
+
+    def _get_dbstate_info(self):
+        """
+        Blocking call to DB, should be called from thread pool.
+        Returns dbstate format info of this server sent to peers.
+        """
+
+        dbstate = Dbstate()
+        with self._database.transaction() as txn:
+            return {
+                "active": dbstate.format_version(self._database, txn)[0],
+                "maintained": dbstate.ready_versions(self._database, txn),
+                "position": self._dbstate_switch_position(txn)
+            }
+
+    def negotiate_dbstate(self):
+        """
+        Make next step of switching dbstate format of cluster
+          to configured one.
+        Method do not blocks.
+        """
+
+        if self._dbstate_negotiation_in_progress:
+            return
+
+        self._dbstate_negotiation_in_progress = True
+
+        def done(res):
+            self._dbstate_negotiation_in_progress = False
+            return res
+
+        d = threads.deferToThread(self._do_negotiate_dbstate)
+        d.addBoth(done)
+        d.addErrback(self._errback, "Error while negotiating dbstate format")
+
+    def _do_negotiate_dbstate(self):
+        """
+        Blocking call to DB, should be called from thread pool.
+        Peer verifies pulled action against state of format the action
+          was made with, so format is switched in steps:
+          - states of new format are computed and maintained along
+            with old ones;
+          - new format becomes active when all peers maintain it,
+            journal position of switch is recorded and sent to peers;
+          - old formats are dropped when all peers have new format active
+            and their actions up to switch position are pulled.
+        Returns configured format version if it is active, None otherwise.
+        """
+
+        version = self._dbstate_format
+        dbstate = Dbstate()
+        if not version in dbstate.ready_versions(self._database):
+            dbstate.prepare(self._database, version)
+            return None
+
+        pdb = self._dbpool.peer.dbhandle()
+        pddb = self._dbpool.peer_dbstate.dbhandle()
+        peers = {}
+        for pname in self._peers:
+            value = pddb.get(pname, None)
+            peers[pname] = None if value is None else self._parse_dbstate_info(value)
+
+        active, maintained = dbstate.format_version(self._database)
+        if active != version:
+            waiting = [pname for pname, info in peers.iteritems()
+                       if info is None or not version in info["maintained"]]
+            if waiting:
+                log.msg("Dbstate format {0} is not maintained by peers: {1}".format(
+                        version, ", ".join(sorted(waiting))))
+                return None
+
+            with self._database.transaction() as txn:
+                dbstate.activate(self._database, version, txn)
+                delete(pddb, self._name, txn)
+
+        # transactions which made actions with states of old format
+        #   hold lock of format marker, so they are committed before
+        #   activation and their actions are below this position
+        if self._dbstate_switch_position() is None:
+            position = self._action_journal.refresh_position()
+            with self._database.transaction() as txn:
+                pddb.put(self._name, str(position), txn)
+            log.msg("Dbstate format {0} is active since position {1}".format(
+                    version, position))
+
+        if len(maintained) > 1:
+            waiting = []
+            for pname, info in peers.iteritems():
+                if info is None or info["active"] != version or \
+                   info["position"] is None or \
+                   int(pdb.get(pname, 0)) < info["position"]:
+                    waiting.append(pname)
+            if waiting:
+                log.msg("Actions with old dbstate formats are not pulled "
+                        "from peers: {0}".format(", ".join(sorted(waiting))))
+                return version
+
+            dbstate.retire(self._database)
+
+        return version
+
+
     def pull(self):
         """
         Initiate pull requests to all known cluster peers.
         Method do not blocks.
         """
 
+        # fallback for missed database update signals
+        d = threads.deferToThread(self._action_journal.refresh_position)
+        d.addErrback(self._errback, "Error while refreshing journal position")
+
         for _, pdesc in self._peers.iteritems():
             peer = pdesc["peer"]
 
@@ -360,14 +685,16 @@ class SyncApp(object):
             pos = int(pos)
         except:
             pos = 0
-        return pos
+        return (pos, self._get_dbstate_info())
 
-    def _got_peer_position(self, pos, peer):
+    def _got_peer_position(self, res, peer):
         if peer.client is None:
             return
 
+        pos, dbstate_format = res
         log.msg("Got server position on peer '{0}': {1}".format(peer.name, pos))
-        peer.client.service.send_pull_request(pos)
+        peer.client.service.send_pull_request(pos, supported_versions(),
+                                              dbstate_format)
         d = peer.client.service.register_event('actions_received')
         d.addCallback(self._on_actions_received, peer, pos)
 
@@ -388,15 +715,53 @@ class SyncApp(object):
                                         "'{0}'".format(peer.name))
 
     def _do_apply_actions(self, actions, peer):
+        """
+        Apply batch of actions in single transaction, so dbstates are
+          updated once per batch. If the batch fails for any reason, actions
+          are reapplied one per transaction to keep the progress before
+          failure, the failing action is logged and its error is raised.
+        """
+
         log.msg("Applying actions from peer '{0}'".format(peer.name))
         pdb = self._dbpool.peer.dbhandle()
-        for act_desc in actions:
-            act_dump = act_desc["action"]
-            act = Action.unserialize(act_dump)
-            pos = act_desc["position"]
-            with self._database.transaction() as txn:
+        if not actions:
+            return
+
+        # deadlocked transactions are retried, actions of aborted
+        #   transaction may keep target dbstate of it, so they are
+        #   unserialized anew on every try
+        def apply_batch(txn):
+            for act_desc in actions:
+                act = Action.unserialize(act_desc["action"], trusted=True)
                 act.apply(self._database, txn)
-                pdb.put(peer.name, str(pos), txn)
+            pdb.put(peer.name, str(actions[-1]["position"]), txn)
+
+        def apply_one(txn, act_desc):
+            act = Action.unserialize(act_desc["action"], trusted=True)
+            act.apply(self._database, txn)
+            pdb.put(peer.name, str(act_desc["position"]), txn)
+
+        try:
+            self._database.run_transaction(apply_batch, name="sync.apply_actions",
+                                           workload=WORKLOAD_REPLICATION)
+            return
+        except ActionError:
+            log.msg("Batch of actions from peer '{0}' failed, applying "
+                    "one by one".format(peer.name))
+        except Exception as e:
+            log.err("Batch of actions from peer '{0}' failed, applying "
+                    "one by one".format(peer.name))
+            log.err(e)
+
+        for act_desc in actions:
+            try:
+                self._database.run_transaction(apply_one, act_desc,
+                                               name="sync.apply_action",
+                                               workload=WORKLOAD_REPLICATION)
+            except:
+                log.err("Unable to apply action at position {0} from peer "
+                        "'{1}'".format(act_desc["position"], peer.name))
+                raise
 
     def _actions_applied(self, _, peer):
         self._do_pull_request(peer)
@@ -410,6 +775,12 @@ class SyncApp(object):
 
 
     def database_updated(self):
+        # journal may be written by another process (user_apid)
+        d = threads.deferToThread(self._action_journal.refresh_position)
+        d.addCallback(lambda _: self._update_active_peers())
+        d.addErrback(self._errback, "Error while refreshing journal position")
+
+    def _update_active_peers(self):
         log.msg("Updating active peers:", self._active_peers)
         while self._active_peers:
             peer, pos = self._active_peers.pop(0)
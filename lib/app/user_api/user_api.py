@@ -6,6 +6,7 @@ import signal
 from lib import database
 from lib import session
 from lib import lock
+from lib import backup
 from lib.network.user_api.resources import *
 from lib.operations import *
 from lib.common import retrieve_key
@@ -49,6 +50,10 @@ class UserApiApp(object):
         root.putChild('get_segments', GetSegmentsResource(self._sp))
         root.putChild('get_zones', GetZonesResource(self._sp))
         root.putChild('get_records', GetRecordsResource(self._sp))
+        root.putChild('get_record', GetRecordResource(self._sp))
+        root.putChild('get_zone_history', GetZoneHistoryResource(self._sp))
+        root.putChild('backup', BackupResource(self._sp))
+        root.putChild('get_stats', GetStatsResource(self._sp))
         root.putChild('begin_session', BeginSessionResource(self._sp))
         root.putChild('rollback_session', RollbackSessionResource(self._sp))
         root.putChild('keepalive_session', KeepaliveSessionResource(self._sp))
@@ -77,6 +82,12 @@ class UserApiApp(object):
         self.add_database_change_resource(
             root, 'del_record', DelRecordResource(self._sp)
         )
+        self.add_database_change_resource(
+            root, 'del_record_by_id', DelRecordByIdResource(self._sp)
+        )
+        self.add_database_change_resource(
+            root, 'mod_record', ModRecordResource(self._sp)
+        )
         self.add_database_change_resource(
             root, 'commit_session', CommitSessionResource(self._sp)
         )
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import shutil
+
+from twisted.python import log
+
+from lib import database
+from lib.service import ServiceProvider
+from lib.action import journal
+from lib.journal_archive import Segment
+from lib.backup_lock import BackupLock
+from lib.db_layout import Layout
+
+
+class BackupError(Exception): pass
+
+
+@ServiceProvider.register("backup", deps=["database", "action_journal"])
+class manager(object):
+    """
+    Class used to take consistent copies of the database environment
+      while it is used by other threads and processes.
+    Data files are copied first, then all log files, then catastrophic
+      recovery is run on the copy, so the copy is consistent as of
+      the end of the last copied log. Writers are never blocked.
+    Removal of log files waits while files are copied (see lib.backup_lock).
+    Journal position and layout of the copy are stored in info file,
+      the copy may be used to seed a new node (see tools/backup.py).
+    """
+
+    BACKUP_DIR_DEFAULT = "/var/backups/dns_cluster"
+    INFO_FILENAME = "backup.info"
+    JOURNAL_ARCHIVE_DIRNAME = "journal_archive"
+    NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+    # multiple of any database page size
+    COPY_BUFFER_SIZE = 1 << 16
+
+    RECOVERY_FLAGS = (database.bdb.DB_CREATE | database.bdb.DB_INIT_MPOOL |
+                      database.bdb.DB_INIT_LOCK | database.bdb.DB_INIT_LOG |
+                      database.bdb.DB_INIT_TXN | database.bdb.DB_RECOVER_FATAL)
+
+    def __init__(self, sp, *args, **kwargs):
+        self._database = sp.get('database')
+        self._action_journal = sp.get('action_journal')
+        self._backup_dir = kwargs.get("backup_dir", self.BACKUP_DIR_DEFAULT)
+
+    def backup_path(self, name):
+        if not self.NAME_RE.match(name):
+            raise BackupError("Wrong backup name '{0}'".format(name))
+        return os.path.join(self._backup_dir, name)
+
+    def backup(self, name=None):
+        """
+        Blocking call, should be called from thread pool.
+        Copy environment into backup directory named name
+          (current time by default).
+        Returns backup info dict.
+        """
+
+        if name is None:
+            name = time.strftime("%Y%m%d-%H%M%S")
+
+        dest = self.backup_path(name)
+        if os.path.exists(dest):
+            raise BackupError("Backup '{0}' already exists".format(name))
+        os.makedirs(dest)
+
+        try:
+            started = time.time()
+            log.msg("Taking backup '{0}'".format(name))
+
+            dbenv = self._database.dbenv()
+            homedir = self._database.dbenv_homedir()
+
+            # less log to replay on the copy
+            dbenv.txn_checkpoint(0, 0, database.bdb.DB_FORCE)
+
+            with BackupLock(homedir).shared():
+                for fname in dbenv.log_archive(database.bdb.DB_ARCH_DATA):
+                    self._copy_file(os.path.join(homedir, fname),
+                                    os.path.join(dest, fname))
+
+                # logs must be copied after data files
+                for fname in dbenv.log_archive(database.bdb.DB_ARCH_LOG):
+                    self._copy_file(os.path.join(homedir, fname),
+                                    os.path.join(dest, fname))
+
+            position = self._recover(dest)
+            self._copy_journal_archive(dest, position)
+
+            info = {
+                "name": name,
+                "position": position,
+                "time": int(started),
+                "duration": time.time() - started,
+                "dbfile": self._database.dbfile(),
+                "layout": self._database.layout().signature()
+            }
+            self.write_info(dest, info)
+
+        except:
+            log.err("Backup '{0}' failed, removing".format(name))
+            shutil.rmtree(dest, True)
+            raise
+
+        log.msg("Backup '{0}' taken at journal position {1} in {2:.3f}s".format(
+                name, info["position"], info["duration"]))
+        return info
+
+    def _copy_file(self, src, dst):
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                while True:
+                    buf = fsrc.read(self.COPY_BUFFER_SIZE)
+                    if not buf:
+                        break
+                    fdst.write(buf)
+                fdst.flush()
+                os.fsync(fdst.fileno())
+
+    def _recover(self, dest):
+        """
+        Run catastrophic recovery on the copy.
+        Returns journal position of the copy.
+        """
+
+        dbenv = database.bdb.DBEnv()
+        dbenv.open(dest, self.RECOVERY_FLAGS)
+        try:
+            spec = dict(journal.DATABASES["action"])
+            spec.pop("seq_spec", None)
+            dbpool = database.DatabasePool({"action": spec}, dbenv,
+                                           self._database.dbfile(),
+                                           layout=self._database.layout())
+            seq = dbpool.action.sequence()
+            position = seq.stat().get("last_value", 0)
+            seq.close()
+            dbpool.action.dbhandle().close()
+
+            dbenv.txn_checkpoint(0, 0, database.bdb.DB_FORCE)
+            for fname in dbenv.log_archive(database.bdb.DB_ARCH_ABS):
+                os.remove(fname)
+        finally:
+            dbenv.close()
+
+        database.bdb.DBEnv().remove(dest)
+        return position
+
+    def _copy_journal_archive(self, dest, position):
+        """
+        Copy journal archive segments up to position.
+        Segment files are immutable, the copy needs no recovery.
+        """
+
+        src = self._action_journal.archive_path()
+        if src is None:
+            return
+
+        dst = os.path.join(dest, self.JOURNAL_ARCHIVE_DIRNAME)
+        os.makedirs(dst)
+        for fname in os.listdir(src):
+            bounds = Segment.parse_name(fname)
+            if not bounds is None and bounds[1] <= position:
+                base = Segment.make_name(*bounds)
+                # index is copied last, as segment is written
+                for suffix in (Segment.DATA_SUFFIX, Segment.INDEX_SUFFIX):
+                    self._copy_file(os.path.join(src, base + suffix),
+                                    os.path.join(dst, base + suffix))
+
+    @classmethod
+    def write_info(cls, path, info):
+        with open(os.path.join(path, cls.INFO_FILENAME), 'w') as f:
+            for key in sorted(info):
+                f.write("{0} {1}\n".format(key, info[key]))
+
+    @classmethod
+    def read_info(cls, path):
+        """
+        Returns backup info dict.
+        """
+
+        info = {}
+        try:
+            with open(os.path.join(path, cls.INFO_FILENAME), 'r') as f:
+                for line in f:
+                    key, _, value = line.rstrip("\n").partition(" ")
+                    info[key] = value
+        except IOError:
+            raise BackupError("No backup info in '{0}'".format(path))
+
+        # backups taken before layouts
+        info.setdefault("layout", Layout(None, info["dbfile"]).signature())
+
+        for key in ("position", "time"):
+            info[key] = int(info[key])
+        info["duration"] = float(info["duration"])
+        return info
+
+    def list_backups(self):
+        """
+        Returns list of backup info dicts sorted by time.
+        """
+
+        if not os.path.isdir(self._backup_dir):
+            return []
+
+        res = []
+        for name in os.listdir(self._backup_dir):
+            path = os.path.join(self._backup_dir, name)
+            if os.path.exists(os.path.join(path, self.INFO_FILENAME)):
+                res.append(self.read_info(path))
+        return sorted(res, key=lambda info: info["time"])
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
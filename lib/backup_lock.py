@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import os
+import fcntl
+import contextlib
+
+
+class BackupLock(object):
+    """
+    Lock file in environment home directory held while backup copies
+      data and log files. Backups hold it shared, so they may run
+      concurrently, removal of unneeded log files holds it exclusively
+      and waits for running backups (see lib.backup, lib.checkpoint).
+    flock is used, so locks of distinct opens conflict in one process too.
+    """
+
+    FILENAME = "__backup.lock"
+
+    def __init__(self, homedir):
+        self._path = os.path.join(homedir, self.FILENAME)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0660)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            # closing releases lock
+            os.close(fd)
+
+    def shared(self):
+        return self._locked(fcntl.LOCK_SH)
+
+    def exclusive(self):
+        return self._locked(fcntl.LOCK_EX)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -4,35 +4,156 @@ import database
 
 from bsddb3 import db as bdb
 
+from lib.cursor import open_cursor
+
+
+# Iterators over BTREE databases read records in chunks of BUFFER_SIZE
+#   records: cursor is opened for each chunk and closed before chunk
+#   is yielded, then repositioned after the last read record. Cursors are
+#   never left open by abandoned iterators and memory is bounded by the
+#   chunk size. Databases must be either without duplicates or with sorted
+#   duplicates.
+# HASH databases could not be repositioned after a deleted record (there is
+#   no order of keys to find the next one), iterators over them keep one
+#   cursor until exhausted, abandoned iterator's cursor is closed with
+#   the transaction (see lib.cursor).
+BUFFER_SIZE = 1000
+
+
+class BdbHelpersError(Exception): pass
+
 
 def get_all(db, key, txn=None, **kwargs):
     delete = kwargs.get("delete", False)
 
     res = []
-    val = db.get(key, None, txn)
-    if not val is None:
-        c = db.cursor(txn)
-
-        kv = c.get(key, val, bdb.DB_GET_BOTH)
+    with open_cursor(db, txn) as c:
+        kv = c.set(key)
         while kv:
             if delete:
                 c.delete()
             res.append(kv[1])
             kv = c.get('', '', bdb.DB_NEXT_DUP)
 
-        c.close()
+    return res
+
+
+def _read_chunk(db, txn, position, next_flag, buffer_size):
+    """
+    Returns list of (key, value) following position read by one cursor.
+    Position is (key, value) of the last read record or None to start
+      from the first record of database, or (key, None) to start from
+      the first record of key.
+    """
+
+    res = []
+    with open_cursor(db, txn) as c:
+        if position is None:
+            kv = c.first()
+        else:
+            key, val = position
+            if val is None:
+                kv = c.set(key)
+            else:
+                kv = c.get(key, val, bdb.DB_GET_BOTH_RANGE)
+                if kv and kv[1] == val:
+                    kv = c.get('', '', next_flag)
+                elif not kv and next_flag == bdb.DB_NEXT:
+                    # record and all greater duplicates of key are deleted
+                    kv = c.set_range(key)
+                    if kv and kv[0] == key:
+                        kv = c.get('', '', bdb.DB_NEXT_NODUP)
+
+        while kv and len(res) < buffer_size:
+            res.append(kv)
+            if len(res) < buffer_size:
+                kv = c.get('', '', next_flag)
 
     return res
 
 
-def delete_pair(db, key, val, txn):
-    c = db.cursor(txn)
+def _iter_cursor(db, txn, position, next_flag):
+    """
+    Iterator over records following position read by single cursor.
+    """
+
+    with open_cursor(db, txn) as c:
+        if position is None:
+            kv = c.first()
+        else:
+            kv = c.set(position[0])
+
+        while kv:
+            yield kv
+            kv = c.get('', '', next_flag)
+
+
+def _iter_records(db, txn, position, next_flag, buffer_size):
+    if db.get_type() == bdb.DB_HASH:
+        for kv in _iter_cursor(db, txn, position, next_flag):
+            yield kv
+        return
+
+    while True:
+        chunk = _read_chunk(db, txn, position, next_flag, buffer_size)
+        for kv in chunk:
+            yield kv
+
+        if len(chunk) < buffer_size:
+            break
+        position = chunk[-1]
+
+
+def iter_values(db, key, txn=None, **kwargs):
+    """
+    Iterator over all values of key.
+    """
+
+    buffer_size = kwargs.get("buffer_size", BUFFER_SIZE)
+    for kv in _iter_records(db, txn, (key, None), bdb.DB_NEXT_DUP, buffer_size):
+        yield kv[1]
 
-    res = c.get(key, val, bdb.DB_GET_BOTH)
-    if res:
-        c.delete()
 
-    c.close()
+def iter_items(dbh, txn=None, **kwargs):
+    """
+    Iterator over all (key, value) records of database.
+    """
+
+    buffer_size = kwargs.get("buffer_size", BUFFER_SIZE)
+    return _iter_records(dbh, txn, None, bdb.DB_NEXT, buffer_size)
+
+
+def read_items(dbh, position=None, number=BUFFER_SIZE, txn=None):
+    """
+    Returns list of up to number (key, value) records following
+      position -- (key, value) of the last record read before,
+      or from the first record of database if position is None.
+    Used to walk database in separate transactions, BTREE databases only.
+    """
+
+    if dbh.get_type() == bdb.DB_HASH:
+        raise BdbHelpersError("Unable to read HASH database by chunks: "
+                              "position of deleted record is lost")
+
+    return _read_chunk(dbh, txn, position, bdb.DB_NEXT, number)
+
+
+def iter_keys(dbh, txn=None, **kwargs):
+    """
+    Iterator over keys of all records of database,
+      key is repeated for each of its duplicates.
+    """
+
+    for kv in iter_items(dbh, txn, **kwargs):
+        yield kv[0]
+
+
+def delete_pair(db, key, val, txn):
+    with open_cursor(db, txn) as c:
+        res = c.get(key, val, bdb.DB_GET_BOTH)
+        if res:
+            c.delete()
+
     return res
 
 
@@ -44,40 +165,21 @@ def delete(dbh, key, txn=None):
 
 
 def pair_exists(db, key, val, txn):
-    c = db.cursor(txn)
-    return not c.get(key, val, bdb.DB_GET_BOTH) is None
+    with open_cursor(db, txn) as c:
+        return not c.get(key, val, bdb.DB_GET_BOTH) is None
 
 
 def for_each(dbh, func, txn=None):
-    c = dbh.cursor(txn)
-    kv = c.first()
-    while kv:
+    for kv in iter_items(dbh, txn):
         func(kv)
-        kv = c.next()
-
-    c.close()
 
 
 def keys(dbh, txn=None):
-    res = []
-
-    def append(kv):
-        res.append(kv[0])
-
-    for_each(dbh, append, txn)
-    
-    return res
+    return list(iter_keys(dbh, txn))
 
 
 def keys_values(dbh, txn=None):
-    res = []
-
-    def append(kv):
-        res.append((kv[0], kv[1]))
-
-    for_each(dbh, append, txn)
-    
-    return res
+    return list(iter_items(dbh, txn))
 
 
 def print_db(dbh, txn=None):
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import threading
+
+from twisted.internet import threads, task
+from twisted.python import log
+
+from lib import database
+from lib.service import ServiceProvider
+from lib.backup_lock import BackupLock
+
+
+@ServiceProvider.register("checkpoint", deps=["database"])
+class manager(object):
+    """
+    Class used to checkpoint database environment and to get rid of
+      transaction log files no longer needed for recovery.
+    Checkpoint is taken if at least kbyte kilobytes of log were written
+      or min minutes passed since the last checkpoint, so amount of log
+      replayed by recovery is bounded.
+    Unneeded log files are moved into log_archive_dir if configured,
+      otherwise removed unless remove_logs is unset (then they are left
+      as is and the log grows without bound).
+    Log files are not moved or removed while backup copies them,
+      so backups keep logs needed by catastrophic recovery.
+    Periodic checkpoints are started by start call, only one process
+      sharing the environment should start them. It logs checkpoint
+      statistics every report_period seconds.
+    """
+
+    PERIOD_DEFAULT = 60.0
+    KBYTE_DEFAULT = 16384
+    MIN_DEFAULT = 5
+    REPORT_PERIOD_DEFAULT = 3600.0
+
+    def __init__(self, sp, *args, **kwargs):
+        self._database = sp.get('database')
+
+        self._period = kwargs.get("period", self.PERIOD_DEFAULT)
+        self._kbyte = kwargs.get("kbyte", self.KBYTE_DEFAULT)
+        self._min = kwargs.get("min", self.MIN_DEFAULT)
+        self._remove_logs = kwargs.get("remove_logs", True)
+        self._report_period = kwargs.get("report_period", self.REPORT_PERIOD_DEFAULT)
+        self._archive_dir = kwargs.get("log_archive_dir", None)
+
+        if not self._archive_dir is None and not os.path.isdir(self._archive_dir):
+            os.makedirs(self._archive_dir)
+
+        self._in_progress = False
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "checkpoints": 0,
+            "last_checkpoint_time": None,
+            "last_checkpoint_duration": None,
+            "logs_archived": 0,
+            "logs_removed": 0,
+            "log_files": None,
+            "log_bytes": None
+        }
+
+    def start(self):
+        l = task.LoopingCall(self.run)
+        l.start(self._period, now=False)
+        l = task.LoopingCall(self.report)
+        l.start(self._report_period, now=False)
+
+    def run(self):
+        """
+        Initiate checkpoint.
+        Method do not blocks.
+        """
+
+        if self._in_progress:
+            return
+
+        self._in_progress = True
+
+        def done(res):
+            self._in_progress = False
+            return res
+
+        d = threads.deferToThread(self.checkpoint)
+        d.addBoth(done)
+        d.addErrback(self._errback)
+
+    def _errback(self, failure, desc="Error while checkpointing database"):
+        log.err(desc)
+        log.err(failure)
+
+    def report(self):
+        """
+        Log checkpoint statistics.
+        Method do not blocks.
+        """
+
+        d = threads.deferToThread(self.stats)
+        d.addCallback(self._log_stats)
+        d.addErrback(self._errback, "Error while retrieving checkpoint stats")
+
+    def _log_stats(self, stats):
+        log.msg("Checkpoint stats: {0}".format(", ".join(
+                ["{0}={1}".format(k, stats[k]) for k in sorted(stats)])))
+
+    def checkpoint(self, force=False):
+        """
+        Blocking call to DB, should be called from thread pool.
+        Take checkpoint according to the policy (unconditionally if force)
+          and get rid of unneeded log files.
+        """
+
+        dbenv = self._database.dbenv()
+
+        started = time.time()
+        if force:
+            dbenv.txn_checkpoint(0, 0, database.bdb.DB_FORCE)
+        else:
+            dbenv.txn_checkpoint(self._kbyte, self._min)
+        duration = time.time() - started
+
+        archived, removed = self._prune_logs(dbenv)
+        log_files, log_bytes = self._log_volume(dbenv)
+
+        with self._stats_lock:
+            self._stats["checkpoints"] += 1
+            self._stats["last_checkpoint_time"] = started
+            self._stats["last_checkpoint_duration"] = duration
+            self._stats["logs_archived"] += archived
+            self._stats["logs_removed"] += removed
+            self._stats["log_files"] = log_files
+            self._stats["log_bytes"] = log_bytes
+
+        if archived or removed:
+            log.msg("Database log files: {0} archived, {1} removed, {2} files "
+                    "({3} bytes) left".format(archived, removed, log_files, log_bytes))
+
+    def _prune_logs(self, dbenv):
+        """
+        Returns numbers of archived and removed log files.
+        """
+
+        if self._archive_dir is None and not self._remove_logs:
+            return (0, 0)
+
+        with BackupLock(self._database.dbenv_homedir()).exclusive():
+            return self._do_prune_logs(dbenv)
+
+    def _do_prune_logs(self, dbenv):
+        if not self._archive_dir is None:
+            unneeded = dbenv.log_archive(database.bdb.DB_ARCH_ABS)
+            for path in unneeded:
+                shutil.move(path, os.path.join(self._archive_dir,
+                                               os.path.basename(path)))
+            return (len(unneeded), 0)
+
+        unneeded = dbenv.log_archive(database.bdb.DB_ARCH_ABS)
+        dbenv.log_archive(database.bdb.DB_ARCH_REMOVE)
+        return (0, len(unneeded))
+
+    def _log_volume(self, dbenv):
+        """
+        Returns number and total size of log files.
+        """
+
+        paths = dbenv.log_archive(database.bdb.DB_ARCH_ABS | database.bdb.DB_ARCH_LOG)
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return (len(paths), size)
+
+    def stats(self):
+        """
+        Blocking call to DB, should be called from thread pool.
+        Returns dict with checkpoint and current log volume numbers,
+          recovery duration included.
+        """
+
+        log_files, log_bytes = self._log_volume(self._database.dbenv())
+        with self._stats_lock:
+            self._stats["log_files"] = log_files
+            self._stats["log_bytes"] = log_bytes
+            res = dict(self._stats)
+        res["recovery_duration"] = self._database.recovery_duration()
+        return res
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
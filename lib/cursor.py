@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import traceback
+
+from twisted.python import log
+
+from lib.database import Transaction
+
+
+class CursorTracker(object):
+    """
+    Counts cursors opened by open_cursor and not closed yet, per thread.
+    In debug mode open site of every cursor is recorded and reported
+      if cursor is closed by transaction end or garbage collector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = {}
+        self._opened_total = 0
+        self._leaked_total = 0
+        self._debug = False
+
+    def set_debug(self, debug):
+        self._debug = debug
+
+    def debug(self):
+        return self._debug
+
+    def opened(self, cursor):
+        thread = threading.current_thread().name
+        site = traceback.format_stack()[:-3] if self._debug else None
+        with self._lock:
+            self._open.setdefault(thread, 0)
+            self._open[thread] += 1
+            self._opened_total += 1
+        cursor.thread = thread
+        cursor.site = site
+
+    def closed(self, cursor):
+        with self._lock:
+            left = self._open.get(cursor.thread, 0) - 1
+            if left > 0:
+                self._open[cursor.thread] = left
+            else:
+                self._open.pop(cursor.thread, None)
+
+    def leaked(self, cursor, reason):
+        with self._lock:
+            self._leaked_total += 1
+
+        if not cursor.site is None:
+            log.msg("Cursor leak: cursor closed by {0}, opened at:\n{1}".format(
+                    reason, "".join(cursor.site)))
+
+    def stats(self):
+        """
+        Returns dict with open cursors number per thread, total numbers
+          of opened cursors and cursors closed not by owner.
+        """
+
+        with self._lock:
+            return {
+                "open": dict(self._open),
+                "opened": self._opened_total,
+                "leaked": self._leaked_total
+            }
+
+
+tracker = CursorTracker()
+
+
+class Cursor(object):
+    """
+    Bdb cursor wrapper closed on exit from with block.
+    Cursors opened in transaction began by Transaction wrapper are
+      closed before commit or abort if owner did not close them.
+    """
+
+    __slots__ = ("_cursor", "thread", "site", "__weakref__")
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        tracker.opened(self)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def closed(self):
+        return self._cursor is None
+
+    def close(self):
+        if not self._cursor is None:
+            c, self._cursor = self._cursor, None
+            c.close()
+            tracker.closed(self)
+
+    def close_leaked(self, reason):
+        if not self._cursor is None:
+            tracker.leaked(self, reason)
+            self.close()
+
+    def __del__(self):
+        try:
+            self.close_leaked("garbage collector")
+        except:
+            pass
+
+
+def open_cursor(dbh, txn=None, flags=0):
+    """
+    Open cursor of database handle dbh in transaction txn.
+    """
+
+    c = Cursor(dbh.cursor(txn, flags))
+
+    t = Transaction.lookup(txn) if not txn is None else None
+    if not t is None:
+        t.add_cursor(c)
+    return c
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -1,26 +1,76 @@
 # -*- coding: utf-8 -*-
 
+import sys
+import time
 import atexit
+import random
+import weakref
 import functools
+import threading
 
 from bsddb3 import db as bdb
 from twisted.python import log
 
 from lib.service import ServiceProvider
+from lib.db_tuning import Tuning
+from lib.db_layout import Layout
+from lib.db_durability import Durability
+from lib.txn_profiler import TransactionProfiler
 
 
 class DatabaseError(Exception): pass
 class TransactionError(DatabaseError): pass
 
 
+# errors after which aborted transaction may be retried as is
+RETRY_ERRORS = (bdb.DBLockDeadlockError, bdb.DBLockNotGrantedError)
+
+# deadlock detector policies: which locker of the cycle is rejected
+DEADLOCK_DETECT_POLICIES = {
+    "default": bdb.DB_LOCK_DEFAULT,
+    "oldest": bdb.DB_LOCK_OLDEST,
+    "youngest": bdb.DB_LOCK_YOUNGEST,
+    "random": bdb.DB_LOCK_RANDOM,
+    "minlocks": bdb.DB_LOCK_MINLOCKS,
+    "maxlocks": bdb.DB_LOCK_MAXLOCKS,
+    "minwrite": bdb.DB_LOCK_MINWRITE
+}
+
+
 class Transaction(object):
     """
     Bdb transaction wrapper with context manager support.
     """
 
-    def __init__(self, dbenv):
+    # began transactions: id of bdb txn handle => wrapper
+    _active = {}
+
+    @classmethod
+    def lookup(cls, txn):
+        """
+        Find wrapper of given bdb txn handle.
+        Returns None if transaction was not began by wrapper.
+        """
+
+        return cls._active.get(id(txn), None)
+
+    def __init__(self, dbenv, **kwargs):
         self._dbenv = dbenv
+        self._flags = kwargs.get("flags", 0)
+        self._name = kwargs.get("name", None)
+        self._profiler = kwargs.get("profiler", None)
+        self._profile_sample = None
+        # commit of transactions began without log flush may have
+        #   to wait for it (see lib.db_durability)
+        self._durability = kwargs.get("durability", None)
+        self._workload = kwargs.get("workload", None)
+        self._read_only = kwargs.get("read_only", False)
         self._used = False
+        self._commit_callbacks = []
+        self._precommit_callbacks = []
+        self._abort_callbacks = []
+        self._context = {}
+        self._cursors = weakref.WeakSet()
 
     def _check_not_used(self):
         if self._used:
@@ -36,9 +86,22 @@ class Transaction(object):
     def __exit__(self, type, value, traceback):
         if type is None:
             self.commit()
+        elif issubclass(type, RETRY_ERRORS):
+            # expected under concurrent writers, callers may retry
+            log.msg("Aborting transaction: {0}".format(type.__name__))
+            self._rollback(type.__name__)
         else:
             log.err("Aborting transaction")
-            self.rollback()
+            self._rollback(type.__name__)
+
+    def name(self):
+        return self._name
+
+    def read_only(self):
+        return self._read_only
+
+    def snapshot(self):
+        return bool(self._flags & bdb.DB_TXN_SNAPSHOT)
 
     def get(self):
         self._check_not_used()
@@ -47,20 +110,136 @@ class Transaction(object):
 
     def begin(self):
         self._check_not_used()
-        self._txn = self._dbenv.txn_begin()
+        self._txn = self._dbenv.txn_begin(None, self._flags)
+        self._active[id(self._txn)] = self
+        if not self._profiler is None:
+            self._profile_sample = self._profiler.started(self)
         return self._txn
 
     def commit(self):
         self._check_not_used()
         self._check_began()
+
+        try:
+            # callbacks may register new ones
+            while self._precommit_callbacks:
+                func, args = self._precommit_callbacks.pop(0)
+                func(*args)
+        except:
+            log.err("Transaction precommit callback failed")
+            self._rollback("precommit:" + sys.exc_info()[0].__name__)
+            raise
+
+        self._close_cursors("commit")
+        self._active.pop(id(self._txn), None)
         self._txn.commit()
         self._used = True
+        if not self._durability is None:
+            self._durability.committed(self._workload)
+        self._profile("commit")
+
+        for func, args in self._commit_callbacks:
+            try:
+                func(*args)
+            except:
+                log.err("Transaction commit callback failed")
 
     def rollback(self):
+        self._rollback("rollback")
+
+    def _rollback(self, reason):
         self._check_not_used()
         self._check_began()
+        self._close_cursors("abort")
+        self._active.pop(id(self._txn), None)
         self._txn.abort()
         self._used = True
+        self._profile("abort", reason)
+
+        for func, args in self._abort_callbacks:
+            try:
+                func(*args)
+            except:
+                log.err("Transaction abort callback failed")
+
+    def _profile(self, outcome, reason=None):
+        if not self._profile_sample is None:
+            try:
+                self._profiler.finished(self._profile_sample, outcome, reason)
+            except:
+                log.err("Transaction profiler failed")
+
+    def add_commit_callback(self, func, *args):
+        """
+        Register func to be called with args after successful commit.
+        """
+
+        self._check_not_used()
+        self._commit_callbacks.append((func, args))
+
+    def add_abort_callback(self, func, *args):
+        """
+        Register func to be called with args after abort.
+        """
+
+        self._check_not_used()
+        self._abort_callbacks.append((func, args))
+
+    def add_precommit_callback(self, func, *args):
+        """
+        Register func to be called with args in transaction just before commit.
+        Exception in func aborts transaction.
+        """
+
+        self._check_not_used()
+        self._precommit_callbacks.append((func, args))
+
+    def context(self):
+        """
+        Returns dict for data bound to transaction.
+        """
+
+        return self._context
+
+    def add_cursor(self, cursor):
+        """
+        Register cursor to be closed before commit or abort.
+        Cursor must have close_leaked(reason) method (see lib.cursor).
+        """
+
+        self._check_not_used()
+        self._cursors.add(cursor)
+
+    def _close_cursors(self, reason):
+        for cursor in list(self._cursors):
+            cursor.close_leaked(reason)
+        self._cursors.clear()
+
+
+def on_commit(txn, func, *args):
+    """
+    Call func with args after commit of bdb txn handle.
+    Function is called immediately if there is no transaction
+      or transaction was not began by Transaction wrapper.
+    """
+
+    t = Transaction.lookup(txn) if not txn is None else None
+    if t is None:
+        func(*args)
+    else:
+        t.add_commit_callback(func, *args)
+
+
+def on_abort(txn, func, *args):
+    """
+    Call func with args after abort of bdb txn handle.
+    Function is never called if there is no transaction
+      or transaction was not began by Transaction wrapper.
+    """
+
+    t = Transaction.lookup(txn) if not txn is None else None
+    if not t is None:
+        t.add_abort_callback(func, *args)
 
 
 class Database(object):
@@ -73,15 +252,23 @@ class Database(object):
     SEQUENCE_KEY = "_seq"
     SEQUENCE_FLAGS = bdb.DB_CREATE | bdb.DB_THREAD
 
-    def __init__(self, dbenv, file, name, type, flags, open_flags):
+    def __init__(self, dbenv, file, name, type, flags, open_flags, **kwargs):
         self._dbenv = dbenv
         self._file = file
         self._name = name
         self._type = type
         self._flags = flags
         self._open_flags = open_flags
+        self._tuning = kwargs.get("tuning", None)
+        self._layout = kwargs.get("layout", None)
         self._dbhandle = None
 
+        # seqkey => cache size
+        self._seq_cachesize = kwargs.get("seq_cachesize", {})
+        # seqkey => long-lived sequence handle
+        self._sequences = {}
+        self._sequences_lock = threading.Lock()
+
     def dbhandle(self):
         if self._dbhandle is None:
             # Transactional database may be opened only in transaction
@@ -94,6 +281,10 @@ class Database(object):
 
     def _do_open(self, txn):
         db = bdb.DB(self._dbenv)
+        if not self._layout is None:
+            self._layout.apply_db(self._name, db)
+        if not self._tuning is None:
+            self._tuning.apply_db(self._name, db)
         db.set_flags(self._flags)
         db.open(self._file, self._name, self._type,
                  self._open_flags, self.DBFILE_PERMISSIONS, txn)
@@ -104,6 +295,7 @@ class Database(object):
         txn = kwargs.get("txn", None)
         initial = kwargs.get("initial", None)
         dbhandle = kwargs.get("dbhandle", None)
+        cachesize = kwargs.get("cachesize", 0)
 
         if seqkey is None:
             seqkey = self.SEQUENCE_KEY
@@ -116,28 +308,114 @@ class Database(object):
         if not initial is None:
             dbseq.initial_value(initial)
 
+        if cachesize:
+            dbseq.set_cachesize(cachesize)
+
         dbseq.open(seqkey, txn, self.SEQUENCE_FLAGS)
         return dbseq
 
+    def _cached_sequence(self, seqkey, initial=None, txn=None):
+        dbseq = self._sequences.get(seqkey, None)
+        if dbseq is None:
+            with self._sequences_lock:
+                dbseq = self._sequences.get(seqkey, None)
+                if dbseq is None:
+                    dbseq = self.sequence(seqkey, initial=initial, txn=txn,
+                                          cachesize=self._seq_cachesize.get(seqkey, 0))
+                    self._sequences[seqkey] = dbseq
+
+        return dbseq
+
+    def init_sequence(self, seqkey=None, initial=None):
+        """
+        Create sequence if not exists and cache its handle.
+        Initial value will be ignored if sequence already exists.
+        """
+
+        if seqkey is None:
+            seqkey = self.SEQUENCE_KEY
+
+        self._cached_sequence(seqkey, initial)
+
+    def allocate(self, seqkey=None, number=1, txn=None):
+        """
+        Allocate number of consecutive ids from the sequence.
+        Returns the first allocated id.
+        Sequences with non-zero cache size are allocated outside of txn
+          (ids lost on abort), other ones -- in txn.
+        """
+
+        if seqkey is None:
+            seqkey = self.SEQUENCE_KEY
+
+        dbseq = self._cached_sequence(seqkey)
+        if self._seq_cachesize.get(seqkey, 0):
+            return dbseq.get(number)
+        else:
+            return dbseq.get(number, txn)
+
+    def reset_sequence(self, initial, seqkey=None, txn=None):
+        """
+        Recreate sequence starting from initial value.
+        Sequence is recreated in txn, new handle is used by allocations
+          in txn and after commit. On abort the handle is dropped,
+          so the next allocation reopens the sequence as it was.
+        """
+
+        if seqkey is None:
+            seqkey = self.SEQUENCE_KEY
+
+        with self._sequences_lock:
+            dbseq = self._sequences.pop(seqkey, None)
+            if not dbseq is None:
+                dbseq.close()
+
+            try:
+                self.dbhandle().delete(seqkey, txn)
+            except bdb.DBNotFoundError:
+                pass
+
+            dbseq = self.sequence(seqkey, initial=initial, txn=txn,
+                                  cachesize=self._seq_cachesize.get(seqkey, 0))
+            self._sequences[seqkey] = dbseq
+
+        on_abort(txn, self._drop_sequence, seqkey, dbseq)
+
+    def _drop_sequence(self, seqkey, dbseq):
+        with self._sequences_lock:
+            if self._sequences.get(seqkey, None) is dbseq:
+                del self._sequences[seqkey]
+                dbseq.close()
+
 
 class DatabasePool(object):
     """
     Class used to store specified database descriptors
     as object attributes.
+    Databases are opened in dbfile or in files given by layout.
     """
 
-    def __init__(self, databases_spec, dbenv, dbfile):
+    def __init__(self, databases_spec, dbenv, dbfile, **kwargs):
+        tuning = kwargs.get("tuning", None)
+        layout = kwargs.get("layout", None)
+
         for dbname in databases_spec:
-            dbdesc = Database(dbenv, dbfile, dbname,
+            dbdesc = Database(dbenv,
+                              dbfile if layout is None else layout.file(dbname),
+                              dbname,
                               databases_spec[dbname]["type"],
                               databases_spec[dbname]["flags"],
-                              databases_spec[dbname]["open_flags"])
+                              databases_spec[dbname]["open_flags"],
+                              seq_cachesize=databases_spec[dbname].get(
+                                                "seq_cachesize", {}),
+                              tuning=tuning,
+                              layout=layout)
             setattr(self, dbname, dbdesc)
             getattr(self, dbname, dbdesc).dbhandle()
 
             seq_spec = databases_spec[dbname].get("seq_spec", {})
             for seq_name in seq_spec:
-                dbdesc.sequence(seq_name, initial=seq_spec[seq_name])
+                dbdesc.init_sequence(seq_name, seq_spec[seq_name])
 
 
 @ServiceProvider.register("database")
@@ -183,6 +461,12 @@ class manager(object):
             "flags": bdb.DB_DUP|bdb.DB_DUPSORT,
             "open_flags": bdb.DB_CREATE
         },
+        # record id => "zone host" key of dns_data, see lib.record_index
+        "dns_data_id": {
+            "type": bdb.DB_BTREE,
+            "flags": 0,
+            "open_flags": bdb.DB_CREATE
+        },
         "dns_data_inactive": {
             "type": bdb.DB_HASH,
             "flags": bdb.DB_DUP|bdb.DB_DUPSORT,
@@ -222,7 +506,10 @@ class manager(object):
             "type": bdb.DB_HASH,
             "flags": 0,
             "open_flags": bdb.DB_CREATE,
-            "seq_spec": {"dns_data": 1}
+            "seq_spec": {"dns_data": 1},
+            # record ids are allocated outside of transactions,
+            #   gaps are allowed
+            "seq_cachesize": {"dns_data": 100}
         },
         "dbstate": {
             "type": bdb.DB_BTREE,
@@ -235,30 +522,99 @@ class manager(object):
                          bdb.DB_INIT_MPOOL | bdb.DB_INIT_LOCK |
                          bdb.DB_INIT_LOG | bdb.DB_INIT_TXN )
 
-    ENV_MAX_LOCKERS = 100000
-    ENV_MAX_LOCKS = 100000
-    ENV_MAX_OBJECTS = 100000
+    DEADLOCK_RETRIES_DEFAULT = 5
+    # seconds, doubled on every retry
+    DEADLOCK_BACKOFF_DEFAULT = 0.01
 
     def __init__(self, *args, **kwargs):
         self._dbenv_flags = kwargs.get("dbenv_flags", self.ENV_FLAGS_DEFAULT)
         self._dbenv_homedir = kwargs.get("dbenv_homedir", None)
         self._dbfile = kwargs.get("dbfile", None)
 
+        if kwargs.get("cursor_debug", False):
+            from lib.cursor import tracker
+            tracker.set_debug(True)
+
         assert not self._dbenv_homedir is None
         assert not self._dbfile is None
 
-        self._dbenv = bdb.DBEnv()
-        self._dbenv.set_lk_max_lockers(self.ENV_MAX_LOCKERS)
-        self._dbenv.set_lk_max_locks(self.ENV_MAX_LOCKS)
-        self._dbenv.set_lk_max_objects(self.ENV_MAX_OBJECTS)
-        self._dbenv.open(self._dbenv_homedir, self._dbenv_flags)
+        # see lib.db_tuning for options and profiles
+        self._tuning = Tuning(kwargs.get("tuning", None))
+
+        # see lib.db_layout for modes, tools/migrate_layout.py
+        #   moves existing databases on mode change
+        self._layout = Layout(kwargs.get("layout", None), self._dbfile, self._tuning)
+
+        # see lib.db_durability for workloads and modes
+        self._durability = Durability(kwargs.get("durability", None))
+
+        # deadlock detector runs on every lock conflict,
+        #   deadlocked transactions begun by decorators are retried
+        self._deadlock_detect = kwargs.get("deadlock_detect", "default")
+        self._deadlock_retries = kwargs.get("deadlock_retries", self.DEADLOCK_RETRIES_DEFAULT)
+        self._deadlock_backoff = kwargs.get("deadlock_backoff", self.DEADLOCK_BACKOFF_DEFAULT)
+        if not self._deadlock_detect is None and \
+           not DEADLOCK_DETECT_POLICIES.has_key(self._deadlock_detect):
+            raise DatabaseError("Unknown deadlock detect policy '{0}', available: {1}".format(
+                                self._deadlock_detect,
+                                ", ".join(sorted(DEADLOCK_DETECT_POLICIES))))
+
+        self._retry_stats_lock = threading.Lock()
+        self._retry_stats = {
+            "deadlocks": 0,
+            "retries": 0,
+            "failures": 0
+        }
 
-        self._dbpool = DatabasePool(self.DATABASES, self._dbenv, self._dbfile)
+        # recovery must be run by a single process, while no other
+        #   process has the environment opened
+        self._recover = kwargs.get("recover", False)
+        self._recovery_duration = None
 
+        self._dbenv = bdb.DBEnv()
+        self._tuning.apply_env(self._dbenv)
+        if not self._deadlock_detect is None:
+            self._dbenv.set_lk_detect(DEADLOCK_DETECT_POLICIES[self._deadlock_detect])
+        if self._recover:
+            log.msg("Running database environment recovery")
+            started = time.time()
+            self._dbenv.open(self._dbenv_homedir, self._dbenv_flags | bdb.DB_RECOVER)
+            self._recovery_duration = time.time() - started
+            log.msg("Database environment recovered in {0:.3f}s".format(
+                    self._recovery_duration))
+        else:
+            self._dbenv.open(self._dbenv_homedir, self._dbenv_flags)
+        self._tuning.report()
+        self._layout.report()
+        self._durability.start(self._dbenv)
+        self._durability.report()
+
+        # see lib.txn_profiler for options, disabled if not given
+        profiler_cfg = kwargs.get("txn_profiler", None)
+        self._profiler = None
+        if not profiler_cfg is None:
+            self._profiler = TransactionProfiler(self._dbenv, profiler_cfg)
+
+        self._dbpool = DatabasePool(self.DATABASES, self._dbenv, self._dbfile,
+                                    tuning=self._tuning, layout=self._layout)
+
+        # records stored before the index was introduced are indexed once
+        from lib import record_index
+        record_index.build(self)
+
+        # the only shutdown path, explicit call before exit makes it no-op
+        self._terminated = False
         atexit.register(self._terminate)
 
     def _terminate(self):
+        if self._terminated:
+            return
+        self._terminated = True
+
         log.msg("Terminating database context")
+        if not self._profiler is None:
+            self._profiler.report()
+        self._durability.stop()
         self._dbenv.close()
 
     def dbenv(self):
@@ -270,24 +626,126 @@ class manager(object):
     def dbfile(self):
         return self._dbfile
 
+    def tuning(self):
+        return self._tuning
+
+    def layout(self):
+        return self._layout
+
+    def durability(self):
+        return self._durability
+
+    def recovery_duration(self):
+        """
+        Returns duration of startup recovery in seconds or None
+          if recovery was not run.
+        """
+
+        return self._recovery_duration
+
     def dbpool(self):
         return self._dbpool
 
-    def transaction(self):
-        return Transaction(self.dbenv())
-
+    def profiler(self):
+        """
+        Returns TransactionProfiler or None if profiling is disabled.
+        """
+
+        return self._profiler
+
+    def transaction(self, name=None, workload=None):
+        """
+        Name is used by profiler to group transactions.
+        Workload selects durability mode (see lib.db_durability).
+        """
+
+        return Transaction(self.dbenv(), flags=self._durability.begin_flags(workload),
+                           name=name, profiler=self._profiler,
+                           durability=self._durability, workload=workload)
+
+    def read_transaction(self, name=None):
+        """
+        Transaction for reads only. With multiversion tuning option it runs
+          with snapshot isolation: reads neither take nor wait for page locks.
+        """
+
+        if self._tuning.multiversion():
+            return Transaction(self.dbenv(), flags=bdb.DB_TXN_SNAPSHOT,
+                               name=name, profiler=self._profiler, read_only=True)
+        return Transaction(self.dbenv(), name=name, profiler=self._profiler,
+                           read_only=True)
+
+    def run_transaction(self, func, *args, **kwargs):
+        """
+        Blocking call, should be called from thread pool.
+        Call func(txn, *args, **kwargs) in new transaction (created by
+          read_transaction if read_only kwarg is set, named by name kwarg,
+          of workload kwarg) and commit it.
+        Deadlocked transaction is aborted and func is called again
+          in new one after jittered exponential backoff, at most
+          deadlock_retries times. So func must have no side effects
+          outside of transaction (actions reset their state on abort,
+          see lib.action Action.apply).
+        Returns func result.
+        """
+
+        read_only = kwargs.pop("read_only", False)
+        name = kwargs.pop("name", None)
+        workload = kwargs.pop("workload", None)
+
+        attempt = 0
+        while True:
+            if read_only:
+                t = self.read_transaction(name)
+            else:
+                t = self.transaction(name, workload)
+            try:
+                with t as txn:
+                    return func(txn, *args, **kwargs)
+            except RETRY_ERRORS:
+                attempt += 1
+                retry = attempt <= self._deadlock_retries
+                self._count_deadlock(retry)
+                if not retry:
+                    log.msg("Transaction deadlocked {0} times, giving up".format(attempt))
+                    raise
+
+            backoff = self._deadlock_backoff * (1 << (attempt - 1))
+            time.sleep(random.uniform(0, backoff))
+
+    def _count_deadlock(self, retry):
+        with self._retry_stats_lock:
+            self._retry_stats["deadlocks"] += 1
+            self._retry_stats["retries" if retry else "failures"] += 1
+
+    def retry_stats(self):
+        """
+        Returns dict with numbers of deadlocked transactions,
+          retries and transactions failed after all retries.
+        """
+
+        with self._retry_stats_lock:
+            return dict(self._retry_stats)
+
+
+def _txn_name(obj, func):
+    # services are all named manager, module name tells them apart
+    return "{0}.{1}.{2}".format(func.__module__.rsplit(".", 1)[-1],
+                                type(obj).__name__, func.__name__)
 
 def transactional(**kwargs):
     """
     Function that returns decorator used to make some function transactional.
     If user gives txn in kwargs, then function executes in this transaction.
-    Otherwise new transaction will be created.
+    Otherwise new transaction will be created and retried on deadlock
+        (see manager.run_transaction).
     Function func should be a method with signature: (self, *args, **kwargs).
     Database service looked up as self attribute,
         database_srv_attr is the name of that attribute.
     """
 
     database_srv_attr = kwargs.get('database_srv_attr', 'database_srv')
+    read_only = kwargs.get('read_only', False)
 
     def decorator(func):
         @functools.wraps(func)
@@ -295,9 +753,13 @@ def transactional(**kwargs):
             txn = kwargs.get('txn', None)
             if txn is None:
                 database_srv = getattr(self, database_srv_attr)
-                with database_srv.transaction() as txn:
+
+                def call(txn):
                     kwargs['txn'] = txn
                     return func(self, *args, **kwargs)
+
+                return database_srv.run_transaction(call, read_only=read_only,
+                                                    name=_txn_name(self, func))
             else:
                 return func(self, *args, **kwargs)
 
@@ -309,6 +771,7 @@ def transactional2(func):
     """
     Function becomes transactional with opportunity
         to give external transaction handle in kwargs as 'txn'.
+    Own transaction is retried on deadlock (see manager.run_transaction).
     The difference with transactional is that database service passed as second arg.
     Function func should be a method with signature: (self, database_srv *args, **kwargs).
     """
@@ -318,10 +781,32 @@ def transactional2(func):
         if kwargs.has_key('txn'):
             return func(self, database_srv, *args, **kwargs)
         else:
-            with database_srv.transaction() as txn:
+            def call(txn):
+                kwargs['txn'] = txn
+                return func(self, database_srv, *args, **kwargs)
+
+            return database_srv.run_transaction(call, name=_txn_name(self, func))
+
+    return wrapper
+
+def read_transactional2(func):
+    """
+    Read-only variant of transactional2: new transaction
+        is created by database service read_transaction.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, database_srv, *args, **kwargs):
+        if kwargs.has_key('txn'):
+            return func(self, database_srv, *args, **kwargs)
+        else:
+            def call(txn):
                 kwargs['txn'] = txn
                 return func(self, database_srv, *args, **kwargs)
 
+            return database_srv.run_transaction(call, read_only=True,
+                                                name=_txn_name(self, func))
+
     return wrapper
 
 
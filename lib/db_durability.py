@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from bsddb3 import db as bdb
+from twisted.python import log
+
+
+class DurabilityError(Exception): pass
+
+
+# commit returns after log is flushed to disk
+MODE_SYNC = "sync"
+# commit writes log to OS buffers, log is flushed every flush_interval
+#   seconds, so at most flush_interval of commits may be lost on OS crash
+MODE_WRITE_NOSYNC = "write-nosync"
+# commit returns after log is flushed to disk, concurrent commits
+#   wait for single flush
+MODE_GROUP = "group"
+MODES = (MODE_SYNC, MODE_WRITE_NOSYNC, MODE_GROUP)
+
+# user API writes and everything not marked otherwise
+WORKLOAD_DEFAULT = "default"
+# actions applied from peers and peer positions, they are pulled again
+#   from peers if lost
+WORKLOAD_REPLICATION = "replication"
+WORKLOADS = (WORKLOAD_DEFAULT, WORKLOAD_REPLICATION)
+
+
+class GroupCommit(object):
+    """
+    Makes transactions committed without log flush durable, one flush
+      is done for all transactions committed while previous flush ran.
+    The first waiter becomes a leader: it waits up to window seconds
+      for more commits and flushes the log, other waiters wait for it.
+    """
+
+    def __init__(self, dbenv, window):
+        self._dbenv = dbenv
+        self._window = window
+        self._cond = threading.Condition()
+        # commits are numbered, ones up to flushed are durable
+        self._committed = 0
+        self._flushed = 0
+        self._flushing = False
+        self._flushes = 0
+
+    def wait_durable(self):
+        """
+        Should be called after commit, returns when commit is on disk.
+        """
+
+        with self._cond:
+            self._committed += 1
+            ticket = self._committed
+
+            while self._flushed < ticket:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+
+                self._flushing = True
+                try:
+                    self._cond.release()
+                    try:
+                        if self._window:
+                            time.sleep(self._window)
+                    finally:
+                        self._cond.acquire()
+
+                    # commits numbered up to target are in log before flush
+                    target = self._committed
+                    self._cond.release()
+                    try:
+                        self._dbenv.log_flush()
+                    finally:
+                        self._cond.acquire()
+
+                    self._flushed = max(self._flushed, target)
+                    self._flushes += 1
+                finally:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"commits": self._committed, "flushes": self._flushes}
+
+
+class Durability(object):
+    """
+    Durability mode of transactions per workload:
+      durability:
+        default: sync
+        replication: write-nosync
+        flush_interval: 1.0
+        group_window: 0.002
+    Log is sequential, so durable commit makes all previous relaxed
+      commits durable too: recovery never leaves a hole, only a tail
+      of relaxed commits may be lost.
+    """
+
+    FLUSH_INTERVAL_DEFAULT = 1.0
+    GROUP_WINDOW_DEFAULT = 0.002
+
+    def __init__(self, cfg=None):
+        cfg = {} if cfg is None else cfg
+
+        self._modes = {}
+        for workload in WORKLOADS:
+            mode = cfg.get(workload, MODE_SYNC)
+            if not mode in MODES:
+                raise DurabilityError("Unknown durability mode '{0}' of workload "
+                                      "'{1}', available: {2}".format(
+                                      mode, workload, ", ".join(MODES)))
+            self._modes[workload] = mode
+
+        for key in cfg:
+            if not key in WORKLOADS and not key in ("flush_interval", "group_window"):
+                raise DurabilityError("Unknown durability option '{0}'".format(key))
+
+        self._flush_interval = cfg.get("flush_interval", self.FLUSH_INTERVAL_DEFAULT)
+        self._group_window = cfg.get("group_window", self.GROUP_WINDOW_DEFAULT)
+
+        self._dbenv = None
+        self._group = None
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    def start(self, dbenv):
+        """
+        Start log flusher and group commit of opened environment.
+        """
+
+        self._dbenv = dbenv
+        modes = self._modes.values()
+        if MODE_GROUP in modes:
+            self._group = GroupCommit(dbenv, self._group_window)
+        if MODE_WRITE_NOSYNC in modes:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name="log flusher")
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def stop(self):
+        """
+        Stop log flusher and flush log, should be called before
+          environment is closed. Calls after the first one do nothing.
+        """
+
+        if self._stopped.is_set():
+            return
+
+        self._stopped.set()
+        if not self._flusher is None:
+            self._flusher.join()
+            self._flusher = None
+        if MODE_WRITE_NOSYNC in self._modes.values():
+            self._dbenv.log_flush()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self._flush_interval):
+            try:
+                self._dbenv.log_flush()
+            except Exception:
+                log.err("Periodic log flush failed")
+
+    def mode(self, workload=None):
+        return self._modes.get(workload or WORKLOAD_DEFAULT, MODE_SYNC)
+
+    def begin_flags(self, workload=None):
+        """
+        Returns txn_begin flags of workload transactions.
+        """
+
+        if self.mode(workload) == MODE_SYNC:
+            return 0
+        return bdb.DB_TXN_WRITE_NOSYNC
+
+    def committed(self, workload=None):
+        """
+        Should be called after commit of workload transaction.
+        """
+
+        if self.mode(workload) == MODE_GROUP:
+            self._group.wait_durable()
+
+    def stats(self):
+        res = {"modes": dict(self._modes)}
+        if not self._group is None:
+            res["group"] = self._group.stats()
+        return res
+
+    def report(self):
+        log.msg("Transaction durability: {0}".format(", ".join(
+                ["{0}={1}".format(w, self._modes[w]) for w in WORKLOADS])))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+from twisted.python import log
+
+from lib.db_tuning import DB_OPTIONS, FILE_OPTIONS, parse_size, format_size
+
+
+class LayoutError(Exception): pass
+
+
+MODE_SINGLE = "single"
+MODE_GROUPED = "grouped"
+MODE_PER_DATABASE = "per-database"
+MODES = (MODE_SINGLE, MODE_GROUPED, MODE_PER_DATABASE)
+
+# databases read by bind DLZ driver, they are kept in dbfile in any mode
+DLZ_DATABASES = ("dns_data", "dns_zone", "dns_xfr", "dns_client")
+
+# group of logical databases not listed in GROUPS
+GROUP_DEFAULT = "dlz"
+
+# group => logical databases
+GROUPS = {
+    "journal": ("action", "action_index"),
+    "sessions": ("lock", "lock_hier", "session_lock", "lock_wait",
+                 "session", "action_journal", "session_action"),
+    "sync": ("peer", "peer_ack", "peer_dbstate")
+}
+
+GROUP_FILE_FORMAT = "{0}.db"
+DATABASE_FILE_FORMAT = "{0}.db"
+
+
+class Layout(object):
+    """
+    Placement of logical databases into physical files of environment.
+    Modes:
+      single        all databases are subdatabases of dbfile
+      grouped       databases of group share file named after group,
+                      dlz group is kept in dbfile
+      per-database  every database has own file named after it,
+                      databases read by bind are kept in dbfile
+    Group options set file name of group, Database parameters
+      (see lib.db_tuning DB_OPTIONS) for databases of group
+      and file parameters (FILE_OPTIONS) for file of group:
+      layout:
+        mode: grouped
+        groups:
+          journal: {file: journal.db, pagesize: 32K}
+          sessions: {pagesize: 4K}
+    File options of group override group options of tuning, they are
+      applied only to files of the group: databases of group placed into
+      dbfile take file options of dlz group, such options are reported.
+    Per-database tuning options override group ones.
+    """
+
+    def __init__(self, cfg, dbfile, tuning=None):
+        cfg = {} if cfg is None else cfg
+
+        self._dbfile = dbfile
+        self._mode = cfg.get("mode", MODE_SINGLE)
+        if not self._mode in MODES:
+            raise LayoutError("Unknown layout mode '{0}', available: {1}".format(
+                              self._mode, ", ".join(MODES)))
+
+        self._group_of = {}
+        for group, dbnames in GROUPS.iteritems():
+            for dbname in dbnames:
+                self._group_of[dbname] = group
+
+        self._files = {}
+        self._options = {}
+        self._file_options = {}
+        for group in ([] if tuning is None else tuning.groups()):
+            self._check_group(group)
+            self._file_options[group] = tuning.file_options(group)
+
+        for group, options in copy.deepcopy(cfg.get("groups", {})).iteritems():
+            self._check_group(group)
+
+            fname = options.pop("file", None)
+            if not fname is None:
+                if group == GROUP_DEFAULT:
+                    raise LayoutError("File of group '{0}' is dbfile".format(group))
+                self._files[group] = fname
+
+            for name, value in options.iteritems():
+                if FILE_OPTIONS.has_key(name):
+                    specs, target = FILE_OPTIONS, self._file_options
+                elif DB_OPTIONS.has_key(name):
+                    specs, target = DB_OPTIONS, self._options
+                else:
+                    raise LayoutError("Unknown option '{0}' of database "
+                                      "group '{1}'".format(name, group))
+                target.setdefault(group, {})[name] = \
+                    parse_size(value) if specs[name][1] else int(value)
+
+    def _check_group(self, group):
+        if group != GROUP_DEFAULT and not GROUPS.has_key(group):
+            raise LayoutError("Unknown database group '{0}'".format(group))
+
+    def mode(self):
+        return self._mode
+
+    def group(self, dbname):
+        return self._group_of.get(dbname, GROUP_DEFAULT)
+
+    def group_file(self, group):
+        if group == GROUP_DEFAULT:
+            return self._dbfile
+        return self._files.get(group, GROUP_FILE_FORMAT.format(group))
+
+    def file(self, dbname):
+        """
+        Returns name of file holding logical database dbname.
+        """
+
+        if self._mode == MODE_SINGLE or dbname in DLZ_DATABASES:
+            return self._dbfile
+        elif self._mode == MODE_GROUPED:
+            return self.group_file(self.group(dbname))
+        else:
+            return DATABASE_FILE_FORMAT.format(dbname)
+
+    def signature(self):
+        """
+        Returns string identifying placement of databases into files,
+          environments of layouts with equal signatures have the same files.
+        """
+
+        res = [self._mode, self._dbfile]
+        if self._mode == MODE_GROUPED:
+            res += ["{0}={1}".format(group, self.group_file(group))
+                    for group in sorted(GROUPS)]
+        return " ".join(res)
+
+    def file_group(self, dbname):
+        """
+        Returns group which file options apply to file of database dbname.
+        """
+
+        if self.file(dbname) == self._dbfile:
+            return GROUP_DEFAULT
+        return self.group(dbname)
+
+    def apply_db(self, dbname, db):
+        """
+        Set group options and file options of database handle,
+          should be called before open.
+        """
+
+        for name, value in self._options.get(self.group(dbname), {}).iteritems():
+            getattr(db, DB_OPTIONS[name][0])(value)
+
+        for name, value in self._file_options.get(self.file_group(dbname),
+                                                  {}).iteritems():
+            getattr(db, FILE_OPTIONS[name][0])(value)
+
+    def _group_has_file(self, group):
+        return group == GROUP_DEFAULT or self._mode != MODE_SINGLE
+
+    def report(self):
+        def fmt(options, specs):
+            return ", ".join(["{0}={1}".format(name, format_size(options[name])
+                                               if specs[name][1] else options[name])
+                              for name in sorted(options)])
+
+        log.msg("Database file layout '{0}'".format(self._mode))
+        for group in sorted(self._options):
+            log.msg("Database group '{0}' options: {1}".format(group,
+                    fmt(self._options[group], DB_OPTIONS)))
+
+        for group in sorted(self._file_options):
+            if self._group_has_file(group):
+                log.msg("Database group '{0}' file options: {1}".format(group,
+                        fmt(self._file_options[group], FILE_OPTIONS)))
+            else:
+                log.msg("Warning: file options of database group '{0}' are "
+                        "ignored, group has no own file in layout '{1}': "
+                        "{2}".format(group, self._mode,
+                                     fmt(self._file_options[group], FILE_OPTIONS)))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
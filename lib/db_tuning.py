@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+from bsddb3 import db as bdb
+from twisted.python import log
+
+
+class TuningError(Exception): pass
+
+
+SIZE_SUFFIXES = {
+    "K": 1 << 10,
+    "M": 1 << 20,
+    "G": 1 << 30
+}
+
+
+def parse_size(value):
+    """
+    Returns number of bytes from integer or string with K, M or G suffix.
+    """
+
+    if isinstance(value, (int, long)):
+        return value
+
+    value = str(value).strip().upper()
+    try:
+        if value and SIZE_SUFFIXES.has_key(value[-1]):
+            return int(value[:-1]) * SIZE_SUFFIXES[value[-1]]
+        return int(value)
+    except ValueError:
+        raise TuningError("Wrong size value '{0}'".format(value))
+
+
+def format_size(value):
+    for suffix in ("G", "M", "K"):
+        if value >= SIZE_SUFFIXES[suffix] and value % SIZE_SUFFIXES[suffix] == 0:
+            return "{0}{1}".format(value // SIZE_SUFFIXES[suffix], suffix)
+    return str(value)
+
+
+# Environment options: name => (setter, is size)
+ENV_OPTIONS = {
+    "cachesize": ("set_cachesize", True),
+    "cache_regions": (None, False),
+    "log_buffer_size": ("set_lg_bsize", True),
+    "log_file_size": ("set_lg_max", True),
+    "log_region_size": ("set_lg_regionmax", True),
+    "lk_max_lockers": ("set_lk_max_lockers", False),
+    "lk_max_locks": ("set_lk_max_locks", False),
+    "lk_max_objects": ("set_lk_max_objects", False),
+    "tx_max": ("set_tx_max", False),
+    # all databases are opened with DB_MULTIVERSION,
+    #   read transactions use snapshot isolation
+    "multiversion": (None, False)
+}
+
+# Database options: name => (setter, is size)
+DB_OPTIONS = {
+    "bt_minkey": ("set_bt_minkey", False),
+    "h_ffactor": ("set_h_ffactor", False),
+    "h_nelem": ("set_h_nelem", False)
+}
+
+# File options are set by group of databases (see lib.db_layout),
+#   databases sharing file share them: name => (setter, is size)
+FILE_OPTIONS = {
+    "pagesize": ("set_pagesize", True)
+}
+
+
+# Profiles extend the default one, options missing in profile
+#   are left to Berkeley DB defaults (or DB_CONFIG file).
+PROFILES = {
+    "default": {
+        "lk_max_lockers": 100000,
+        "lk_max_locks": 100000,
+        "lk_max_objects": 100000
+    },
+
+    # single node, test and development setups
+    "small": {
+        "cachesize": "32M",
+        "log_buffer_size": "256K",
+        "log_file_size": "10M"
+    },
+
+    # hundreds of thousands zones served by one node
+    "large-zone": {
+        "cachesize": "1G",
+        "cache_regions": 2,
+        "log_buffer_size": "1M",
+        "log_file_size": "64M",
+        "multiversion": 1,
+        "groups": {
+            "dlz": {"pagesize": "16K"}
+        },
+        "databases": {
+            "dns_data": {"h_ffactor": 64, "h_nelem": 2000000}
+        }
+    },
+
+    # many small transactions applied by syncd from several peers
+    "replication-heavy": {
+        "cachesize": "512M",
+        "log_buffer_size": "4M",
+        "log_file_size": "100M",
+        "tx_max": 1000,
+        "multiversion": 1,
+        "groups": {
+            "journal": {"pagesize": "32K"}
+        }
+    }
+}
+PROFILE_DEFAULT = "default"
+
+
+class Tuning(object):
+    """
+    Berkeley DB environment and database tuning options.
+    Options of named profile are merged with options given explicitly:
+      tuning:
+        profile: large-zone
+        cachesize: 2G
+        groups:
+          dlz: {pagesize: 8K}
+        databases:
+          dns_data: {h_ffactor: 64}
+    Page size is the property of file: it is set for group of databases
+      (see lib.db_layout), it takes effect only for groups having own file
+      in configured layout.
+    Environment options take effect when environment region is created,
+      page size and hash options -- when database file is created.
+    """
+
+    def __init__(self, cfg=None):
+        cfg = {} if cfg is None else cfg
+
+        self._profile = cfg.get("profile", PROFILE_DEFAULT)
+        if not PROFILES.has_key(self._profile):
+            raise TuningError("Unknown tuning profile '{0}', available: {1}".format(
+                              self._profile, ", ".join(sorted(PROFILES))))
+
+        self._env = {}
+        self._groups = {}
+        self._databases = {}
+        for source in (PROFILES[PROFILE_DEFAULT], PROFILES[self._profile], cfg):
+            self._merge(copy.deepcopy(source))
+
+    def _merge(self, source):
+        for name, value in source.iteritems():
+            if name in ("profile", "groups", "databases"):
+                continue
+            if not ENV_OPTIONS.has_key(name):
+                raise TuningError("Unknown environment tuning option '{0}'".format(name))
+            self._env[name] = parse_size(value) if ENV_OPTIONS[name][1] else int(value)
+
+        for group, options in source.get("groups", {}).iteritems():
+            gopts = self._groups.setdefault(group, {})
+            for name, value in options.iteritems():
+                if not FILE_OPTIONS.has_key(name):
+                    raise TuningError("Unknown file tuning option '{0}' "
+                                      "for database group '{1}'".format(name, group))
+                gopts[name] = parse_size(value) if FILE_OPTIONS[name][1] else int(value)
+
+        for dbname, options in source.get("databases", {}).iteritems():
+            dbopts = self._databases.setdefault(dbname, {})
+            for name, value in options.iteritems():
+                if FILE_OPTIONS.has_key(name):
+                    raise TuningError("Option '{0}' of database '{1}' is shared by "
+                                      "databases of file, set it for database "
+                                      "group".format(name, dbname))
+                if not DB_OPTIONS.has_key(name):
+                    raise TuningError("Unknown database tuning option '{0}' "
+                                      "for database '{1}'".format(name, dbname))
+                dbopts[name] = parse_size(value) if DB_OPTIONS[name][1] else int(value)
+
+    def profile(self):
+        return self._profile
+
+    def multiversion(self):
+        return bool(self._env.get("multiversion", 0))
+
+    def groups(self):
+        return self._groups.keys()
+
+    def file_options(self, group):
+        """
+        Returns dict of file options of database group.
+        """
+
+        return dict(self._groups.get(group, {}))
+
+    def apply_env(self, dbenv):
+        """
+        Set options of environment handle, should be called before open.
+        """
+
+        for name, value in self._env.iteritems():
+            setter = ENV_OPTIONS[name][0]
+            if name == "cachesize":
+                dbenv.set_cachesize(value >> 30, value & ((1 << 30) - 1),
+                                    self._env.get("cache_regions", 1))
+            elif name == "multiversion":
+                if value:
+                    dbenv.set_flags(bdb.DB_MULTIVERSION, 1)
+            elif not setter is None:
+                getattr(dbenv, setter)(value)
+
+    def apply_db(self, dbname, db):
+        """
+        Set options of database handle, should be called before open.
+        """
+
+        for name, value in self._databases.get(dbname, {}).iteritems():
+            getattr(db, DB_OPTIONS[name][0])(value)
+
+    def report(self):
+        """
+        Log effective tuning options.
+        """
+
+        def fmt(options, specs):
+            return ", ".join(["{0}={1}".format(name, format_size(options[name])
+                                               if specs[name][1] else options[name])
+                              for name in sorted(options)])
+
+        log.msg("Database tuning profile '{0}': {1}".format(self._profile,
+                fmt(self._env, ENV_OPTIONS)))
+        for group in sorted(self._groups):
+            log.msg("Database group '{0}' tuning: {1}".format(group,
+                    fmt(self._groups[group], FILE_OPTIONS)))
+        for dbname in sorted(self._databases):
+            log.msg("Database '{0}' tuning: {1}".format(dbname,
+                    fmt(self._databases[dbname], DB_OPTIONS)))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -1,26 +1,169 @@
 # -*- coding: utf-8 -*-
 
+import struct
 import hashlib
 
+from itertools import islice
+
 from twisted.python import log
 
-from lib.bdb_helpers import get_all, keys, delete, pair_exists
+from lib.database import Transaction
+from lib.dbstate_cache import StateCache
+from lib.bdb_helpers import iter_values, iter_keys, pair_exists
 from lib.common import reorder
 
 
+class DbstateError(Exception): pass
+
+
+class DbstateFormatV1(object):
+    """
+    Format of nodes without dbstate format negotiation.
+    State is md5 of string representation of set of zone data
+      or child states, so any change requires recomputation of the whole
+      level and of all its parents.
+    """
+
+    VERSION = 1
+    INCREMENTAL = False
+    KEY_PREFIX = ""
+    STATE_PREFIX = ""
+
+    def key(self, key):
+        return key
+
+    def owns_key(self, key):
+        return not key.startswith("_") and not ":" in key[:2]
+
+    def make_state(self, data):
+        try:
+            return hashlib.md5(data).hexdigest()
+        except:
+            log.err("Unable to make hash of '{0}'".format(data))
+            return ""
+
+
+class DbstateFormat(object):
+    """
+    Encoding of states and state elements of incremental formats.
+    State is an order-independent multiset hash: sum of element digests
+      modulo 2^128. Element is a tuple of strings.
+    """
+
+    VERSION = None
+    INCREMENTAL = True
+    KEY_PREFIX = ""
+    STATE_PREFIX = ""
+    MODULUS = 1 << 128
+
+    def key(self, key):
+        return self.KEY_PREFIX + key
+
+    def owns_key(self, key):
+        return key.startswith(self.KEY_PREFIX)
+
+    def digest(self, element):
+        assert 0, "Element digest is not implemented"
+
+    def format_state(self, value):
+        return self.STATE_PREFIX + "{0:032x}".format(value % self.MODULUS)
+
+    def state_value(self, state):
+        return int(state[len(self.STATE_PREFIX):], 16)
+
+
+class DbstateFormatV2(DbstateFormat):
+    """
+    Length-prefixed elements hashed with md5.
+    States and state keys are prefixed with format version.
+    """
+
+    VERSION = 2
+    KEY_PREFIX = "2:"
+    STATE_PREFIX = "2:"
+    LENGTH = struct.Struct(">I")
+    DIGEST = struct.Struct(">QQ")
+
+    def digest(self, element):
+        data = "".join([self.LENGTH.pack(len(field)) + field for field in element])
+        high, low = self.DIGEST.unpack(hashlib.md5(data).digest())
+        return (high << 64) | low
+
+
+FORMATS = {
+    1: DbstateFormatV1(),
+    2: DbstateFormatV2()
+}
+
+
+def supported_versions():
+    return sorted(FORMATS.keys())
+
+
+def state_version(state):
+    """
+    Returns version of format of state.
+    """
+
+    for fmt in FORMATS.itervalues():
+        if fmt.STATE_PREFIX and state.startswith(fmt.STATE_PREFIX):
+            return fmt.VERSION
+    return DbstateFormatV1.VERSION
+
+
 class Dbstate(object):
     """
     Class used to manage database data state hierarchy.
     This class is collection of methods and constants and
       supposed to be mixed into another class by inheritance.
+
+    Format of states is versioned, marker record keeps active format
+      version and formats being maintained: states of all maintained
+      formats are updated, reads return states of active format
+      unless other maintained format is requested.
+    Format is changed in steps: states of new format are computed
+      (prepare), new format becomes active (activate) and states of old
+      format are dropped (retire). Nodes of cluster must keep maintaining
+      old format while they may pull actions with states of it
+      (see lib.app.sync).
+
+    States of format 1 are recomputed from all data of the changed
+      resource and then of each of its parents.
+    States of incremental formats are hashes of multisets of elements:
+      the resource state key itself, zone data entries for zone and
+      (child state key, child state) pairs for segment, arena and global.
+      Adding or removing one element changes the state by its digest,
+      so a change is propagated to the global state in O(depth).
+      Zone changes made in transaction are batched and propagated once
+      before commit, zone state reads include pending changes,
+      other state reads and structural changes flush the batch first.
     """
 
+    __slots__ = ()
+
     DELIMITER = "_"
     GLOBAL_STATE = "global"
     ARENA_STATE_PREFIX = "a"
     SEGMENT_STATE_PREFIX = "s"
     ZONE_STATE_PREFIX = "z"
 
+    RECORD_ELEMENT_PREFIX = "d"
+    CLIENT_ELEMENT_PREFIX = "c"
+    XFR_ELEMENT_PREFIX = "x"
+
+    # stores "<active version> [<maintained version> ...]"
+    FORMAT_KEY = "_format"
+    # stores "<version> ..." of maintained formats
+    #   which states are not computed yet
+    FORMAT_PENDING_KEY = "_format_pending"
+    FORMAT_DEFAULT = 1
+
+    # transaction context keys
+    BATCH_CONTEXT_KEY = "dbstate_batch"
+    FORMAT_CONTEXT_KEY = "dbstate_format"
+
+    CONVERSION_BATCH_SIZE = 1000
+
     def _make_key(self, resource_list):
         return self.DELIMITER.join(resource_list)
 
@@ -36,203 +179,771 @@ class Dbstate(object):
     def _zone_key(self, zone):
         return self._make_key([self.ZONE_STATE_PREFIX, zone])
 
-    def _get_state(self, key, database, txn):
+    def _get_record(self, key, database, txn):
         sdb = database.dbpool().dbstate.dbhandle()
-        res = sdb.get(key, None, txn)
-        return res
+        return StateCache.instance(database).get(sdb, key, txn)
 
-    def _make_state(self, data):
-        try:
-            return hashlib.md5(data).hexdigest()
-        except:
-            log.err("Unable to make hash of '{0}'".format(data))
-            return ""
+    def _put_record(self, key, value, database, txn):
+        sdb = database.dbpool().dbstate.dbhandle()
+        StateCache.instance(database).put(sdb, key, value, txn)
 
-    def _del_state(self, key, database, txn):
+    def _del_record(self, key, database, txn):
         sdb = database.dbpool().dbstate.dbhandle()
-        delete(sdb, key, txn)
+        StateCache.instance(database).delete(sdb, key, txn)
+
+    def _get_state(self, fmt, key, database, txn):
+        return self._get_record(fmt.key(key), database, txn)
+
+    def _put_state(self, fmt, key, state, database, txn):
+        self._put_record(fmt.key(key), state, database, txn)
+
+    def _del_state(self, fmt, key, database, txn):
+        self._del_record(fmt.key(key), database, txn)
+
+    def _make_state(self, fmt, elements):
+        value = 0
+        for element in elements:
+            value += fmt.digest(element)
+        return fmt.format_state(value)
+
+    def record_element(self, dkey, rec_data):
+        """
+        Zone element of dns_data record for incremental formats,
+          record id is local to the node and not included.
+        """
+
+        return (self.RECORD_ELEMENT_PREFIX, dkey, rec_data[rec_data.find(' ') + 1:])
+
+    def client_element(self, client):
+        return (self.CLIENT_ELEMENT_PREFIX, client)
 
-    def get_global(self, database, txn=None):
+    def xfr_element(self, host):
+        return (self.XFR_ELEMENT_PREFIX, host)
+
+    def _child_element(self, child_key, child_state):
+        return (child_key, child_state)
+
+    def _elements_delta(self, fmt, added, removed):
+        delta = 0
+        for element in added:
+            delta += fmt.digest(element)
+        for element in removed:
+            delta -= fmt.digest(element)
+        return delta
+
+    def _child_delta(self, fmt, child_key, old, new):
+        delta = 0
+        if not new is None:
+            delta += fmt.digest(self._child_element(child_key, new))
+        if not old is None:
+            delta -= fmt.digest(self._child_element(child_key, old))
+        return delta
+
+    def _change_state(self, fmt, key, delta, database, txn):
+        """
+        Add delta to stored state.
+        Returns (old, new) states, (None, None) if there is no stored state.
+        """
+
+        old = self._get_state(fmt, key, database, txn)
+        if old is None:
+            return (None, None)
+
+        new = fmt.format_state(fmt.state_value(old) + delta)
+        if new != old:
+            self._put_state(fmt, key, new, database, txn)
+
+        return (old, new)
+
+    def _level_state(self, fmt, key, children):
+        """
+        Make state of segment, arena or global from list of
+          (child state key, child state) pairs.
+        """
+
+        if not fmt.INCREMENTAL:
+            return fmt.make_state(str(set([state for _, state in children])))
+
+        elements = [(key,)]
+        for child_key, child_state in children:
+            if not child_state is None:
+                elements.append(self._child_element(child_key, child_state))
+        return self._make_state(fmt, elements)
+
+    def _zone_state(self, fmt, zone, database, txn):
+        zddb = database.dbpool().zone_dns_data.dbhandle()
+        ddb = database.dbpool().dns_data.dbhandle()
+        cdb = database.dbpool().dns_client.dbhandle()
+        xdb = database.dbpool().dns_xfr.dbhandle()
+
+        if not fmt.INCREMENTAL:
+            zone_acc = set()
+            for dkey in iter_values(zddb, zone, txn):
+                zone_acc.add(str(set([rec_data[rec_data.find(' '):]
+                                      for rec_data in iter_values(ddb, dkey, txn)])))
+            zone_acc.add(str(set(iter_values(cdb, zone, txn))))
+            zone_acc.add(str(set(iter_values(xdb, zone, txn))))
+            return fmt.make_state(str(zone_acc))
+
+        elements = [(self._zone_key(zone),)]
+        for dkey in iter_values(zddb, zone, txn):
+            for rec_data in iter_values(ddb, dkey, txn):
+                elements.append(self.record_element(dkey, rec_data))
+
+        for client in iter_values(cdb, zone, txn):
+            elements.append(self.client_element(client))
+
+        for host in iter_values(xdb, zone, txn):
+            elements.append(self.xfr_element(host))
+
+        return self._make_state(fmt, elements)
+
+    def _zone_arena_segment(self, zone, database, txn):
+        zdb = database.dbpool().dns_zone.dbhandle()
+        arena_segment = zdb.get(reorder(zone), None, txn)
+        if not arena_segment is None:
+            aslist = arena_segment.split(' ', 1)
+            if len(aslist) == 2:
+                return aslist
+        return None
+
+    def _read_format(self, database, txn):
+        value = self._get_record(self.FORMAT_KEY, database, txn)
+        if value is None:
+            return (self.FORMAT_DEFAULT, [self.FORMAT_DEFAULT])
+
+        versions = [int(version) for version in value.split()]
+        for version in versions:
+            if not FORMATS.has_key(version):
+                raise DbstateError("Dbstate format version {0} is not "
+                                   "supported".format(version))
+        return (versions[0], versions)
+
+    def _write_format(self, active, maintained, database, txn):
+        versions = [active] + [v for v in maintained if v != active]
+        self._put_record(self.FORMAT_KEY, " ".join([str(v) for v in versions]),
+                         database, txn)
+
+        t = Transaction.lookup(txn) if not txn is None else None
+        if not t is None:
+            t.context().pop(self.FORMAT_CONTEXT_KEY, None)
+
+    def format_version(self, database, txn=None):
+        """
+        Returns (active, maintained) format versions.
+        Marker is read once per transaction.
+        """
+
+        t = Transaction.lookup(txn) if not txn is None else None
+        if t is None:
+            return self._read_format(database, txn)
+
+        res = t.context().get(self.FORMAT_CONTEXT_KEY, None)
+        if res is None:
+            res = self._read_format(database, txn)
+            t.context()[self.FORMAT_CONTEXT_KEY] = res
+        return res
+
+    def ready_versions(self, database, txn=None):
+        """
+        Returns versions of maintained formats which states are computed.
+        """
+
+        maintained = self.format_version(database, txn)[1]
+        value = self._get_record(self.FORMAT_PENDING_KEY, database, txn)
+        if value is None:
+            return maintained
+
+        pending = [int(version) for version in value.split()]
+        return [version for version in maintained if not version in pending]
+
+    def _active_format(self, database, txn):
+        return FORMATS[self.format_version(database, txn)[0]]
+
+    def _read_format_of(self, database, txn, version):
+        """
+        Returns format of version or active format if version is None,
+          None if format of version is not maintained.
+        """
+
+        active, maintained = self.format_version(database, txn)
+        if version is None:
+            return FORMATS[active]
+        if version in maintained:
+            return FORMATS[version]
+        return None
+
+    def _maintained_formats(self, database, txn):
+        return [FORMATS[version] for version in self.format_version(database, txn)[1]]
+
+    def _batch(self, database, txn, create=False):
+        """
+        Returns pending zone changes of transaction:
+          format version => zone => state delta.
+        Changes are batched only in transactions began by Transaction wrapper,
+          batch is flushed before commit. Returns None if there is no batch.
+        """
+
+        t = Transaction.lookup(txn) if not txn is None else None
+        if t is None:
+            return None
+
+        batch = t.context().get(self.BATCH_CONTEXT_KEY, None)
+        if batch is None and create:
+            batch = {}
+            t.context()[self.BATCH_CONTEXT_KEY] = batch
+            t.add_precommit_callback(self.flush_batch, database, txn)
+        return batch
+
+    def flush_batch(self, database, txn=None):
+        """
+        Apply pending zone changes of transaction to stored states,
+          each dirty segment, arena and global state updated once.
+        """
+
+        batch = self._batch(database, txn)
+        if not batch:
+            return
+
+        pending = batch.items()
+        batch.clear()
+
+        for version, zones in pending:
+            self._flush_zones(FORMATS[version], zones, database, txn)
+
+    def _flush_zones(self, fmt, zones, database, txn):
+        segments = {}
+        for zone, delta in zones.iteritems():
+            zkey = self._zone_key(zone)
+            old, new = self._change_state(fmt, zkey, delta, database, txn)
+            if old is None:
+                self._update_zone(fmt, zone, database, txn, True)
+                continue
+
+            arena_segment = self._zone_arena_segment(zone, database, txn)
+            if old != new and not arena_segment is None:
+                arena_segment = tuple(arena_segment)
+                segments[arena_segment] = (segments.get(arena_segment, 0) +
+                                           self._child_delta(fmt, zkey, old, new))
+
+        arenas = {}
+        for (arena, segment), delta in segments.iteritems():
+            skey = self._segment_key(arena, segment)
+            old, new = self._change_state(fmt, skey, delta, database, txn)
+            if old is None:
+                self._update_segment(fmt, arena, segment, database, txn, True)
+            elif old != new:
+                arenas[arena] = (arenas.get(arena, 0) +
+                                 self._child_delta(fmt, skey, old, new))
+
+        global_delta = 0
+        for arena, delta in arenas.iteritems():
+            akey = self._arena_key(arena)
+            old, new = self._change_state(fmt, akey, delta, database, txn)
+            if old is None:
+                self._update_arena(fmt, arena, database, txn, True)
+            elif old != new:
+                global_delta += self._child_delta(fmt, akey, old, new)
+
+        if global_delta:
+            self._change_global(fmt, global_delta, database, txn)
+
+    def get_global(self, database, txn=None, **kwargs):
         """
         Retrieve global state.
+        Keyword argument version selects maintained format (active by default).
         """
 
-        gkey = self._global_key()
-        return self._get_state(gkey, database, txn)
+        self.flush_batch(database, txn)
+        fmt = self._read_format_of(database, txn, kwargs.get("version", None))
+        if fmt is None:
+            return None
+        return self._get_state(fmt, self._global_key(), database, txn)
 
-    def get_arena(self, arena, database, txn=None):
+    def get_arena(self, arena, database, txn=None, **kwargs):
         """
         Retrieve arena state.
+        Keyword argument version selects maintained format (active by default).
         """
 
-        akey = self._arena_key(arena)
-        return self._get_state(akey, database, txn)
+        self.flush_batch(database, txn)
+        fmt = self._read_format_of(database, txn, kwargs.get("version", None))
+        if fmt is None:
+            return None
+        return self._get_state(fmt, self._arena_key(arena), database, txn)
 
-    def get_segment(self, arena, segment, database, txn=None):
+    def get_segment(self, arena, segment, database, txn=None, **kwargs):
         """
         Retrieve segment state.
+        Keyword argument version selects maintained format (active by default).
         """
 
-        skey = self._segment_key(arena, segment)
-        return self._get_state(skey, database, txn)
+        self.flush_batch(database, txn)
+        fmt = self._read_format_of(database, txn, kwargs.get("version", None))
+        if fmt is None:
+            return None
+        return self._get_state(fmt, self._segment_key(arena, segment), database, txn)
 
-    def get_zone(self, zone, database, txn=None):
+    def get_zone(self, zone, database, txn=None, **kwargs):
         """
-        Retrieve zone state.
+        Retrieve zone state, pending changes of transaction included.
+        Keyword argument version selects maintained format (active by default).
         """
 
-        zkey = self._zone_key(zone)
-        return self._get_state(zkey, database, txn)
+        fmt = self._read_format_of(database, txn, kwargs.get("version", None))
+        if fmt is None:
+            return None
+
+        state = self._get_state(fmt, self._zone_key(zone), database, txn)
+
+        batch = self._batch(database, txn)
+        if batch and not state is None:
+            delta = batch.get(fmt.VERSION, {}).get(zone, None)
+            if not delta is None:
+                state = fmt.format_state(fmt.state_value(state) + delta)
+        return state
+
+    def _del_all_formats(self, key, database, txn):
+        self.flush_batch(database, txn)
+        for fmt in self._maintained_formats(database, txn):
+            self._del_state(fmt, key, database, txn)
 
     def del_global(self, database, txn=None):
-        self._del_state(self._global_key(), database, txn)
+        self._del_all_formats(self._global_key(), database, txn)
 
     def del_arena(self, arena, database, txn=None):
-        self._del_state(self._arena_key(arena), database, txn)
+        self._del_all_formats(self._arena_key(arena), database, txn)
 
     def del_segment(self, arena, segment, database, txn=None):
-        self._del_state(self._segment_key(arena, segment), database, txn)
+        self._del_all_formats(self._segment_key(arena, segment), database, txn)
 
     def del_zone(self, zone, database, txn=None):
-        self._del_state(self._zone_key(zone), database, txn)
+        self._del_all_formats(self._zone_key(zone), database, txn)
 
-    def update_global(self, database, txn=None):
+    def change_zone(self, zone, database, txn=None, **kwargs):
         """
-        Update global state.
+        Update zone state and its parents.
+        Keyword arguments added and removed are lists of zone elements
+          (see record_element, client_element, xfr_element).
+        Within transaction began by Transaction wrapper parents are
+          updated once for all changes of transaction (see flush_batch).
         """
 
-        adb = database.dbpool().arena.dbhandle()
-        sdb = database.dbpool().dbstate.dbhandle()
+        added = kwargs.get("added", [])
+        removed = kwargs.get("removed", [])
+        zkey = self._zone_key(zone)
 
-        astate_acc = set()
-        for arena in keys(adb, txn):
-            akey = self._arena_key(arena)
+        for fmt in self._maintained_formats(database, txn):
+            if not fmt.INCREMENTAL:
+                self._update_zone(fmt, zone, database, txn, True)
+                continue
+
+            delta = self._elements_delta(fmt, added, removed)
+
+            batch = self._batch(database, txn, create=True)
+            if (not batch is None and
+                not self._get_state(fmt, zkey, database, txn) is None):
+                zones = batch.setdefault(fmt.VERSION, {})
+                zones[zone] = zones.get(zone, 0) + delta
+                continue
+
+            self.flush_batch(database, txn)
+            old, new = self._change_state(fmt, zkey, delta, database, txn)
+            if old is None:
+                self._update_zone(fmt, zone, database, txn, True)
+            else:
+                self._zone_state_changed(fmt, zone, old, new, database, txn)
+
+    def _zone_state_changed(self, fmt, zone, old, new, database, txn):
+        if old == new:
+            return
+
+        arena_segment = self._zone_arena_segment(zone, database, txn)
+        if arena_segment is None:
+            return
+
+        arena, segment = arena_segment
+        if fmt.INCREMENTAL:
+            self._change_segment(fmt, arena, segment,
+                                 self._child_delta(fmt, self._zone_key(zone), old, new),
+                                 database, txn)
+        else:
+            self._update_segment(fmt, arena, segment, database, txn, True)
 
-            astate = sdb.get(akey, None, txn)
-            if astate is None:
-                astate = self.update_arena(arena, database, txn, cascade=False)
-            astate_acc.add(astate)
+    def _change_segment(self, fmt, arena, segment, delta, database, txn):
+        old, new = self._change_state(fmt, self._segment_key(arena, segment),
+                                      delta, database, txn)
+        if old is None:
+            self._update_segment(fmt, arena, segment, database, txn, True)
+        else:
+            self._segment_state_changed(fmt, arena, segment, old, new, database, txn)
 
-        gstate = self._make_state(str(astate_acc))
-        sdb.put(self._global_key(), gstate, txn)
+    def _segment_state_changed(self, fmt, arena, segment, old, new, database, txn):
+        if old == new:
+            return
 
-        return gstate
+        if fmt.INCREMENTAL:
+            self._change_arena(fmt, arena,
+                               self._child_delta(fmt, self._segment_key(arena, segment),
+                                                 old, new),
+                               database, txn)
+        else:
+            self._update_arena(fmt, arena, database, txn, True)
+
+    def _change_arena(self, fmt, arena, delta, database, txn):
+        old, new = self._change_state(fmt, self._arena_key(arena), delta,
+                                      database, txn)
+        if old is None:
+            self._update_arena(fmt, arena, database, txn, True)
+        else:
+            self._arena_state_changed(fmt, arena, old, new, database, txn)
+
+    def _arena_state_changed(self, fmt, arena, old, new, database, txn):
+        if old == new:
+            return
+
+        if fmt.INCREMENTAL:
+            self._change_global(fmt, self._child_delta(fmt, self._arena_key(arena),
+                                                       old, new),
+                                database, txn)
+        else:
+            self._update_global(fmt, database, txn)
+
+    def _change_global(self, fmt, delta, database, txn):
+        old, new = self._change_state(fmt, self._global_key(), delta, database, txn)
+        if old is None:
+            self._update_global(fmt, database, txn)
+
+    def remove_zone(self, zone, arena, segment, database, txn=None):
+        """
+        Drop state of deleted zone and update states of its parents.
+        """
+
+        self.flush_batch(database, txn)
+        zkey = self._zone_key(zone)
+        for fmt in self._maintained_formats(database, txn):
+            old = self._get_state(fmt, zkey, database, txn)
+            self._del_state(fmt, zkey, database, txn)
+            if fmt.INCREMENTAL and not old is None:
+                self._change_segment(fmt, arena, segment,
+                                     self._child_delta(fmt, zkey, old, None),
+                                     database, txn)
+            else:
+                self._update_segment(fmt, arena, segment, database, txn, True)
+
+    def remove_segment(self, arena, segment, database, txn=None):
+        """
+        Drop state of deleted segment and update states of its parents.
+        """
+
+        self.flush_batch(database, txn)
+        skey = self._segment_key(arena, segment)
+        for fmt in self._maintained_formats(database, txn):
+            old = self._get_state(fmt, skey, database, txn)
+            self._del_state(fmt, skey, database, txn)
+            if fmt.INCREMENTAL and not old is None:
+                self._change_arena(fmt, arena, self._child_delta(fmt, skey, old, None),
+                                   database, txn)
+            else:
+                self._update_arena(fmt, arena, database, txn, True)
+
+    def remove_arena(self, arena, database, txn=None):
+        """
+        Drop state of deleted arena and update global state.
+        """
+
+        self.flush_batch(database, txn)
+        akey = self._arena_key(arena)
+        for fmt in self._maintained_formats(database, txn):
+            old = self._get_state(fmt, akey, database, txn)
+            self._del_state(fmt, akey, database, txn)
+            if fmt.INCREMENTAL and not old is None:
+                self._change_global(fmt, self._child_delta(fmt, akey, old, None),
+                                    database, txn)
+            else:
+                self._update_global(fmt, database, txn)
+
+    def _update_all_formats(self, update, database, txn, *args):
+        self.flush_batch(database, txn)
+
+        active = self._active_format(database, txn)
+        res = None
+        for fmt in self._maintained_formats(database, txn):
+            state = update(fmt, *args)
+            if fmt is active:
+                res = state
+        return res
+
+    def update_global(self, database, txn=None):
+        """
+        Recompute global state.
+        """
+
+        return self._update_all_formats(self._update_global, database, txn,
+                                        database, txn)
 
     def update_arena(self, arena, database, txn=None, **kwargs):
         """
-        Update arena state.
+        Recompute arena state.
         Keyword argument cascade=True (default),
           causes global state update.
         """
 
-        cascade = kwargs.get("cascade", True)
+        return self._update_all_formats(self._update_arena, database, txn,
+                                        arena, database, txn,
+                                        kwargs.get("cascade", True))
+
+    def update_segment(self, arena, segment, database, txn=None, **kwargs):
+        """
+        Recompute segment state.
+        Keyword argument cascade=True (default),
+          causes arena state update with cascade=True.
+        """
+
+        return self._update_all_formats(self._update_segment, database, txn,
+                                        arena, segment, database, txn,
+                                        kwargs.get("cascade", True))
 
+    def update_zone(self, zone, database, txn=None, **kwargs):
+        """
+        Recompute zone state.
+        Keyword argument cascade=True (default),
+          causes segment state update with cascade=True.
+        """
+
+        return self._update_all_formats(self._update_zone, database, txn,
+                                        zone, database, txn,
+                                        kwargs.get("cascade", True))
+
+    def _update_global(self, fmt, database, txn):
+        adb = database.dbpool().arena.dbhandle()
+
+        gkey = self._global_key()
+        children = []
+        for arena in iter_keys(adb, txn):
+            akey = self._arena_key(arena)
+
+            astate = self._get_state(fmt, akey, database, txn)
+            if astate is None:
+                astate = self._update_arena(fmt, arena, database, txn, False)
+            children.append((akey, astate))
+
+        gstate = self._level_state(fmt, gkey, children)
+        self._put_state(fmt, gkey, gstate, database, txn)
+
+        return gstate
+
+    def _update_arena(self, fmt, arena, database, txn, cascade):
         adb = database.dbpool().arena.dbhandle()
         asdb = database.dbpool().arena_segment.dbhandle()
-        sdb = database.dbpool().dbstate.dbhandle()
 
-        sstate_acc = set()
-        for segment in get_all(asdb, arena, txn):
-            skey = self._segment_key(arena, segment)
-            sstate = sdb.get(skey, None, txn)
-            if sstate is None:
-                sstate = self.update_segment(arena, segment, database, txn,
-                                             cascade=False)
-            sstate_acc.add(sstate)
+        akey = self._arena_key(arena)
+        old = self._get_state(fmt, akey, database, txn)
 
         if adb.exists(arena, txn):
-            astate = self._make_state(str(sstate_acc))
-            sdb.put(self._arena_key(arena), astate, txn)
+            children = []
+            for segment in iter_values(asdb, arena, txn):
+                skey = self._segment_key(arena, segment)
+                sstate = self._get_state(fmt, skey, database, txn)
+                if sstate is None:
+                    sstate = self._update_segment(fmt, arena, segment, database, txn,
+                                                  False)
+                children.append((skey, sstate))
+
+            astate = self._level_state(fmt, akey, children)
+            self._put_state(fmt, akey, astate, database, txn)
         else:
-            self.del_arena(arena, database, txn)
+            self._del_state(fmt, akey, database, txn)
             astate = None
 
         if cascade:
-            self.update_global(database, txn)
+            self._arena_state_changed(fmt, arena, old, astate, database, txn)
 
         return astate
 
-    def update_segment(self, arena, segment, database, txn=None, **kwargs):
-        """
-        Update segment state.
-        Keyword argument cascade=True (default),
-          causes arena state update with cascade=True.
-        """
-
-        cascade = kwargs.get("cascade", True)
-
+    def _update_segment(self, fmt, arena, segment, database, txn, cascade):
         asdb = database.dbpool().arena_segment.dbhandle()
         szdb = database.dbpool().segment_zone.dbhandle()
-        sdb = database.dbpool().dbstate.dbhandle()
 
-        zstate_acc = set()
-        szkey = arena + ' ' + segment
-        for zone in get_all(szdb, szkey, txn):
-            zkey = self._zone_key(zone)
-            zstate = sdb.get(zkey, None, txn)
-            if zstate is None:
-                zstate = self.update_zone(zone, database, txn, cascade=False)
-            zstate_acc.add(zstate)
+        skey = self._segment_key(arena, segment)
+        old = self._get_state(fmt, skey, database, txn)
 
         if pair_exists(asdb, arena, segment, txn):
-            sstate = self._make_state(str(zstate_acc))
-            sdb.put(self._segment_key(arena, segment), sstate, txn)
+            children = []
+            szkey = arena + ' ' + segment
+            for zone in iter_values(szdb, szkey, txn):
+                zkey = self._zone_key(zone)
+                zstate = self._get_state(fmt, zkey, database, txn)
+                if zstate is None:
+                    zstate = self._update_zone(fmt, zone, database, txn, False)
+                children.append((zkey, zstate))
+
+            sstate = self._level_state(fmt, skey, children)
+            self._put_state(fmt, skey, sstate, database, txn)
         else:
-            self.del_segment(arena, segment, database, txn)
+            self._del_state(fmt, skey, database, txn)
             sstate = None
 
         if cascade:
-            self.update_arena(arena, database, txn, cascade=True)
+            self._segment_state_changed(fmt, arena, segment, old, sstate,
+                                        database, txn)
 
         return sstate
 
-    def update_zone(self, zone, database, txn=None, **kwargs):
+    def _update_zone(self, fmt, zone, database, txn, cascade):
+        zdb = database.dbpool().dns_zone.dbhandle()
+
+        zkey = self._zone_key(zone)
+        old = self._get_state(fmt, zkey, database, txn)
+
+        if zdb.exists(reorder(zone), txn):
+            zstate = self._zone_state(fmt, zone, database, txn)
+            self._put_state(fmt, zkey, zstate, database, txn)
+        else:
+            self._del_state(fmt, zkey, database, txn)
+            zstate = None
+
+        if cascade:
+            self._zone_state_changed(fmt, zone, old, zstate, database, txn)
+
+        return zstate
+
+    def recompute_all(self, database, version=None):
         """
-        Update zone state.
-        Keyword argument cascade=True (default),
-          causes segment state update with cascade=True.
+        Recompute all states of format version (active by default)
+          from database contents and drop states of resources
+          which no longer exist.
+        Zones are recomputed in separate transactions.
+        Returns (total, changed, stale) numbers of states.
         """
 
-        cascade = kwargs.get("cascade", True)
+        dbpool = database.dbpool()
+        sdb = dbpool.dbstate.dbhandle()
 
-        zdb = database.dbpool().dns_zone.dbhandle()
-        zddb = database.dbpool().zone_dns_data.dbhandle()
-        ddb = database.dbpool().dns_data.dbhandle()
-        cdb = database.dbpool().dns_client.dbhandle()
-        xdb = database.dbpool().dns_xfr.dbhandle()
-        sdb = database.dbpool().dbstate.dbhandle()
+        with database.transaction() as txn:
+            if version is None:
+                version = self.format_version(database, txn)[0]
+            fmt = FORMATS[version]
 
-        zone_acc = set()
+            old_states = dict((key, sdb.get(key, None, txn))
+                              for key in iter_keys(sdb, txn) if fmt.owns_key(key))
+            zones = [reorder(zone_rname) for zone_rname in
+                     iter_keys(dbpool.dns_zone.dbhandle(), txn)]
 
-        for dkey in get_all(zddb, zone, txn):
-            dns_data = str(set([rec_data[rec_data.find(' '):] 
-                                for rec_data in get_all(ddb, dkey, txn)]))
-            zone_acc.add(dns_data)
+        valid = set()
+        for zone in zones:
+            with database.transaction() as txn:
+                if not self._update_zone(fmt, zone, database, txn, False) is None:
+                    valid.add(fmt.key(self._zone_key(zone)))
 
-        dns_client = str(set(get_all(cdb, zone, txn)))
-        zone_acc.add(dns_client)
+        with database.transaction() as txn:
+            for arena in iter_keys(dbpool.arena.dbhandle(), txn):
+                for segment in iter_values(dbpool.arena_segment.dbhandle(), arena, txn):
+                    self._update_segment(fmt, arena, segment, database, txn, False)
+                    valid.add(fmt.key(self._segment_key(arena, segment)))
 
-        dns_xfr = str(set(get_all(xdb, zone, txn)))
-        zone_acc.add(dns_xfr)
+                self._update_arena(fmt, arena, database, txn, False)
+                valid.add(fmt.key(self._arena_key(arena)))
 
-        zone_rname = reorder(zone)
+            self._update_global(fmt, database, txn)
+            valid.add(fmt.key(self._global_key()))
 
-        if zdb.exists(zone_rname, txn):
-            zstate = self._make_state(str(zone_acc))
-            sdb.put(self._zone_key(zone), zstate, txn)
-        else:
-            self.del_zone(zone, database, txn)
-            zstate = None
+            stale = [key for key in iter_keys(sdb, txn)
+                     if fmt.owns_key(key) and not key in valid]
+            for key in stale:
+                self._del_record(key, database, txn)
 
-        if cascade:
-            arena_segment = zdb.get(zone_rname, None, txn)
-            if not arena_segment is None:
-                aslist = arena_segment.split(' ', 1)
-                if len(aslist) == 2:
-                    self.update_segment(aslist[0], aslist[1], database, txn,
-                                        cascade=True)
+            changed = [key for key in valid
+                       if old_states.get(key, None) != sdb.get(key, None, txn)]
 
-        return zstate
+        return (len(valid), len(changed), len(stale))
+
+    def _check_supported(self, version):
+        if not FORMATS.has_key(version):
+            raise DbstateError("Dbstate format version {0} is not "
+                               "supported".format(version))
+
+    def prepare(self, database, version):
+        """
+        Start maintaining states of format version and compute them.
+        Interrupted computation is started anew by the next call.
+        Long running, should be called from thread pool.
+        """
+
+        self._check_supported(version)
+
+        with database.transaction() as txn:
+            if version in self.ready_versions(database, txn):
+                return
+
+            active, maintained = self.format_version(database, txn)
+            if not version in maintained:
+                self._write_format(active, maintained + [version], database, txn)
+            self._put_record(self.FORMAT_PENDING_KEY, str(version), database, txn)
+
+        log.msg("Computing dbstates of format {0}".format(version))
+        self.recompute_all(database, version)
+
+        with database.transaction() as txn:
+            self._del_record(self.FORMAT_PENDING_KEY, database, txn)
+
+        log.msg("Dbstates of format {0} computed".format(version))
+
+    def activate(self, database, version, txn=None):
+        """
+        Make prepared format version active.
+        Actions applied after it get states of this format.
+        """
+
+        self._check_supported(version)
+        if not version in self.ready_versions(database, txn):
+            raise DbstateError("Dbstates of format {0} are not "
+                               "computed".format(version))
+
+        maintained = self.format_version(database, txn)[1]
+        self._write_format(version, maintained, database, txn)
+        log.msg("Dbstate format {0} is active".format(version))
+
+    def retire(self, database):
+        """
+        Stop maintaining formats other than active one and drop their states.
+        """
+
+        with database.transaction() as txn:
+            active, maintained = self.format_version(database, txn)
+            old_fmts = [FORMATS[version] for version in maintained if version != active]
+            if not old_fmts:
+                return
+            self._write_format(active, [active], database, txn)
+
+        # old states are not used anymore, drop them in batches
+        sdb = database.dbpool().dbstate.dbhandle()
+        while True:
+            with database.transaction() as txn:
+                old_keys = list(islice((key for key in iter_keys(sdb, txn)
+                                        if any(fmt.owns_key(key) for fmt in old_fmts)),
+                                       self.CONVERSION_BATCH_SIZE))
+                for key in old_keys:
+                    self._del_record(key, database, txn)
+
+            if len(old_keys) < self.CONVERSION_BATCH_SIZE:
+                break
+
+        log.msg("Dbstates of format {0} dropped".format(
+                ", ".join([str(fmt.VERSION) for fmt in old_fmts])))
+
+    def convert(self, database, version):
+        """
+        Convert stored states to format version at once.
+        Node of cluster must change format in steps coordinated with peers
+          instead (see lib.app.sync).
+        Long running, should be called from thread pool.
+        """
+
+        self.prepare(database, version)
+        with database.transaction() as txn:
+            self.activate(database, version, txn)
+        self.retire(database)
 
 
 # vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from lib.database import Transaction, bdb
+from lib.bdb_helpers import delete
+from lib.generation import GenerationFile
+
+
+class StateCache(object):
+    """
+    Process-local read-through cache of dbstate database records,
+      shared by all threads of the process.
+    Cache is filled only by reads of committed data: reads without
+      transaction and reads in read-only transactions without snapshot
+      isolation (snapshot may be older than committed data).
+    Reads in write transactions take write lock on the record first
+      (DB_RMW existence check, record is not fetched), so concurrent
+      read-modify-write of the same state is serialized: while the lock
+      is held committed value can't change and cached value is current.
+      Records written in transaction are kept in transaction overlay
+      and read from it.
+    Written records are invalidated just before commit while write locks
+      are still held: read which could observe old value either waits
+      for the commit or sees changed generation and is not cached.
+    Processes sharing the environment are kept coherent by generation
+      counter in a file mapped into memory (see lib.generation): it is
+      incremented by every write, cache is dropped when counter differs
+      from the one cache was filled at.
+    Transactions should be began by Transaction wrapper, reads in other
+      transactions bypass the cache.
+    """
+
+    FILENAME = "__dbstate_cache.gen"
+    CONTEXT_KEY = "dbstate_cache"
+    PENDING_CONTEXT_KEY = "dbstate_cache_pending"
+    MAX_SIZE_DEFAULT = 100000
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls, database):
+        """
+        Returns cache of database environment.
+        """
+
+        homedir = database.dbenv_homedir()
+        with cls._instances_lock:
+            cache = cls._instances.get(homedir, None)
+            if cache is None:
+                cache = cls(homedir)
+                cls._instances[homedir] = cache
+            return cache
+
+    def __init__(self, homedir, **kwargs):
+        self._max_size = kwargs.get("max_size", self.MAX_SIZE_DEFAULT)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        self._generation_file = GenerationFile(os.path.join(homedir, self.FILENAME))
+        self._generation = self._generation_file.get()
+
+    def _sync(self):
+        """
+        Drop the cache if another process committed changes.
+        Should be called with lock held.
+        """
+
+        generation = self._generation_file.get()
+        if generation != self._generation:
+            self._values.clear()
+            self._generation = generation
+        return generation
+
+    def _overlay(self, t, create=False):
+        overlay = t.context().get(self.CONTEXT_KEY, None)
+        if overlay is None and create:
+            overlay = {}
+            t.context()[self.CONTEXT_KEY] = overlay
+        return overlay
+
+    def get(self, sdb, key, txn=None):
+        if not txn is None:
+            t = Transaction.lookup(txn)
+            if t is None:
+                return sdb.get(key, None, txn)
+
+            overlay = self._overlay(t)
+            if not overlay is None and overlay.has_key(key):
+                return overlay[key]
+
+            if not t.read_only():
+                return self._get_locked(sdb, key, txn)
+            if t.snapshot():
+                return sdb.get(key, None, txn)
+
+        found, value, generation = self._lookup(key)
+        if found:
+            return value
+
+        value = sdb.get(key, None, txn)
+        self._store(key, value, generation)
+        return value
+
+    def _get_locked(self, sdb, key, txn):
+        exists = sdb.exists(key, txn, bdb.DB_RMW)
+
+        found, value, generation = self._lookup(key)
+        # entry not matching the record is refetched
+        if found and (not value is None) == exists:
+            return value
+
+        value = sdb.get(key, None, txn, bdb.DB_RMW) if exists else None
+        self._store(key, value, generation)
+        return value
+
+    def _lookup(self, key):
+        """
+        Returns (found, value, generation) of cached key.
+        """
+
+        with self._lock:
+            generation = self._sync()
+            if self._values.has_key(key):
+                self._hits += 1
+                return (True, self._values[key], generation)
+            self._misses += 1
+            return (False, None, generation)
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            # value may be already changed if generation moved on
+            if self._sync() == generation:
+                if len(self._values) >= self._max_size:
+                    self._values.clear()
+                self._values[key] = value
+
+    def put(self, sdb, key, value, txn=None):
+        sdb.put(key, value, txn)
+        self._written(key, value, txn)
+
+    def delete(self, sdb, key, txn=None):
+        delete(sdb, key, txn)
+        self._written(key, None, txn)
+
+    def _written(self, key, value, txn):
+        t = Transaction.lookup(txn) if not txn is None else None
+        if t is None:
+            self._invalidate([key])
+            return
+
+        self._overlay(t, create=True)[key] = value
+
+        # keys written after invalidation ran (by other precommit
+        #   callbacks) are invalidated by the next one
+        pending = t.context().get(self.PENDING_CONTEXT_KEY, None)
+        if pending is None:
+            pending = set()
+            t.context()[self.PENDING_CONTEXT_KEY] = pending
+            t.add_precommit_callback(self._invalidate_pending, t, pending)
+        pending.add(key)
+
+    def _invalidate_pending(self, t, pending):
+        t.context().pop(self.PENDING_CONTEXT_KEY, None)
+        self._invalidate(pending)
+
+    def _invalidate(self, written):
+        with self._lock:
+            generation = self._generation_file.increment()
+            if generation == self._generation:
+                for key in written:
+                    self._values.pop(key, None)
+            else:
+                self._values.clear()
+            self._generation = generation + 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        """
+        Returns dict with cache size, hits and misses.
+        """
+
+        with self._lock:
+            return {
+                "size": len(self._values),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
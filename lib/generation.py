@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import fcntl
+import struct
+
+
+class GenerationFile(object):
+    """
+    Counter of changes of data shared by processes, kept in a file
+      mapped into memory. Writers increment it after every change,
+      readers compare it with the value their copy of data was made at.
+    """
+
+    GENERATION = struct.Struct(">Q")
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0660)
+        if os.fstat(self._fd).st_size < self.GENERATION.size:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < self.GENERATION.size:
+                    os.ftruncate(self._fd, self.GENERATION.size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+        self._map = mmap.mmap(self._fd, self.GENERATION.size)
+
+    def get(self):
+        return self.GENERATION.unpack_from(self._map, 0)[0]
+
+    def increment(self):
+        """
+        Returns generation before increment.
+        """
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            generation = self.get()
+            self.GENERATION.pack_into(self._map, 0, generation + 1)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return generation
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
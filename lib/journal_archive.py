@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import errno
+import struct
+import threading
+
+from twisted.python import log
+
+from lib.generation import GenerationFile
+
+
+class JournalArchiveError(Exception): pass
+
+
+class Segment(object):
+    """
+    Append-only file of journal records with positions [first, last].
+    Data file contains concatenated records, index file contains
+      fixed-width (position, offset) entries sorted by position.
+    Both files are read through mmap.
+    Optional keys file lists journal index keys of segment records,
+      one per line, so records are unindexed without decoding.
+    """
+
+    INDEX_ENTRY_FORMAT = ">QQ"
+    INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+
+    DATA_SUFFIX = ".dat"
+    INDEX_SUFFIX = ".idx"
+    KEYS_SUFFIX = ".key"
+    NAME_FORMAT = "{0:020d}-{1:020d}"
+
+    @classmethod
+    def make_name(cls, first, last):
+        return cls.NAME_FORMAT.format(first, last)
+
+    @classmethod
+    def parse_name(cls, name):
+        """
+        Returns (first, last) positions or None if name is not segment name.
+        """
+
+        if not name.endswith(cls.INDEX_SUFFIX):
+            return None
+
+        bounds = name[:-len(cls.INDEX_SUFFIX)].split('-')
+        if len(bounds) != 2 or not bounds[0].isdigit() or not bounds[1].isdigit():
+            return None
+
+        return (int(bounds[0]), int(bounds[1]))
+
+    @classmethod
+    def write(cls, dirpath, records, keys=None):
+        """
+        Write segment from list of (position, record) sorted by position
+          and optional list of journal index keys of records.
+        Files are written under temporary names and renamed when synced,
+          index is renamed last, so segment is visible only when complete.
+        """
+
+        first = records[0][0]
+        last = records[-1][0]
+        name = cls.make_name(first, last)
+        data_path = os.path.join(dirpath, name + cls.DATA_SUFFIX)
+        index_path = os.path.join(dirpath, name + cls.INDEX_SUFFIX)
+        keys_path = os.path.join(dirpath, name + cls.KEYS_SUFFIX)
+
+        if not keys is None:
+            with open(keys_path + ".tmp", 'wb') as f:
+                f.write("".join(key + "\n" for key in keys))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(keys_path + ".tmp", keys_path)
+
+        offset = 0
+        index = []
+        with open(data_path + ".tmp", 'wb') as f:
+            for pos, rec in records:
+                index.append(struct.pack(cls.INDEX_ENTRY_FORMAT, pos, offset))
+                f.write(rec)
+                offset += len(rec)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(index_path + ".tmp", 'wb') as f:
+            f.write("".join(index))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(data_path + ".tmp", data_path)
+        os.rename(index_path + ".tmp", index_path)
+
+        return cls(dirpath, first, last)
+
+    def __init__(self, dirpath, first, last):
+        self.first = first
+        self.last = last
+        name = self.make_name(first, last)
+        self._data_path = os.path.join(dirpath, name + self.DATA_SUFFIX)
+        self._index_path = os.path.join(dirpath, name + self.INDEX_SUFFIX)
+        self._keys_path = os.path.join(dirpath, name + self.KEYS_SUFFIX)
+        self._data = None
+        self._index = None
+        self._size = 0
+
+    def _map_file(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _ensure_mapped(self):
+        if self._index is None:
+            self._data = self._map_file(self._data_path)
+            self._index = self._map_file(self._index_path)
+            self._size = len(self._index) // self.INDEX_ENTRY_SIZE
+
+    def _entry(self, i):
+        begin = i * self.INDEX_ENTRY_SIZE
+        return struct.unpack(self.INDEX_ENTRY_FORMAT,
+                             self._index[begin:begin + self.INDEX_ENTRY_SIZE])
+
+    def _record(self, i):
+        offset = self._entry(i)[1]
+        if i + 1 < self._size:
+            end = self._entry(i + 1)[1]
+        else:
+            end = len(self._data)
+        return self._data[offset:end]
+
+    def _lower_bound(self, pos):
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, pos):
+        self._ensure_mapped()
+        i = self._lower_bound(pos)
+        if i < self._size and self._entry(i)[0] == pos:
+            return self._record(i)
+        return None
+
+    def get_range(self, from_pos, to_pos, number=None):
+        """
+        Returns list of (position, record) with from_pos <= position <= to_pos.
+        """
+
+        self._ensure_mapped()
+        res = []
+        i = self._lower_bound(from_pos)
+        while i < self._size:
+            if not number is None and len(res) >= number:
+                break
+            pos = self._entry(i)[0]
+            if pos > to_pos:
+                break
+            res.append((pos, self._record(i)))
+            i += 1
+        return res
+
+    def keys(self):
+        """
+        Returns list of index keys or None if segment was written without them.
+        """
+
+        try:
+            with open(self._keys_path, 'rb') as f:
+                return f.read().splitlines()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def close(self):
+        for m in (self._data, self._index):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self._data = self._index = None
+
+    def remove(self):
+        self.close()
+        os.remove(self._index_path)
+        os.remove(self._data_path)
+        if os.path.exists(self._keys_path):
+            os.remove(self._keys_path)
+
+
+class JournalArchive(object):
+    """
+    Directory of journal segments holding old journal records.
+    Directory may be changed by another process, every change increments
+      generation file in the directory and segments list is reloaded
+      when generation differs from the one it was loaded at.
+    """
+
+    GENERATION_FILE = "__archive.gen"
+
+    def __init__(self, path):
+        self._path = path
+        self._segments = []
+        self._generation = None
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._generation_file = GenerationFile(os.path.join(path,
+                                                            self.GENERATION_FILE))
+
+    def path(self):
+        return self._path
+
+    def _reload(self):
+        # generation read before listing: change made during listing
+        #   causes another reload next time
+        generation = self._generation_file.get()
+        if generation == self._generation:
+            return
+
+        known = dict(((s.first, s.last), s) for s in self._segments)
+        segments = []
+        for name in sorted(os.listdir(self._path)):
+            bounds = Segment.parse_name(name)
+            if bounds is None:
+                continue
+            seg = known.pop(bounds, None)
+            if seg is None:
+                seg = Segment(self._path, bounds[0], bounds[1])
+            segments.append(seg)
+
+        for seg in known.itervalues():
+            seg.close()
+
+        self._segments = segments
+        self._generation = generation
+
+    def first_position(self):
+        with self._lock:
+            self._reload()
+            if not self._segments:
+                return None
+            return self._segments[0].first
+
+    def last_position(self):
+        with self._lock:
+            self._reload()
+            if not self._segments:
+                return None
+            return self._segments[-1].last
+
+    def get(self, pos):
+        with self._lock:
+            self._reload()
+            for seg in self._segments:
+                if seg.first <= pos <= seg.last:
+                    return seg.get(pos)
+            return None
+
+    def get_range(self, from_pos, to_pos, number=None):
+        """
+        Returns list of (position, record) with from_pos <= position <= to_pos.
+        """
+
+        res = []
+        with self._lock:
+            self._reload()
+            for seg in self._segments:
+                if seg.last < from_pos:
+                    continue
+                if seg.first > to_pos:
+                    break
+
+                left = None if number is None else number - len(res)
+                res += seg.get_range(from_pos, to_pos, left)
+                if not number is None and len(res) >= number:
+                    break
+        return res
+
+    def append(self, records, keys=None):
+        """
+        Write new segment from list of (position, record) sorted by position
+          and optional list of journal index keys of records.
+        Records must follow the last archived position.
+        """
+
+        if not records:
+            return
+
+        with self._lock:
+            self._reload()
+            if self._segments and records[0][0] <= self._segments[-1].last:
+                raise JournalArchiveError("Unable to archive position {0}: already "
+                                          "archived up to {1}".format(
+                                          records[0][0], self._segments[-1].last))
+
+            Segment.write(self._path, records, keys)
+            self._generation_file.increment()
+            self._reload()
+
+    def segments_below(self, pos):
+        """
+        Returns list of (first, last) positions of segments
+          which would be removed by drop_below(pos).
+        """
+
+        with self._lock:
+            self._reload()
+            return [(seg.first, seg.last) for seg in self._segments
+                    if seg.last < pos]
+
+    def segment_keys(self, first, last):
+        """
+        Returns index keys of segment [first, last], None if segment
+          was written without keys or does not exist.
+        """
+
+        with self._lock:
+            self._reload()
+            for seg in self._segments:
+                if (seg.first, seg.last) == (first, last):
+                    return seg.keys()
+            return None
+
+    def drop_below(self, pos):
+        """
+        Remove segments containing only positions less than pos.
+        Files could not be restored, so when removal is a part
+          of database transaction it should be called on commit.
+        Returns number of removed segments.
+        """
+
+        removed = 0
+        with self._lock:
+            self._reload()
+            for seg in self._segments:
+                if seg.last >= pos:
+                    break
+                log.msg("Removing journal archive segment [{0}, {1}]".format(
+                        seg.first, seg.last))
+                seg.remove()
+                removed += 1
+
+            if removed:
+                self._generation_file.increment()
+                self._reload()
+
+        return removed
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+
+
+class JournalCodecError(Exception): pass
+
+
+def _bson_string_field(name):
+    return "\x02" + name + "\x00"
+
+def _bson_int_field(name):
+    return "\x10" + name + "\x00"
+
+
+# Strings repeated in serialized actions, the most frequent ones are
+#   placed at the end of dictionary (deflate prefers closer matches).
+#   Dictionary content must never change: add new dictionary instead.
+_ACTION_STRINGS = [
+    "AddArena", "DelArena", "AddSegment", "DelSegment", "ModAuth",
+    "AddRecord_SOA", "DelRecord_SOA", "AddRecord_SRV", "DelRecord_SRV",
+    "AddRecord_DNAME", "DelRecord_DNAME", "AddRecord_PTR", "DelRecord_PTR",
+    "AddRecord_TXT", "DelRecord_TXT", "AddRecord_MX", "DelRecord_MX",
+    "AddRecord_NS", "DelRecord_NS", "AddRecord_CNAME", "DelRecord_CNAME",
+    "AddZone", "DelZone", "AddRecord_A", "DelRecord_A",
+    _bson_string_field("target"), _bson_string_field("key"),
+    _bson_string_field("primary_ns"), _bson_string_field("resp_person"),
+    _bson_int_field("serial"), _bson_int_field("refresh"),
+    _bson_int_field("retry"), _bson_int_field("expire"),
+    _bson_int_field("minimum"), _bson_string_field("service"),
+    _bson_int_field("port"), _bson_int_field("weight"),
+    _bson_string_field("text"), _bson_string_field("zone_dst"),
+    _bson_int_field("priority"), _bson_string_field("domain"),
+    _bson_string_field("arena"), _bson_string_field("segment"),
+    _bson_string_field("ip"), _bson_int_field("ttl"),
+    _bson_string_field("host"), _bson_string_field("zone")]
+
+# dbstate is 32 chars hex digest (format 1 only)
+DICTIONARY_V1 = "".join(
+    _ACTION_STRINGS +
+    [_bson_string_field("dbstate") + "\x21\x00\x00\x00",
+     "\x03data\x00", _bson_string_field("name")])
+
+# dbstate is 32 chars hex digest of format 1
+#   or "2:" followed by 32 chars hex digest of format 2 (see lib.dbstate)
+DICTIONARY_V2 = "".join(
+    _ACTION_STRINGS +
+    [_bson_string_field("dbstate") + "\x21\x00\x00\x00",
+     _bson_string_field("dbstate") + "\x23\x00\x00\x002:",
+     "\x03data\x00", _bson_string_field("name")])
+
+
+class JournalCodecError(Exception): pass
+
+
+def _bson_string_field(name):
+    return "\x02" + name + "\x00"
+
+def _bson_int_field(name):
+    return "\x10" + name + "\x00"
+
+
+# Strings repeated in serialized actions, the most frequent ones are
+#   placed at the end of dictionary (deflate prefers closer matches).
+#   Dictionary content must never change: add new dictionary instead.
+DICTIONARY_V1 = "".join(
+    ["AddArena", "DelArena", "AddSegment", "DelSegment", "ModAuth",
+     "AddRecord_SOA", "DelRecord_SOA", "AddRecord_SRV", "DelRecord_SRV",
+     "AddRecord_DNAME", "DelRecord_DNAME", "AddRecord_PTR", "DelRecord_PTR",
+     "AddRecord_TXT", "DelRecord_TXT", "AddRecord_MX", "DelRecord_MX",
+     "AddRecord_NS", "DelRecord_NS", "AddRecord_CNAME", "DelRecord_CNAME",
+     "AddZone", "DelZone", "AddRecord_A", "DelRecord_A",
+     _bson_string_field("target"), _bson_string_field("key"),
+     _bson_string_field("primary_ns"), _bson_string_field("resp_person"),
+     _bson_int_field("serial"), _bson_int_field("refresh"),
+     _bson_int_field("retry"), _bson_int_field("expire"),
+     _bson_int_field("minimum"), _bson_string_field("service"),
+     _bson_int_field("port"), _bson_int_field("weight"),
+     _bson_string_field("text"), _bson_string_field("zone_dst"),
+     _bson_int_field("priority"), _bson_string_field("domain"),
+     _bson_string_field("arena"), _bson_string_field("segment"),
+     _bson_string_field("ip"), _bson_int_field("ttl"),
+     _bson_string_field("host"), _bson_string_field("zone"),
+     # dbstate is 32 chars hex digest
+     _bson_string_field("dbstate") + "\x21\x00\x00\x00",
+     "\x03data\x00", _bson_string_field("name")])
+
+
+class JournalCodec(object):
+    """
+    Transparent compression of journal records.
+    Compressed record is a 4-byte header (magic, format, dictionary id)
+      followed by deflate stream primed with preset dictionary.
+    Header never matches the beginning of bson document (4th byte of bson
+      length is zero for documents less than 16M), so records without
+      header are returned as is.
+    Preset dictionary is emulated by copying compressor and decompressor
+      objects which already processed the dictionary.
+    """
+
+    MAGIC = "JZ"
+    FORMAT_DEFLATE = "\x01"
+    HEADER_SIZE = 4
+
+    DICTIONARIES = {
+        1: DICTIONARY_V1,
+        2: DICTIONARY_V2
+    }
+    DICTIONARY_DEFAULT = 2
+
+    def __init__(self, **kwargs):
+        self._compress = kwargs.get("compress", False)
+        self._level = kwargs.get("level", zlib.Z_DEFAULT_COMPRESSION)
+        self._dict_id = kwargs.get("dictionary", self.DICTIONARY_DEFAULT)
+
+        if not self.DICTIONARIES.has_key(self._dict_id):
+            raise JournalCodecError("Unknown compression dictionary "
+                                    "'{0}'".format(self._dict_id))
+
+        self._header = self.MAGIC + self.FORMAT_DEFLATE + chr(self._dict_id)
+        self._compressor = self._make_compressor(self._dict_id)
+        self._decompressors = {}
+        for dict_id in self.DICTIONARIES:
+            self._decompressors[chr(dict_id)] = self._make_decompressor(dict_id)
+
+    def _make_compressor(self, dict_id):
+        c = zlib.compressobj(self._level)
+        c.compress(self.DICTIONARIES[dict_id])
+        c.flush(zlib.Z_SYNC_FLUSH)
+        return c
+
+    def _make_decompressor(self, dict_id):
+        c = zlib.compressobj()
+        prefix = c.compress(self.DICTIONARIES[dict_id]) + c.flush(zlib.Z_SYNC_FLUSH)
+
+        d = zlib.decompressobj()
+        d.decompress(prefix)
+        return d
+
+    def is_encoded(self, record):
+        return (len(record) >= self.HEADER_SIZE and
+                record[:2] == self.MAGIC and record[3] != "\x00")
+
+    def encode(self, record):
+        if not self._compress:
+            return record
+
+        c = self._compressor.copy()
+        return self._header + c.compress(record) + c.flush()
+
+    def decode(self, record):
+        if record is None or not self.is_encoded(record):
+            return record
+
+        if record[2] != self.FORMAT_DEFLATE:
+            raise JournalCodecError("Unknown journal record format "
+                                    "'{0}'".format(ord(record[2])))
+
+        primed = self._decompressors.get(record[3], None)
+        if primed is None:
+            raise JournalCodecError("Unknown compression dictionary "
+                                    "'{0}'".format(ord(record[3])))
+
+        d = primed.copy()
+        return d.decompress(record[self.HEADER_SIZE:]) + d.flush()
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
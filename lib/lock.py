@@ -55,7 +55,9 @@ class manager(object):
         self._database = sp.get('database')
         self._dbpool = database.DatabasePool(self.DATABASES,
                                              self._database.dbenv(),
-                                             self._database.dbfile())
+                                             self._database.dbfile(),
+                                             tuning=self._database.tuning(),
+                                             layout=self._database.layout())
 
     def dbpool(self):
         return self._dbpool
@@ -162,13 +162,18 @@ class SyncClient(SyncService):
     def register_event(self, event):
         return self._es.register_event(event)
 
-    def send_pull_request(self, position):
+    def send_pull_request(self, position, dbstate_versions=None,
+                          dbstate_format=None):
         if self._allowed_state(self.State.OPERATIONAL):
             log.msg("Requesting pull from peer '{0}'".format(self.peer.name))
             msg = {
                 "cmd": Protocol.Cmd.PULL_REQUEST,
                 "position": position
             }
+            if not dbstate_versions is None:
+                msg["dbstate_versions"] = dbstate_versions
+            if not dbstate_format is None:
+                msg["dbstate_format"] = dbstate_format
             self.send_message(msg)
             self._state = self.State.PULL_REQUEST_SENT
 
@@ -230,6 +235,8 @@ class SyncServer(SyncService):
                                 'auth_request_chap',
                                 'auth_challenge')
         self.peer = None
+        self.dbstate_versions = [1]
+        self.dbstate_format = None
 
     def _handle_cmd_auth_request(self, msg):
         if self._allowed_state(self.State.CONNECTED):
@@ -276,6 +283,10 @@ class SyncServer(SyncService):
                          self.peer.name))
                 return
 
+            # peers without dbstate format negotiation support only format 1
+            self.dbstate_versions = msg.get("dbstate_versions", [1])
+            self.dbstate_format = msg.get("dbstate_format", None)
+
             self._state = self.State.PULL_REQUEST_RECEIVED
             d = self._es.retrieve_event('pull_request')
             if not d is None:
@@ -8,8 +8,14 @@ from get_zones import *
 from add_zone import *
 from del_zone import *
 from get_records import *
+from get_record import *
+from get_zone_history import *
+from backup import *
+from get_stats import *
 from add_record import *
 from del_record import *
+from del_record_by_id import *
+from mod_record import *
 from begin_session import *
 from commit_session import *
 from rollback_session import *
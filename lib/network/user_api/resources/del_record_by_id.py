@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from lib.network.user_api.resources.operation_resource import *
+
+
+__all__ = ['DelRecordByIdResource']
+
+
+class DelRecordByIdResource(OperationResource):
+    isLeaf = True
+
+    @request_handler
+    def render_GET(self, request):
+        return self._del_record_handler(request)
+
+    @request_handler
+    def render_POST(self, request):
+        return self._del_record_handler(request)
+
+    def _del_record_handler(self, request):
+        kwargs = self.optional_fields(request.args, 'sessid', 'auth_arena',
+                                          'auth_key', 'id', 'zone', 'host')
+        operation = DelRecordByIdOp(**kwargs)
+
+        d = self.run_operation(operation, request)
+        d.addCallback(self._del_record_done, request)
+        d.addErrback(self.operation_failure, request)
+        d.addErrback(self.unknown_failure, request)
+
+        return server.NOT_DONE_YET
+
+    def _del_record_done(self, _, request):
+        log.msg("Deleting record by id done")
+        self.response(request, 200, {'status': 200})
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from lib.network.user_api.resources.operation_resource import *
+
+
+__all__ = ['GetRecordResource']
+
+
+class GetRecordResource(OperationResource):
+    isLeaf = True
+
+    @request_handler
+    def render_GET(self, request):
+        kwargs = self.optional_fields(request.args, 'sessid', 'auth_arena',
+                                          'auth_key', 'id', 'zone', 'host')
+
+        operation = GetRecordOp(**kwargs)
+
+        d = self.run_operation(operation, request)
+        d.addCallback(self._get_record_done, request)
+        d.addErrback(self.operation_failure, request)
+        d.addErrback(self.unknown_failure, request)
+
+        return server.NOT_DONE_YET
+
+    def _get_record_done(self, res, request):
+        log.msg("Getting record done:", res)
+        self.response(request, 200, {'status': 200, 'data': res})
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
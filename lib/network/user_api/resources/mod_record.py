@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from lib.network.user_api.resources.operation_resource import *
+
+
+__all__ = ['ModRecordResource']
+
+
+class ModRecordResource(OperationResource):
+    isLeaf = True
+
+    @request_handler
+    def render_GET(self, request):
+        return self._mod_record_handler(request)
+
+    @request_handler
+    def render_POST(self, request):
+        return self._mod_record_handler(request)
+
+    def _mod_record_handler(self, request):
+        kwargs = self.optional_fields(request.args, 'sessid', 'auth_arena',
+                                          'auth_key', 'id', 'zone')
+
+        # only given fields are modified
+        rec_spec = self.optional_fields(request.args, 'zone', 'type')
+        rec_spec.update(self.optional_fields(request.args,
+                                             'ttl', 'host', 'ip',
+                                             'domain', 'zone_dst', 'priority',
+                                             'primary_ns', 'resp_person', 'serial',
+                                             'refresh', 'retry', 'expire',
+                                             'minimum', 'weight', 'service',
+                                             'port', 'text'))
+
+        kwargs['rec_spec'] = rec_spec
+        operation = ModRecordOp(**kwargs)
+
+        d = self.run_operation(operation, request)
+        d.addCallback(self._mod_record_done, request)
+        d.addErrback(self.operation_failure, request)
+        d.addErrback(self.unknown_failure, request)
+
+        return server.NOT_DONE_YET
+
+    def _mod_record_done(self, res, request):
+        log.msg("Modifying record done:", res)
+        self.response(request, 200, {'status': 200, 'data': res})
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -13,6 +13,7 @@ from lib.operation import OperationError
 from lib.action import ActionError
 from lib.session import SessionError
 from lib.lock import LockError
+from lib.backup import BackupError
 from lib.event_storage import EventStorage
 
 
@@ -56,7 +57,7 @@ class OperationResource(resource.Resource):
         return d
 
     def operation_failure(self, failure, request):
-        failure.trap(OperationError, ActionError, SessionError, LockError)
+        failure.trap(OperationError, ActionError, SessionError, LockError, BackupError)
         log.msg("Operation failure:", failure)
         self.response(request, 200, {'status': 400,
                                      'error': failure.getErrorMessage()})
@@ -14,4 +14,10 @@ from get_zones import *
 from add_record import *
 from del_record import *
 from get_records import *
+from get_record import *
+from del_record_by_id import *
+from mod_record import *
+from get_zone_history import *
+from backup import *
+from get_stats import *
 from mod_auth import *
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import log
+
+from lib.operations.session_operation import SessionOperation
+from lib.operations.operation_helpers import OperationHelpersMixin
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['BackupOp']
+
+
+class BackupOp(SessionOperation, OperationHelpersMixin):
+    """
+    Take online backup of the database environment (see lib.backup).
+    Returns backup info with journal position of the backup.
+    """
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+        self.name = self.optional_data_by_key(kwargs, 'name', str, None)
+
+    def _run_in_session(self, service_provider, sessid, session_data, **kwargs):
+        log.msg("_run_in_session")
+
+        op_run_defer = defer.Deferred()
+
+        d = self._prepare_stage(service_provider, sessid, session_data)
+        d.addCallback(self._prepare_stage_done, op_run_defer,
+                          service_provider, sessid, session_data)
+        # prepare stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+        return op_run_defer
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+        self._check_access(service_provider, sessid, session_data, None)
+
+    def _prepare_stage_done(self, _, op_run_defer, service_provider,
+                                sessid, session_data):
+        log.msg("_prepare_stage_done")
+
+        # backup never blocks writers, no locks needed
+        d = self._backup_stage(service_provider, sessid, session_data)
+        d.addCallback(self._backup_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # backup stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    @threaded
+    def _backup_stage(self, service_provider, sessid, session_data):
+        log.msg("_backup_stage")
+        return service_provider.get('backup').backup(self.name)
+
+    def _backup_stage_done(self, res, op_run_defer, service_provider,
+                               sessid, session_data):
+        log.msg("_backup_stage_done")
+        op_run_defer.callback(res)
+
+    def _has_access(self, service_provider, sessid, session_data, _):
+        return self.is_admin(session_data)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from twisted.python import log
+
+from lib.operations.del_record import DelRecordOp
+from lib.operations.session_operation import SessionOperation
+from lib.operation import OperationError
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['DelRecordByIdOp']
+
+
+class DelRecordByIdOp(DelRecordOp):
+    """
+    Delete record by record id, record zone (and host) are given too.
+    Record ids are node-local: id returned by one node of cluster
+      does not identify the record on other nodes.
+    The rest of stages are the same as in DelRecordOp.
+    """
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+        self.id = self.required_data_by_key(kwargs, 'id', int)
+        self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        self.host = self.optional_data_by_key(kwargs, 'host', str, None)
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+
+        database_srv = service_provider.get('database')
+        rec_spec = self.get_record_spec(database_srv, self.id, self.zone, self.host)
+        if rec_spec is None:
+            raise OperationError("No such record '{}'".format(self.id))
+
+        # exact record specification is known: no need to retrieve ttl
+        do_action = self.make_del_record(rec_spec['type'], rec_spec)
+        undo_action = self.make_add_record(rec_spec['type'], rec_spec)
+
+        self._check_access(service_provider, sessid, session_data, do_action)
+
+        # retrieve arena and segment of zone needed for lock
+        zone_data = self.get_zone_data(database_srv, do_action.zone)
+        if not zone_data is None:
+            arena = zone_data['arena']
+            segment = zone_data['segment']
+        else:
+            arena = segment = ""
+
+        return (do_action, undo_action, arena, segment)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -55,7 +55,7 @@ class GetArenasOp(SessionOperation, OperationHelpersMixin):
         database_srv = service_provider.get('database')
 
         adb = database_srv.dbpool().arena.dbhandle()
-        with database_srv.transaction() as txn:
+        with database_srv.read_transaction() as txn:
             return bdb_helpers.keys(adb, txn)
 
     def _retrieve_stage_done(self, res, op_run_defer, service_provider, sessid, session_data):
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import log
+
+from lib.operations.session_operation import SessionOperation
+from lib.operations.operation_helpers import OperationHelpersMixin
+from lib.operation import OperationError
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['GetRecordOp']
+
+
+class GetRecordOp(SessionOperation, OperationHelpersMixin):
+    """
+    Retrieve record specification by record id,
+      record zone (and host) are given too.
+    Record ids are node-local: id returned by one node of cluster
+      does not identify the record on other nodes.
+    """
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+        self.id = self.required_data_by_key(kwargs, 'id', int)
+        self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        self.host = self.optional_data_by_key(kwargs, 'host', str, None)
+
+    def _run_in_session(self, service_provider, sessid, session_data, **kwargs):
+        log.msg("_run_in_session")
+
+        op_run_defer = defer.Deferred()
+
+        # check access here and retrieve zone data
+        d = self._prepare_stage(service_provider, sessid, session_data)
+        d.addCallback(self._prepare_stage_done, op_run_defer,
+                          service_provider, sessid, session_data)
+        # prepare stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+        return op_run_defer
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+
+        database_srv = service_provider.get('database')
+        rec_spec = self.get_record_spec(database_srv, self.id, self.zone, self.host)
+        if rec_spec is None:
+            raise OperationError("No such record '{}'".format(self.id))
+
+        self._check_access(service_provider, sessid, session_data, rec_spec)
+
+        zone_data = self.get_zone_data(database_srv, rec_spec['zone'])
+        if not zone_data is None:
+            arena = zone_data['arena']
+            segment = zone_data['segment']
+        else:
+            arena = segment = ""
+
+        return (arena, segment, rec_spec['zone'])
+
+    def _prepare_stage_done(self, zone_data, op_run_defer, service_provider,
+                                sessid, session_data):
+        log.msg("_prepare_stage_done")
+
+        lock_srv = service_provider.get('lock')
+
+        # setup lock stage
+        resource = lock_srv.RESOURCE_DELIMITER.join([self.GLOBAL_RESOURCE] +
+                                                    list(zone_data))
+        d = self._lock_stage(service_provider, resource, sessid)
+        d.addCallback(self._lock_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # lock stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    def _lock_stage_done(self, _, op_run_defer, service_provider,
+                             sessid, session_data):
+        log.msg("_lock_stage_done")
+        d = self._retrieve_stage(service_provider, sessid, session_data)
+        d.addCallback(self._retrieve_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # retrieve stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    @threaded
+    def _retrieve_stage(self, service_provider, sessid, session_data):
+        log.msg("_retrieve_stage")
+        database_srv = service_provider.get('database')
+
+        # record may be deleted before lock is acquired
+        rec_spec = self.get_record_spec(database_srv, self.id, self.zone, self.host)
+        if rec_spec is None:
+            raise OperationError("No such record '{}'".format(self.id))
+
+        return rec_spec
+
+    def _retrieve_stage_done(self, res, op_run_defer, service_provider,
+                                 sessid, session_data):
+        log.msg("_retrieve_stage_done")
+        op_run_defer.callback(res)
+
+    def _has_access(self, service_provider, sessid, session_data, rec_spec):
+        database_srv = service_provider.get('database')
+        return self.has_access_to_zone(database_srv, rec_spec['zone'], session_data)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
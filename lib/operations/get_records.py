@@ -90,11 +90,9 @@ class GetRecordsOp(SessionOperation, OperationHelpersMixin):
         ddb = database_srv.dbpool().dns_data.dbhandle()
         zddb = database_srv.dbpool().zone_dns_data.dbhandle()
 
-        with database_srv.transaction() as txn:
-            zdkeys = bdb_helpers.get_all(zddb, self.zone, txn)
-            for zdkey in zdkeys:
-                recs = bdb_helpers.get_all(ddb, zdkey, txn)
-                for rec in recs:
+        with database_srv.read_transaction() as txn:
+            for zdkey in bdb_helpers.iter_values(zddb, self.zone, txn):
+                for rec in bdb_helpers.iter_values(ddb, zdkey, txn):
                     rec_spec = self.make_rec_spec(zdkey, rec)
                     if not rec_spec is None:
                         res.append(rec_spec)
@@ -78,7 +78,7 @@ class GetSegmentsOp(SessionOperation, OperationHelpersMixin):
         database_srv = service_provider.get('database')
 
         asdb = database_srv.dbpool().arena_segment.dbhandle()
-        with database_srv.transaction() as txn:
+        with database_srv.read_transaction() as txn:
             return bdb_helpers.get_all(asdb, arena, txn)
 
     def _retrieve_stage_done(self, res, op_run_defer, service_provider,
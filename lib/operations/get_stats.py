@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import log
+
+from lib import cursor
+from lib.dbstate_cache import StateCache
+from lib.operations.session_operation import SessionOperation
+from lib.operations.operation_helpers import OperationHelpersMixin
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['GetStatsOp']
+
+
+class GetStatsOp(SessionOperation, OperationHelpersMixin):
+    """
+    Retrieve runtime statistics of the user api process:
+      open cursors (see lib.cursor), deadlocked transactions retries
+      (see lib.database), dbstate cache size, hits and misses
+      (see lib.dbstate_cache), transaction profile if profiler is enabled
+      (see lib.txn_profiler).
+    Checkpoints run in sync daemon, it reports them (see lib.checkpoint).
+    """
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+
+    def _run_in_session(self, service_provider, sessid, session_data, **kwargs):
+        log.msg("_run_in_session")
+
+        op_run_defer = defer.Deferred()
+
+        d = self._prepare_stage(service_provider, sessid, session_data)
+        d.addCallback(self._prepare_stage_done, op_run_defer,
+                          service_provider, sessid, session_data)
+        # prepare stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+        return op_run_defer
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+        self._check_access(service_provider, sessid, session_data, None)
+
+    def _prepare_stage_done(self, _, op_run_defer, service_provider,
+                                sessid, session_data):
+        log.msg("_prepare_stage_done")
+
+        d = self._retrieve_stage(service_provider, sessid, session_data)
+        d.addCallback(self._retrieve_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # retrieve stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    @threaded
+    def _retrieve_stage(self, service_provider, sessid, session_data):
+        log.msg("_retrieve_stage")
+        database = service_provider.get('database')
+        res = {
+            'cursors': cursor.tracker.stats(),
+            'transactions': database.retry_stats(),
+            'dbstate_cache': StateCache.instance(database).stats()
+        }
+
+        profiler = database.profiler()
+        if not profiler is None:
+            res['transaction_profile'] = profiler.stats()
+
+        return res
+
+    def _retrieve_stage_done(self, res, op_run_defer, service_provider,
+                                 sessid, session_data):
+        log.msg("_retrieve_stage_done")
+        op_run_defer.callback(res)
+
+    def _has_access(self, service_provider, sessid, session_data, _):
+        return self.is_admin(session_data)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
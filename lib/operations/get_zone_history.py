@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import log
+
+from lib.operations.session_operation import SessionOperation
+from lib.operations.operation_helpers import OperationHelpersMixin
+from lib.operation import OperationError
+from lib.action import Action
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['GetZoneHistoryOp']
+
+
+class GetZoneHistoryOp(SessionOperation, OperationHelpersMixin):
+    """
+    Retrieve changes of zone between journal positions from the action
+      journal index: either full list of actions (history mode)
+      or net added and deleted resources (diff mode).
+    """
+
+    MODE_HISTORY = 'history'
+    MODE_DIFF = 'diff'
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+        self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        self.from_position = self.optional_data_by_key(kwargs, 'from_position', int, 0)
+        self.to_position = self.optional_data_by_key(kwargs, 'to_position', int, None)
+        self.mode = self.optional_data_by_key(kwargs, 'mode', str, self.MODE_HISTORY)
+
+        if not self.mode in (self.MODE_HISTORY, self.MODE_DIFF):
+            raise OperationError("Unable to construct operation: "
+                                 "wrong operation data: "
+                                 "unknown mode '{0}'".format(self.mode))
+
+    def _run_in_session(self, service_provider, sessid, session_data, **kwargs):
+        log.msg("_run_in_session")
+
+        op_run_defer = defer.Deferred()
+
+        d = self._prepare_stage(service_provider, sessid, session_data)
+        d.addCallback(self._prepare_stage_done, op_run_defer,
+                          service_provider, sessid, session_data)
+        # prepare stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+        return op_run_defer
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+        self._check_access(service_provider, sessid, session_data, None)
+
+    def _prepare_stage_done(self, _, op_run_defer, service_provider,
+                                sessid, session_data):
+        log.msg("_prepare_stage_done")
+
+        # journal is append-only, no need to lock the zone
+        d = self._retrieve_stage(service_provider, sessid, session_data)
+        d.addCallback(self._retrieve_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # retrieve stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    @threaded
+    def _retrieve_stage(self, service_provider, sessid, session_data):
+        log.msg("_retrieve_stage")
+        database_srv = service_provider.get('database')
+        journal_srv = service_provider.get('action_journal')
+
+        with database_srv.read_transaction() as txn:
+            if self.mode == self.MODE_DIFF:
+                return journal_srv.get_zone_diff(self.zone, self.from_position,
+                                                 self.to_position, txn)
+
+            res = []
+            for rec in journal_srv.get_zone_history(self.zone, self.from_position,
+                                                    self.to_position, txn):
+                act = Action.unserialize(rec['action'], trusted=True)
+                data = act.data()
+                data.pop('dbstate', None)
+                res.append({'position': rec['position'],
+                            'name': act.name(),
+                            'data': data})
+            return res
+
+    def _retrieve_stage_done(self, res, op_run_defer, service_provider,
+                                 sessid, session_data):
+        log.msg("_retrieve_stage_done")
+        op_run_defer.callback(res)
+
+    def _has_access(self, service_provider, sessid, session_data, _):
+        database_srv = service_provider.get('database')
+        return self.has_access_to_zone(database_srv, self.zone, session_data)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
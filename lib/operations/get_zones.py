@@ -178,20 +178,20 @@ class GetZonesOp(SessionOperation, OperationHelpersMixin):
     @threaded
     def _get_all_zones_retrieve(self, service_provider, sessid, session_data):
         database_srv = service_provider.get('database')
-        with database_srv.transaction() as txn:
+        with database_srv.read_transaction() as txn:
             return self._get_all_zones(database_srv, txn)
 
     @threaded
     def _get_arena_zones_retrieve(self, service_provider, arena, sessid, session_data):
         database_srv = service_provider.get('database')
-        with database_srv.transaction() as txn:
+        with database_srv.read_transaction() as txn:
             return self._get_arena_zones(database_srv, arena, txn)
 
     @threaded
     def _get_arena_segment_zones_retrieve(self, service_provider, arena, segment,
                                               sessid, session_data):
         database_srv = service_provider.get('database')
-        with database_srv.transaction() as txn:
+        with database_srv.read_transaction() as txn:
             return self._get_arena_segment_zones(database_srv, arena, segment, txn)
 
 
@@ -199,10 +199,8 @@ class GetZonesOp(SessionOperation, OperationHelpersMixin):
 
     def _get_all_zones(self, database_srv, txn):
         szdb = database_srv.dbpool().segment_zone.dbhandle()
-        as_zone_map = bdb_helpers.keys_values(szdb, txn)
-
         res = []
-        for arena_segment, zone in as_zone_map:
+        for arena_segment, zone in bdb_helpers.iter_items(szdb, txn):
             as_list = arena_segment.split(' ', 1)
             if len(as_list) == 2:
                 arena, segment = as_list
@@ -218,7 +216,7 @@ class GetZonesOp(SessionOperation, OperationHelpersMixin):
         asdb = database_srv.dbpool().arena_segment.dbhandle()
 
         res = []
-        for segment in bdb_helpers.get_all(asdb, arena, txn):
+        for segment in bdb_helpers.iter_values(asdb, arena, txn):
             res += self._get_arena_segment_zones(database_srv, arena, segment, txn)
 
         return res
@@ -227,7 +225,7 @@ class GetZonesOp(SessionOperation, OperationHelpersMixin):
         szdb = database_srv.dbpool().segment_zone.dbhandle()
 
         res = []
-        for zone in bdb_helpers.get_all(szdb, arena + ' ' + segment, txn):
+        for zone in bdb_helpers.iter_values(szdb, arena + ' ' + segment, txn):
             res.append({
                 'arena': arena,
                 'segment': segment,
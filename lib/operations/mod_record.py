@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet import reactor, threads, defer
+from twisted.python import log
+
+from lib.operations.operation_helpers import OperationHelpersMixin
+from lib.operations.session_operation import SessionOperation
+from lib.operation import OperationError
+from lib.twisted_helpers import threaded
+
+
+__all__ = ['ModRecordOp']
+
+
+class ModRecordOp(SessionOperation, OperationHelpersMixin):
+    """
+    Modify fields of record given by record id and zone.
+    Record ids are node-local: id returned by one node of cluster
+      does not identify the record on other nodes.
+    Record is replaced: old record deleted and new one added
+      in one transaction, so the record gets new id,
+      which is the result of operation.
+    Host of rec_spec is the new host of record.
+    """
+
+    # fields that identify record and could not be modified
+    FIXED_FIELDS = ('id', 'type', 'zone')
+
+    def __init__(self, **kwargs):
+        SessionOperation.__init__(self, **kwargs)
+        self.id = self.required_data_by_key(kwargs, 'id', int)
+        self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        self._rec_spec = self.required_data_by_key(kwargs, 'rec_spec', dict)
+
+    def _run_in_session(self, service_provider, sessid, session_data, **kwargs):
+        log.msg("_run_in_session")
+
+        op_run_defer = defer.Deferred()
+
+        d = self._prepare_stage(service_provider, sessid, session_data)
+        d.addCallback(self._prepare_stage_done, op_run_defer,
+                          service_provider, sessid, session_data)
+        # prepare stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+        return op_run_defer
+
+    @threaded
+    def _prepare_stage(self, service_provider, sessid, session_data):
+        log.msg("_prepare_stage")
+
+        database_srv = service_provider.get('database')
+        old_spec = self.get_record_spec(database_srv, self.id, self.zone)
+        if old_spec is None:
+            raise OperationError("No such record '{}'".format(self.id))
+
+        new_spec = dict(old_spec)
+        for key, value in self._rec_spec.iteritems():
+            if key in self.FIXED_FIELDS:
+                if str(value).lower() != str(old_spec[key]).lower():
+                    raise OperationError("Record field '{}' could not be "
+                                         "modified".format(key))
+            else:
+                new_spec[key] = value
+
+        # record specification validation also goes here
+        del_action = self.make_del_record(old_spec['type'], old_spec)
+        add_action = self.make_add_record(new_spec['type'], new_spec)
+        actions = (
+            (del_action, self.make_add_record(old_spec['type'], old_spec)),
+            (add_action, self.make_del_record(new_spec['type'], new_spec))
+        )
+
+        self._check_access(service_provider, sessid, session_data, del_action)
+
+        # retrieve arena and segment of zone needed for lock
+        zone_data = self.get_zone_data(database_srv, del_action.zone)
+        if not zone_data is None:
+            arena = zone_data['arena']
+            segment = zone_data['segment']
+        else:
+            arena = segment = ""
+
+        return (actions, arena, segment)
+
+    def _prepare_stage_done(self, data, op_run_defer, service_provider,
+                                sessid, session_data):
+        lock_srv = service_provider.get('lock')
+
+        actions, arena, segment = data
+
+        # setup lock stage
+        resource = lock_srv.RESOURCE_DELIMITER.join([self.GLOBAL_RESOURCE, arena,
+                                                     segment, actions[0][0].zone])
+        d = self._lock_stage(service_provider, resource, sessid)
+        d.addCallback(self._lock_stage_done, op_run_defer, service_provider,
+                          sessid, session_data, actions)
+        # lock stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    def _lock_stage_done(self, _, op_run_defer, service_provider,
+                             sessid, session_data, actions):
+        log.msg("_lock_stage_done")
+        d = self._apply_stage(service_provider, sessid, session_data, actions)
+        d.addCallback(self._apply_stage_done, op_run_defer, service_provider,
+                          sessid, session_data)
+        # apply stage failure causes entire operation failure
+        d.addErrback(op_run_defer.errback)
+
+    @threaded
+    def _apply_stage(self, service_provider, sessid, session_data, actions):
+        log.msg("_apply_stage")
+        database_srv = service_provider.get('database')
+        session_srv = service_provider.get('session')
+
+        def apply_actions(txn):
+            for do_action, undo_action in actions:
+                session_srv.apply_action(sessid, do_action, undo_action, txn=txn)
+
+        # record is never left deleted without its replacement
+        database_srv.run_transaction(apply_actions, name="operations.mod_record")
+        return actions[1][0].record_id
+
+    def _apply_stage_done(self, recid, op_run_defer, service_provider,
+                              sessid, session_data):
+        log.msg("_apply_stage_done")
+        # action applied - finalize operation run
+        op_run_defer.callback({'id': recid})
+
+    def _has_access(self, service_provider, sessid, session_data, action):
+        database_srv = service_provider.get('database')
+        return self.has_access_to_zone(database_srv, action.zone, session_data)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
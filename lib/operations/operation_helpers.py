@@ -8,11 +8,12 @@ from lib.actions.record import RecordAction
 from lib.common import split, reorder
 from lib.defs import ADMIN_ARENA_NAME
 from lib import bdb_helpers
-from lib.database import transactional2
+from lib import record_index
+from lib.database import transactional2, read_transactional2
 
 
 class OperationHelpersMixin(object):
-    @transactional2
+    @read_transactional2
     def _retrieve_record(self, database_srv, zone, host, pred, **kwargs):
         txn = kwargs['txn']
         ddb = database_srv.dbpool().dns_data.dbhandle()
@@ -523,14 +524,41 @@ class OperationHelpersMixin(object):
             rec_map = self._get_rec_map(rec_list[3])
             if not rec_map is None:
                 spec_maker = rec_map['make_spec']
-                return spec_maker(self, zone_data_key, rec_list)
+                spec = spec_maker(self, zone_data_key, rec_list)
+                if not spec is None:
+                    spec['id'] = int(rec_list[0])
+                return spec
             else:
                 return None
         else:
             return None
 
+    @read_transactional2
+    def get_record_spec(self, database_srv, recid, zone, host=None, **kwargs):
+        """
+        Returns specification of record with given id or None.
+        Record ids are node-local (allocated from sequence of the node,
+          see lib.record_index), so the same id may be taken by records
+          of other zones: record is found only if it belongs to given
+          zone (and host if given).
+        """
 
-    @transactional2
+        txn = kwargs['txn']
+        res = record_index.lookup(database_srv, recid, txn)
+        if res is None:
+            return None
+
+        zone_data_key, rec = res
+        # apex records specifications have no host, it is '@' in key
+        rec_zone, _, rec_host = zone_data_key.partition(' ')
+        if rec_zone.lower() != zone.lower():
+            return None
+        if not host is None and rec_host.lower() != host.lower():
+            return None
+        return self.make_rec_spec(zone_data_key, rec)
+
+
+    @read_transactional2
     def get_zone_data(self, database_srv, zone, **kwargs):
         txn = kwargs['txn']
         zdb = database_srv.dbpool().dns_zone.dbhandle()
@@ -546,7 +574,7 @@ class OperationHelpersMixin(object):
         else:
             return None
 
-    @transactional2
+    @read_transactional2
     def get_arena_data(self, database_srv, arena, **kwargs):
         txn = kwargs['txn']
         adb = database_srv.dbpool().arena.dbhandle()
@@ -557,7 +585,7 @@ class OperationHelpersMixin(object):
         else:
             return None
 
-    @transactional2
+    @read_transactional2
     def get_auth_data(self, database_srv, target, **kwargs):
         txn = kwargs['txn']
         aadb = database_srv.dbpool().arena_auth.dbhandle()
@@ -570,14 +598,14 @@ class OperationHelpersMixin(object):
             return None
 
 
-    @transactional2
+    @read_transactional2
     def check_arena_exists(self, database_srv, arena, **kwargs):
         txn = kwargs['txn']
         adb = database_srv.dbpool().arena.dbhandle()
         if not adb.exists(arena, txn):
             raise OperationError("No such arena '{}'".format(arena))
 
-    @transactional2
+    @read_transactional2
     def check_segment_exists(self, database_srv, arena, segment, **kwargs):
         txn = kwargs['txn']
         asdb = database_srv.dbpool().arena_segment.dbhandle()
@@ -585,14 +613,14 @@ class OperationHelpersMixin(object):
             raise OperationError("No such segment '{}' in arena '{}'".format(
                                  segment, arena))
 
-    @transactional2
+    @read_transactional2
     def check_zone_exists(self, database_srv, zone, **kwargs):
         txn = kwargs['txn']
         zdb = database_srv.dbpool().dns_zone.dbhandle()
         if not zdb.exists(reorder(zone), txn):
             raise OperationError("No such zone '{}'".format(zone))
 
-    @transactional2
+    @read_transactional2
     def is_zone_in_arena(self, database_srv, zone, arena, **kwargs):
         txn = kwargs['txn']
         zdb = database_srv.dbpool().dns_zone.dbhandle()
@@ -606,7 +634,7 @@ class OperationHelpersMixin(object):
     def is_admin(self, session_data):
         return session_data['arena'] == ADMIN_ARENA_NAME
 
-    @transactional2
+    @read_transactional2
     def has_access_to_zone(self, database_srv, zone, session_data, **kwargs):
         txn = kwargs['txn']
         arena = session_data['arena']
@@ -619,7 +647,7 @@ class OperationHelpersMixin(object):
     """
     Authentication checker. Raises exception if authentication fails.
     """
-    @transactional2
+    @read_transactional2
     def check_authenticate(self, database_srv, auth_arena, auth_key, **kwargs):
         txn = kwargs['txn']
         aadb = database_srv.dbpool().arena_auth.dbhandle()
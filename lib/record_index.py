@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from twisted.python import log
+
+from lib import bdb_helpers
+
+
+# Index of dns_data records by record id: id => "zone host" key
+#   of dns_data. Maintained by record actions in their transactions.
+#   dns_data has duplicates, so bdb secondary index (DB.associate)
+#   can not be used on it.
+# Record ids are allocated from local sequence, so ids of the same
+#   record differ between nodes.
+
+INDEX_VERSION_KEY = "_ver"
+INDEX_VERSION = "1"
+
+
+def record_id(rec):
+    """
+    Returns id of raw dns_data record "<id> @ <ttl> <type> <data>".
+    """
+
+    return rec.split(' ', 1)[0]
+
+
+def add(database, rec, dkey, txn):
+    ridb = database.dbpool().dns_data_id.dbhandle()
+    ridb.put(record_id(rec), dkey, txn)
+
+
+def remove(database, rec, txn):
+    ridb = database.dbpool().dns_data_id.dbhandle()
+    bdb_helpers.delete(ridb, record_id(rec), txn)
+
+
+def lookup(database, recid, txn):
+    """
+    Returns ("zone host" key, raw record) of record with id recid
+      or None if there is no such record.
+    """
+
+    ridb = database.dbpool().dns_data_id.dbhandle()
+    ddb = database.dbpool().dns_data.dbhandle()
+
+    recid = str(recid)
+    dkey = ridb.get(recid, None, txn)
+    if dkey is None:
+        return None
+
+    for rec in bdb_helpers.iter_values(ddb, dkey, txn):
+        if record_id(rec) == recid:
+            return (dkey, rec)
+    return None
+
+
+def build(database):
+    """
+    One-time indexing of records stored before index was introduced.
+    dns_data is HASH database which could not be walked by chunks in
+      separate transactions (see lib.bdb_helpers), so all records
+      are indexed in one transaction.
+    """
+
+    ridb = database.dbpool().dns_data_id.dbhandle()
+    ddb = database.dbpool().dns_data.dbhandle()
+    if ridb.get(INDEX_VERSION_KEY, None) == INDEX_VERSION:
+        return
+
+    log.msg("Building dns_data record id index")
+
+    total = 0
+    with database.transaction() as txn:
+        for dkey, rec in bdb_helpers.iter_items(ddb, txn):
+            ridb.put(record_id(rec), dkey, txn)
+            total += 1
+
+        # ids are unique, so index holds exactly one entry per record,
+        #   otherwise index is left unmarked and built again on next start
+        indexed = len([key for key, _ in bdb_helpers.iter_items(ridb, txn)
+                       if key != INDEX_VERSION_KEY])
+        if indexed != total:
+            log.err("Record id index has {0} entries for {1} records, "
+                    "index is not marked as built".format(indexed, total))
+            return
+        ridb.put(INDEX_VERSION_KEY, INDEX_VERSION, txn)
+
+    log.msg("Record id index built, {0} records indexed".format(total))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
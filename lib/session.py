@@ -100,7 +100,9 @@ class manager(object):
         self._action_journal = sp.get('action_journal')
         self._dbpool = database.DatabasePool(self.JOURNAL_DATABASES,
                                              self._database.dbenv(),
-                                             self._database.dbfile())
+                                             self._database.dbfile(),
+                                             tuning=self._database.tuning(),
+                                             layout=self._database.layout())
         self._watchdogs = {}
 
     def session(self, *args, **kwargs):
@@ -130,10 +132,8 @@ class manager(object):
         txn = kwargs['txn']
 
         sdb = self.dbpool().session.dbhandle()
-        seq = self.dbpool().session.sequence(txn=txn)
-        id = str(seq.get(1, txn))
+        id = str(self.dbpool().session.allocate(txn=txn))
         sdb.put(id, arena, txn)
-        seq.close()
         sessid = int(id)
 
         return sessid
@@ -146,6 +146,7 @@ class manager(object):
         self._delete_session(sessid, txn)
         actions = self._retrieve_session_actions(sessid, txn)
         actions.sort()
+        act_dumps = []
         for actid in actions:
             data = self._retrieve_action_record(actid, txn)
             if data:
@@ -158,7 +159,9 @@ class manager(object):
                 except:
                     continue
 
-                self._action_journal.record_action_dump(act_dump, txn)
+                act_dumps.append(act_dump)
+
+        self._action_journal.record_action_dumps(act_dumps, txn)
 
         self._unset_session_watchdog(sessid)
 
@@ -183,7 +186,7 @@ class manager(object):
                 except:
                     continue
 
-                act = Action.unserialize(undo_act_dump)
+                act = Action.unserialize(undo_act_dump, trusted=True)
                 act.apply(self._database, txn)
 
         self._unset_session_watchdog(sessid)
@@ -274,9 +277,7 @@ class manager(object):
         data = (str(len(act_dump)) + ' ' + act_dump + ' ' +
                 str(len(undo_act_dump)) + ' ' + undo_act_dump)
 
-        seq = self.dbpool().action_journal.sequence(txn=txn)
-        newid = seq.get(1, txn)
-        seq.close()
+        newid = self.dbpool().action_journal.allocate(txn=txn)
 
         ajdb = self.dbpool().action_journal.dbhandle()
         ajdb.put(str(newid), data, txn)
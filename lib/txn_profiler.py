@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import threading
+
+from twisted.python import log
+
+
+# upper bounds of duration histogram buckets, milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# environment statistics sampled at transaction begin and end:
+#   (stat method, key) => name of delta
+STAT_DELTAS = {
+    ("lock_stat", "nrequests"): "lock_requests",
+    ("lock_stat", "lock_wait"): "lock_waits",
+    ("lock_stat", "ndeadlocks"): "deadlocks",
+    ("txn_stat", "ncommits"): "txn_commits",
+    ("txn_stat", "naborts"): "txn_aborts",
+    ("memp_stat", "cache_hit"): "page_hits",
+    ("memp_stat", "cache_miss"): "page_misses"
+}
+
+_SKIP_FILES = ("database.py", "txn_profiler.py", "functools.py")
+
+
+def _caller():
+    """
+    Returns "module:function" of the first frame outside of transaction code.
+    """
+
+    frame = sys._getframe(2)
+    while not frame is None:
+        fname = os.path.basename(frame.f_code.co_filename)
+        if not fname in _SKIP_FILES:
+            return "{0}:{1}".format(os.path.splitext(fname)[0], frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+class Histogram(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+        ms = value * 1000
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """
+        Returns upper bound of bucket (ms) holding p-th percentile,
+          None for the last unbounded bucket.
+        """
+
+        if not self.count:
+            return 0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+        return None
+
+    def as_dict(self):
+        bounds = ["<={0}ms".format(b) for b in BUCKETS] + [">{0}ms".format(BUCKETS[-1])]
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "buckets": dict([(b, n) for b, n in zip(bounds, self.buckets) if n])
+        }
+
+
+class TransactionProfiler(object):
+    """
+    Collects durations of transactions began by Transaction wrapper,
+      grouped by transaction name (operation, action or method began it,
+      calling function if not named), into histograms.
+    Transactions running longer than slow_threshold seconds are logged
+      with abort reason and, if sample_stats is set, deltas of environment
+      lock, transaction and cache statistics taken over their lifetime.
+    Deltas are environment-wide, so concurrent transactions contribute
+      to them too; sampling takes region mutexes and is off by default.
+    Profile is logged on database shutdown and periodically by syncd,
+      user api exports it by get_stats operation.
+    Configured by txn_profiler option of database service:
+      txn_profiler:
+        slow_threshold: 0.5
+        sample_stats: true
+    """
+
+    SLOW_THRESHOLD_DEFAULT = 1.0
+
+    def __init__(self, dbenv, cfg=None):
+        cfg = {} if cfg is None else cfg
+
+        self._dbenv = dbenv
+        self._slow_threshold = cfg.get("slow_threshold", self.SLOW_THRESHOLD_DEFAULT)
+        self._sample_stats = cfg.get("sample_stats", False)
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._aborts = {}
+        self._slow = 0
+
+    def started(self, t):
+        """
+        Returns profile sample of just began transaction t.
+        """
+
+        name = t.name()
+        if name is None:
+            name = _caller()
+        return (name, time.time(), self._sample() if self._sample_stats else None)
+
+    def finished(self, sample, outcome, reason=None):
+        """
+        Account transaction finished with outcome ("commit" or "abort").
+        """
+
+        name, started, stats = sample
+        duration = time.time() - started
+        deltas = self._deltas(stats) if not stats is None else None
+
+        with self._lock:
+            hist = self._histograms.get(name, None)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.add(duration)
+
+            if outcome == "abort":
+                aborts = self._aborts.setdefault(name, {})
+                aborts[reason] = aborts.get(reason, 0) + 1
+
+            slow = duration >= self._slow_threshold
+            if slow:
+                self._slow += 1
+
+        if slow:
+            msg = "Slow transaction '{0}': {1:.3f}s, {2}".format(name, duration, outcome)
+            if outcome == "abort":
+                msg += " ({0})".format(reason)
+            if deltas:
+                msg += ", " + ", ".join(["{0}={1}".format(k, deltas[k])
+                                         for k in sorted(deltas)])
+            log.msg(msg)
+
+    def _sample(self):
+        res = {}
+        stats = {}
+        for (method, key) in STAT_DELTAS:
+            if not stats.has_key(method):
+                try:
+                    st = getattr(self._dbenv, method)()
+                except Exception:
+                    st = {}
+                # memp_stat returns global and per file statistics
+                stats[method] = st[0] if isinstance(st, tuple) else st
+            res[(method, key)] = stats[method].get(key, 0)
+        return res
+
+    def _deltas(self, before):
+        after = self._sample()
+        return dict([(STAT_DELTAS[k], after[k] - before[k]) for k in before])
+
+    def stats(self):
+        """
+        Returns dict: name => histogram dict with aborts by reason
+          and p50/p99 bucket bounds.
+        """
+
+        with self._lock:
+            res = {}
+            for name, hist in self._histograms.iteritems():
+                desc = hist.as_dict()
+                desc["aborts"] = dict(self._aborts.get(name, {}))
+                desc["p50"] = hist.percentile(50)
+                desc["p99"] = hist.percentile(99)
+                res[name] = desc
+            return res
+
+    def slow_count(self):
+        return self._slow
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._aborts = {}
+            self._slow = 0
+
+    def report(self):
+        """
+        Log transactions sorted by total time spent in them.
+        """
+
+        stats = self.stats()
+        log.msg("Transaction profile: {0} names, {1} slow transactions".format(
+                len(stats), self._slow))
+        for name in sorted(stats, key=lambda n: stats[n]["total"], reverse=True):
+            desc = stats[name]
+            log.msg("  {0}: count={1} total={2:.3f}s max={3:.3f}s p50<={4}ms "
+                    "p99<={5}ms aborts={6}".format(
+                    name, desc["count"], desc["total"], desc["max"],
+                    desc["p50"], desc["p99"], sum(desc["aborts"].values())))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
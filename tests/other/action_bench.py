@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory and throughput of slotted actions compared to dict-backed
+  actions built by the former closure-based field validation.
+Usage: PYTHONPATH=. python tests/other/action_bench.py [number]
+"""
+
+import sys
+import time
+
+from lib.action import Action
+from lib.actions import *
+from lib.common import retrieve_key, cast_type
+
+
+ACTION_DATA = {
+    "zone": "example.com",
+    "host": "www",
+    "ip": "10.0.0.1",
+    "ttl": "300",
+    "dbstate": "0" * 32
+}
+
+
+class DictAction(object):
+    """
+    Dict-backed AddRecord_A as it was before slots.
+    """
+
+    @classmethod
+    def required_data_by_key(cls, action_data, key, type):
+        value = retrieve_key(action_data, key, failure_func=Action.construction_failure,
+                             failure_msg="wrong action data: {0} required".format(key))
+
+        return cast_type(value, type, failure_func=Action.construction_failure,
+                             failure_msg="wrong action data: bad value "
+                                         "'{0}'".format(value))
+
+    @classmethod
+    def optional_data_by_key(cls, action_data, key, type, default):
+        do_typecast = [True]
+        def not_found(_):
+            do_typecast[0] = False
+
+        value = retrieve_key(action_data, key,
+                             failure_func=not_found,
+                             default=default)
+
+        if do_typecast[0]:
+            value = cast_type(value, type, default=default)
+        return value
+
+    def __init__(self, **kwargs):
+        self.dbstate = kwargs.get("dbstate", None)
+        self.zone = self.required_data_by_key(kwargs, 'zone', str)
+        self.host = self.required_data_by_key(kwargs, 'host', str)
+        self.ip = self.required_data_by_key(kwargs, 'ip', str)
+        self.ttl = self.optional_data_by_key(kwargs, 'ttl', int, 100)
+
+
+def instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def measure(name, func, number):
+    start = time.time()
+    for i in xrange(number):
+        func()
+    elapsed = time.time() - start
+    print "{0:<30} {1:>12.0f} ops/s".format(name, number / elapsed)
+
+
+def main(number):
+    print "{0:<30} {1:>12} bytes".format("dict-backed instance",
+                                         instance_size(DictAction(**ACTION_DATA)))
+    print "{0:<30} {1:>12} bytes".format("slotted instance",
+                                         instance_size(AddRecord_A(**ACTION_DATA)))
+
+    act = AddRecord_A(**ACTION_DATA)
+    compact = act.serialize(Action.FORMAT_COMPACT)
+    bson = act.serialize(Action.FORMAT_BSON)
+
+    measure("dict-backed construct", lambda: DictAction(**ACTION_DATA), number)
+    measure("slotted construct", lambda: AddRecord_A(**ACTION_DATA), number)
+    measure("serialize bson", lambda: act.serialize(Action.FORMAT_BSON), number)
+    measure("serialize compact", lambda: act.serialize(Action.FORMAT_COMPACT), number)
+    measure("unserialize bson", lambda: Action.unserialize(bson), number)
+    measure("unserialize compact", lambda: Action.unserialize(compact), number)
+    measure("unserialize compact trusted",
+            lambda: Action.unserialize(compact, trusted=True), number)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
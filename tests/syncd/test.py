@@ -51,7 +51,8 @@ class Test1(unittest.TestCase):
             self.action_journal = self.sp.get("action_journal")
             self.sa_dbpool = lib.database.DatabasePool(SyncApp.DATABASES,
                                                        self.database.dbenv(),
-                                                       self.database.dbfile())
+                                                       self.database.dbfile(),
+                                                       layout=self.database.layout())
 
     def __init__(self, target_server, *args, **kwargs):
         unittest.TestCase.__init__(self, *args, **{})
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests of library modules, each test runs on a fresh database
+  environment in a temporary directory.
+Usage: PYTHONPATH=. python -m unittest discover -s tests/unit -t .
+"""
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+from lib import database
+from lib.service import ServiceProvider
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case with database service on a temporary environment.
+    Subclasses may extend DATABASE_CFG and list other services
+      to initialize in SERVICES.
+    """
+
+    DATABASE_CFG = {}
+    SERVICES = ()
+
+    def setUp(self):
+        self.homedir = tempfile.mkdtemp(prefix="dns_cluster_test_")
+        self.database = self.open_database()
+        self.sp = ServiceProvider()
+        self.sp._instances[self.sp._lookup_srv("database")] = self.database
+        cfg = self.services_cfg()
+        for name in self.SERVICES:
+            self.sp._initialize_srv(self.sp._lookup_srv(name),
+                                    cfg.get(name, {}), cfg)
+
+    def tearDown(self):
+        self.close_database(self.database)
+        shutil.rmtree(self.homedir, ignore_errors=True)
+
+    def patch(self, obj, name, value):
+        """
+        Set attribute of obj for the time of the test.
+        """
+
+        old = getattr(obj, name)
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, old)
+
+    def services_cfg(self):
+        return {}
+
+    def open_database(self, **kwargs):
+        cfg = dict(self.DATABASE_CFG, dbenv_homedir=self.homedir, dbfile="dlz.db")
+        cfg.update(kwargs)
+        return database.manager(None, **cfg)
+
+    def close_database(self, db):
+        db._terminate()
+
+    def dbpool(self):
+        return self.database.dbpool()
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from bson import BSON
+
+from lib.action import Action, ActionError
+from lib.actions import *
+
+
+def make_actions():
+    return [AddRecord_A(zone="example.com", host="www", ip="10.0.0.1", ttl=300),
+            DelRecord_A(zone="example.com", host="www", ip="10.0.0.1"),
+            AddRecord_MX(zone="example.com", host="@", domain="mx.example.com",
+                         priority=10, dbstate="0123456789abcdef"),
+            AddZone(arena="ar", segment="sg", zone="example.com"),
+            AddArena(arena="ar", key="secret")]
+
+
+class ActionFormatTest(unittest.TestCase):
+    def test_bson_is_default(self):
+        act = make_actions()[0]
+        self.assertEqual(Action.serialize_format, Action.FORMAT_BSON)
+        doc = BSON.decode(BSON(act.serialize()))
+        self.assertEqual(doc["name"], "AddRecord_A")
+        self.assertEqual(doc["data"], act.data())
+
+    def test_round_trip(self):
+        for format in Action.FORMATS:
+            for trusted in (False, True):
+                for act in make_actions():
+                    res = Action.unserialize(act.serialize(format), trusted)
+                    self.assertEqual(res.__class__, act.__class__)
+                    self.assertEqual(res.data(), act.data())
+
+    def test_compact_is_smaller(self):
+        act = make_actions()[0]
+        compact = act.serialize(Action.FORMAT_COMPACT)
+        self.assertTrue(Action.is_compact(compact))
+        self.assertFalse(Action.is_compact(act.serialize(Action.FORMAT_BSON)))
+        self.assertTrue(len(compact) < len(act.serialize(Action.FORMAT_BSON)))
+
+    def test_trusted_compact_initializes_state(self):
+        dump = make_actions()[0].serialize(Action.FORMAT_COMPACT)
+        act = Action.unserialize(dump, trusted=True)
+        self.assertEqual(act.record_id, None)
+        self.assertEqual(act.dbstate, None)
+
+    def test_untrusted_compact_validated(self):
+        # required zone is None in dump
+        act = AddRecord_A(zone="example.com", host="www", ip="10.0.0.1")
+        act.zone = None
+        dump = act.serialize(Action.FORMAT_COMPACT)
+        self.assertRaises(ActionError, Action.unserialize, dump)
+
+    def test_malformed_compact(self):
+        dump = make_actions()[0].serialize(Action.FORMAT_COMPACT)
+        self.assertRaises(ActionError, Action.unserialize, dump[:-1], True)
+        self.assertRaises(ActionError, Action.unserialize, dump + "x", True)
+        self.assertRaises(ActionError, Action.unserialize,
+                          dump[:3] + "\x7f" + dump[4:], True)
+
+    def test_unknown_format(self):
+        self.assertRaises(ActionError, Action.set_serialize_format, "xml")
+
+
+class ActionSlotsTest(unittest.TestCase):
+    def test_no_instance_dict(self):
+        for act in make_actions():
+            self.assertFalse(hasattr(act, "__dict__"))
+            self.assertRaises(AttributeError, setattr, act, "unknown", 1)
+
+    def test_registered(self):
+        for act in make_actions():
+            self.assertTrue(Action.registered_actions[act.name()] is act.__class__)
+            self.assertTrue(Action.registered_action_ids[act.ACTION_ID]
+                            is act.__class__)
+
+    def test_schema(self):
+        self.assertEqual(AddRecord_A._schema_keys,
+                         ("dbstate", "zone", "host", "ip", "ttl"))
+        self.assertEqual(AddRecord_A._state_slots, ("record_id",))
+
+    def test_field_typecast(self):
+        act = AddRecord_A(zone="example.com", host="www", ip="10.0.0.1", ttl="300")
+        self.assertEqual(act.ttl, 300)
+        act = AddRecord_MX(zone="example.com", host="@", domain="mx.example.com",
+                           priority="bad")
+        self.assertEqual(act.priority, AddRecord_MX(zone="example.com", host="@",
+                         domain="mx.example.com").priority)
+        self.assertRaises(ActionError, AddRecord_A, zone="example.com", host="www")
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
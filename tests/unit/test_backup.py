@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+from lib import backup
+from lib import checkpoint
+from lib.backup_lock import BackupLock
+from tests.unit.base import DatabaseTestCase
+
+
+class BackupTest(DatabaseTestCase):
+    SERVICES = ("backup", "checkpoint")
+
+    def services_cfg(self):
+        return {"backup": {"backup_dir": os.path.join(self.homedir, "backups")},
+                "checkpoint": {"remove_logs": True}}
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.backup = self.sp.get("backup")
+        self.checkpoint = self.sp.get("checkpoint")
+
+    def test_info(self):
+        info = self.backup.backup("b1")
+        self.assertEqual(info["layout"], "single dlz.db")
+
+        read = backup.manager.read_info(self.backup.backup_path("b1"))
+        self.assertEqual(read["layout"], info["layout"])
+        self.assertEqual([i["name"] for i in self.backup.list_backups()], ["b1"])
+
+    def test_info_without_layout(self):
+        path = self.backup.backup_path("old")
+        os.makedirs(path)
+        backup.manager.write_info(path, {"name": "old", "position": 5, "time": 0,
+                                         "duration": 1.0, "dbfile": "dlz.db"})
+        info = backup.manager.read_info(path)
+        self.assertEqual(info["layout"], "single dlz.db")
+
+    def test_logs_kept_while_backup_copies(self):
+        pruned = threading.Event()
+
+        def prune():
+            self.checkpoint.checkpoint(force=True)
+            pruned.set()
+
+        with BackupLock(self.homedir).shared():
+            thread = threading.Thread(target=prune)
+            thread.start()
+            time.sleep(0.1)
+            self.assertFalse(pruned.is_set())
+        thread.join()
+        self.assertTrue(pruned.is_set())
+
+    def test_backups_share_lock(self):
+        lock = BackupLock(self.homedir)
+        with lock.shared():
+            with lock.shared():
+                pass
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
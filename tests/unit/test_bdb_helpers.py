@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from lib import bdb_helpers
+from lib import database
+from lib.database import bdb
+from tests.unit.base import DatabaseTestCase
+
+
+class HelpersTestCase(DatabaseTestCase):
+    TYPE = bdb.DB_BTREE
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.db = database.Database(self.database.dbenv(), "helpers.db", "helpers",
+                                    self.TYPE, bdb.DB_DUP | bdb.DB_DUPSORT,
+                                    bdb.DB_CREATE)
+        self.dbh = self.db.dbhandle()
+
+        self.records = sorted(("k{0:02d}".format(i), "v{0:02d}".format(j))
+                              for i in xrange(10) for j in xrange(i % 3 + 1))
+        with self.database.transaction() as txn:
+            for key, val in self.records:
+                self.dbh.put(key, val, txn)
+
+    def items(self, **kwargs):
+        with self.database.transaction() as txn:
+            return sorted(bdb_helpers.iter_items(self.dbh, txn, **kwargs))
+
+    def test_iter_items(self):
+        for buffer_size in (1, 2, 7, 1000):
+            self.assertEqual(self.items(buffer_size=buffer_size), self.records)
+
+    def test_iter_values(self):
+        with self.database.transaction() as txn:
+            self.assertEqual(list(bdb_helpers.iter_values(self.dbh, "k05", txn,
+                                                          buffer_size=2)),
+                             ["v00", "v01", "v02"])
+            self.assertEqual(list(bdb_helpers.iter_values(self.dbh, "none", txn)), [])
+
+    def test_delete_while_iterating(self):
+        # every read record is deleted before the next chunk is read
+        with self.database.transaction() as txn:
+            read = []
+            for key, val in bdb_helpers.iter_items(self.dbh, txn, buffer_size=2):
+                read.append((key, val))
+                bdb_helpers.delete_pair(self.dbh, key, val, txn)
+        self.assertEqual(sorted(read), self.records)
+        self.assertEqual(self.items(), [])
+
+    def test_abandoned_iterator(self):
+        with self.database.transaction() as txn:
+            it = bdb_helpers.iter_items(self.dbh, txn, buffer_size=2)
+            it.next()
+        self.assertEqual(self.items(), self.records)
+
+    def test_read_items(self):
+        read = []
+        position = None
+        while True:
+            with self.database.transaction() as txn:
+                chunk = bdb_helpers.read_items(self.dbh, position, 3, txn)
+                # the last read record is deleted before the next chunk
+                if chunk:
+                    bdb_helpers.delete_pair(self.dbh, chunk[-1][0], chunk[-1][1], txn)
+            read += chunk
+            if len(chunk) < 3:
+                break
+            position = chunk[-1]
+        self.assertEqual(read, self.records)
+
+
+class HashHelpersTest(HelpersTestCase):
+    TYPE = bdb.DB_HASH
+
+    def test_read_items(self):
+        self.assertRaises(bdb_helpers.BdbHelpersError,
+                          bdb_helpers.read_items, self.dbh)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
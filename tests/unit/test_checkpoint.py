@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from twisted.python import log
+
+from lib import checkpoint
+from lib.database import bdb
+from tests.unit.base import DatabaseTestCase
+
+
+class CheckpointTestCase(DatabaseTestCase):
+    """
+    Checkpoint service on environment with two log files of 100 bytes.
+    """
+
+    SERVICES = ("checkpoint",)
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.checkpoint = self.sp.get("checkpoint")
+        self.dbenv = self.database.dbenv()
+
+        self.archive_calls = []
+        log_archive = self.dbenv.log_archive
+        def record(flags=0):
+            self.archive_calls.append(flags)
+            return log_archive(flags)
+        self.patch(self.dbenv, "log_archive", record)
+
+        for i in (1, 2):
+            with open(os.path.join(self.homedir, "log.{0:010d}".format(i)), "w") as f:
+                f.write("x" * 100)
+
+
+class CheckpointTest(CheckpointTestCase):
+    def test_logs_removed_by_default(self):
+        self.checkpoint.checkpoint(force=True)
+        self.assertTrue(bdb.DB_ARCH_REMOVE in self.archive_calls)
+        stats = self.checkpoint.stats()
+        self.assertEqual((stats["logs_archived"], stats["logs_removed"]), (0, 2))
+
+    def test_stats(self):
+        stats = self.checkpoint.stats()
+        self.assertEqual(stats["checkpoints"], 0)
+        self.assertEqual((stats["log_files"], stats["log_bytes"]), (2, 200))
+        self.assertTrue("recovery_duration" in stats)
+
+        self.checkpoint.checkpoint(force=True)
+        self.assertEqual(self.checkpoint.stats()["checkpoints"], 1)
+
+    def test_report(self):
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            self.checkpoint._log_stats(self.checkpoint.stats())
+        finally:
+            log.removeObserver(observer)
+
+        report = [msg for msg in messages if msg.startswith("Checkpoint stats: ")]
+        self.assertEqual(len(report), 1)
+        self.assertTrue("checkpoints=0, " in report[0])
+        self.assertTrue("log_files=2, " in report[0])
+
+
+class KeepLogsCheckpointTest(CheckpointTestCase):
+    def services_cfg(self):
+        return {"checkpoint": {"remove_logs": False}}
+
+    def test_logs_kept(self):
+        self.checkpoint.checkpoint(force=True)
+        self.assertFalse(bdb.DB_ARCH_REMOVE in self.archive_calls)
+        stats = self.checkpoint.stats()
+        self.assertEqual((stats["logs_archived"], stats["logs_removed"]), (0, 0))
+
+
+class ArchiveCheckpointTest(CheckpointTestCase):
+    def services_cfg(self):
+        return {"checkpoint": {"log_archive_dir": os.path.join(self.homedir,
+                                                               "archive")}}
+
+    def test_logs_archived(self):
+        self.checkpoint.checkpoint(force=True)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.homedir, "archive"))),
+                         ["log.0000000001", "log.0000000002"])
+        stats = self.checkpoint.stats()
+        self.assertEqual(stats["logs_archived"], 2)
+        self.assertEqual((stats["log_files"], stats["log_bytes"]), (0, 0))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from lib.cursor import open_cursor, tracker
+from tests.unit.base import DatabaseTestCase
+
+
+class CursorTrackerTest(DatabaseTestCase):
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.dbh = self.dbpool().arena.dbhandle()
+        self.thread = threading.current_thread().name
+
+    def open_number(self):
+        return tracker.stats()["open"].get(self.thread, 0)
+
+    def test_closed_by_owner(self):
+        stats = tracker.stats()
+        with self.database.transaction() as txn:
+            with open_cursor(self.dbh, txn) as c:
+                self.assertEqual(self.open_number(), 1)
+            self.assertTrue(c.closed())
+            self.assertEqual(self.open_number(), 0)
+
+        self.assertEqual(tracker.stats()["opened"], stats["opened"] + 1)
+        self.assertEqual(tracker.stats()["leaked"], stats["leaked"])
+
+    def test_closed_by_transaction(self):
+        leaked = tracker.stats()["leaked"]
+        for commit in (True, False):
+            t = self.database.transaction()
+            txn = t.begin()
+            c = open_cursor(self.dbh, txn)
+            if commit:
+                t.commit()
+            else:
+                t.rollback()
+            self.assertTrue(c.closed())
+            self.assertEqual(self.open_number(), 0)
+        self.assertEqual(tracker.stats()["leaked"], leaked + 2)
+
+    def test_debug_records_site(self):
+        self.patch(tracker, "_debug", True)
+        with self.database.transaction() as txn:
+            with open_cursor(self.dbh, txn) as c:
+                self.assertTrue("test_debug_records_site" in "".join(c.site))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
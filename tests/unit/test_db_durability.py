@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+
+from lib.database import Transaction, bdb
+from lib.db_durability import Durability, DurabilityError, GroupCommit, \
+                              WORKLOAD_REPLICATION
+from tests.unit.base import DatabaseTestCase
+
+
+class Env(object):
+    """
+    Environment counting log flushes.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.flushes = 0
+        self.lock = threading.Lock()
+
+    def log_flush(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.flushes += 1
+
+
+class DurabilityTest(unittest.TestCase):
+    def test_config(self):
+        self.assertRaises(DurabilityError, Durability, {"default": "async"})
+        self.assertRaises(DurabilityError, Durability, {"bulk": "sync"})
+
+        durability = Durability({"replication": "write-nosync"})
+        self.assertEqual(durability.mode(), "sync")
+        self.assertEqual(durability.mode(WORKLOAD_REPLICATION), "write-nosync")
+
+    def test_begin_flags(self):
+        durability = Durability({"default": "group", "replication": "write-nosync"})
+        self.assertEqual(durability.begin_flags(), bdb.DB_TXN_WRITE_NOSYNC)
+        self.assertEqual(durability.begin_flags(WORKLOAD_REPLICATION),
+                         bdb.DB_TXN_WRITE_NOSYNC)
+        self.assertEqual(Durability().begin_flags(WORKLOAD_REPLICATION), 0)
+
+    def test_flusher(self):
+        env = Env()
+        durability = Durability({"replication": "write-nosync",
+                                 "flush_interval": 0.01})
+        durability.start(env)
+        time.sleep(0.1)
+        durability.stop()
+        flushes = env.flushes
+        self.assertTrue(flushes >= 3)
+        # log is flushed on stop, flusher is not running after it
+        time.sleep(0.05)
+        self.assertEqual(env.flushes, flushes)
+
+    def test_stop_once(self):
+        env = Env()
+        durability = Durability({"replication": "write-nosync"})
+        durability.start(env)
+        durability.stop()
+        durability.stop()
+        self.assertEqual(env.flushes, 1)
+
+    def test_no_flusher(self):
+        env = Env()
+        durability = Durability()
+        durability.start(env)
+        durability.stop()
+        self.assertEqual(env.flushes, 0)
+
+
+class GroupCommitTest(unittest.TestCase):
+    def test_commits_share_flush(self):
+        env = Env(delay=0.01)
+        group = GroupCommit(env, 0.005)
+        durable = []
+
+        def commit():
+            group.wait_durable()
+            durable.append(env.flushes)
+
+        threads = [threading.Thread(target=commit) for i in xrange(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = group.stats()
+        self.assertEqual(stats["commits"], 20)
+        self.assertEqual(stats["flushes"], env.flushes)
+        self.assertTrue(env.flushes < 20)
+        # every commit waited for flush
+        self.assertEqual(len(durable), 20)
+        self.assertTrue(min(durable) >= 1)
+
+    def test_single_commit(self):
+        env = Env()
+        group = GroupCommit(env, 0)
+        group.wait_durable()
+        group.wait_durable()
+        self.assertEqual(group.stats(), {"commits": 2, "flushes": 2})
+
+
+class WorkloadTransactionTest(DatabaseTestCase):
+    DATABASE_CFG = {"durability": {"replication": "group", "group_window": 0}}
+
+    def begin_flags(self, workload):
+        with self.database.transaction(workload=workload) as txn:
+            return Transaction.lookup(txn)._flags
+
+    def test_workload_transactions(self):
+        self.assertEqual(self.begin_flags(None), 0)
+        self.assertEqual(self.begin_flags(WORKLOAD_REPLICATION),
+                         bdb.DB_TXN_WRITE_NOSYNC)
+
+        self.database.run_transaction(lambda txn: None,
+                                      workload=WORKLOAD_REPLICATION)
+        stats = self.database.durability().stats()
+        self.assertEqual(stats["modes"], {"default": "sync", "replication": "group"})
+        # committed replication transactions waited for flush
+        self.assertEqual(stats["group"]["commits"], 2)
+        self.assertEqual(stats["group"]["flushes"], 2)
+
+    def test_terminated_once(self):
+        closed = []
+        dbenv = self.database.dbenv()
+        close = dbenv.close
+        self.patch(dbenv, "close", lambda *args: closed.append(args) or close(*args))
+        # explicit shutdown before the one run at exit
+        self.close_database(self.database)
+        self.close_database(self.database)
+        self.assertEqual(len(closed), 1)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
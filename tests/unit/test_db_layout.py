@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from lib import database
+from lib import bdb_helpers
+from lib.database import bdb
+from lib.db_layout import Layout, LayoutError
+from tests.unit.base import DatabaseTestCase
+from tools import migrate_layout
+
+
+class LayoutTest(unittest.TestCase):
+    def test_single(self):
+        layout = Layout(None, "dlz.db")
+        for dbname in ("dns_data", "action", "session", "custom"):
+            self.assertEqual(layout.file(dbname), "dlz.db")
+
+    def test_grouped(self):
+        layout = Layout({"mode": "grouped",
+                         "groups": {"journal": {"file": "j.db"}}}, "dlz.db")
+        self.assertEqual(layout.file("dns_data"), "dlz.db")
+        self.assertEqual(layout.file("custom"), "dlz.db")
+        self.assertEqual(layout.file("action"), "j.db")
+        self.assertEqual(layout.file("action_index"), "j.db")
+        self.assertEqual(layout.file("session"), "sessions.db")
+        self.assertEqual(layout.file("peer"), "sync.db")
+
+    def test_per_database(self):
+        layout = Layout({"mode": "per-database"}, "dlz.db")
+        # databases read by bind are kept in dbfile
+        self.assertEqual(layout.file("dns_zone"), "dlz.db")
+        self.assertEqual(layout.file("action"), "action.db")
+        self.assertEqual(layout.file("custom"), "custom.db")
+
+    def test_signature(self):
+        self.assertEqual(Layout(None, "dlz.db").signature(), "single dlz.db")
+        self.assertNotEqual(
+            Layout({"mode": "grouped"}, "dlz.db").signature(),
+            Layout({"mode": "grouped", "groups": {"sync": {"file": "s.db"}}},
+                   "dlz.db").signature())
+
+    def test_wrong_config(self):
+        self.assertRaises(LayoutError, Layout, {"mode": "sparse"}, "dlz.db")
+        self.assertRaises(LayoutError, Layout, {"groups": {"none": {}}}, "dlz.db")
+        self.assertRaises(LayoutError, Layout,
+                          {"groups": {"dlz": {"file": "other.db"}}}, "dlz.db")
+        self.assertRaises(LayoutError, Layout,
+                          {"groups": {"journal": {"cachesize": "1M"}}}, "dlz.db")
+
+
+class MigrateLayoutTest(DatabaseTestCase):
+    SPEC = {"type": bdb.DB_BTREE, "flags": 0, "open_flags": bdb.DB_CREATE}
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.dbenv = self.database.dbenv()
+        self.records = [("k{0:02d}".format(i), "v{0}".format(i)) for i in xrange(10)]
+
+        src = self.open_db("dlz.db")
+        with database.Transaction(self.dbenv) as txn:
+            for key, value in self.records:
+                src.put(key, value, txn)
+        src.close()
+
+    def open_db(self, fname):
+        return database.Database(self.dbenv, fname, "moved", self.SPEC["type"],
+                                 self.SPEC["flags"], self.SPEC["open_flags"]).dbhandle()
+
+    def items(self, db):
+        with database.Transaction(self.dbenv) as txn:
+            return sorted(bdb_helpers.iter_items(db, txn))
+
+    def test_migrate(self):
+        self.patch(migrate_layout, "BATCH_SIZE", 3)
+        layout = Layout({"mode": "per-database"}, "dlz.db")
+        total = migrate_layout.migrate_database(self.dbenv, "moved", self.SPEC,
+                                                "dlz.db", "moved.db", None, layout)
+        self.assertEqual(total, len(self.records))
+        self.assertTrue(os.path.exists(os.path.join(self.homedir, "moved.db")))
+        self.assertEqual(migrate_layout.open_source(self.dbenv, "dlz.db", "moved"), None)
+
+        dst = self.open_db("moved.db")
+        self.assertEqual(self.items(dst), self.records)
+        dst.close()
+
+    def test_migrate_interrupted(self):
+        # records of interrupted run are both in source and target
+        dst = self.open_db("moved.db")
+        with database.Transaction(self.dbenv) as txn:
+            dst.put(*(self.records[0] + (txn,)))
+        dst.close()
+
+        layout = Layout({"mode": "per-database"}, "dlz.db")
+        total = migrate_layout.migrate_database(self.dbenv, "moved", self.SPEC,
+                                                "dlz.db", "moved.db", None, layout)
+        self.assertEqual(total, len(self.records))
+
+        dst = self.open_db("moved.db")
+        self.assertEqual(self.items(dst), self.records)
+        dst.close()
+
+    def test_no_source(self):
+        layout = Layout({"mode": "per-database"}, "dlz.db")
+        self.assertEqual(migrate_layout.migrate_database(
+                         self.dbenv, "missing", self.SPEC, "dlz.db", "missing.db",
+                         None, layout), 0)
+
+
+class GroupedDatabaseTest(DatabaseTestCase):
+    DATABASE_CFG = {"layout": {"mode": "grouped",
+                               "groups": {"sessions": {"file": "s.db"}}}}
+
+    def test_files(self):
+        spec = dict(MigrateLayoutTest.SPEC)
+        dbpool = database.DatabasePool({"session": spec, "dns_client": spec},
+                                       self.database.dbenv(), self.database.dbfile(),
+                                       layout=self.database.layout())
+        with self.database.transaction() as txn:
+            dbpool.session.dbhandle().put("1", "ar", txn)
+            dbpool.dns_client.dbhandle().put("ar", "10.0.0.1", txn)
+
+        self.assertEqual(dbpool.session.dbhandle().get("1"), "ar")
+        self.assertTrue(os.path.exists(os.path.join(self.homedir, "s.db")))
+        self.assertFalse(os.path.exists(os.path.join(self.homedir, "sessions.db")))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from twisted.python import log
+
+from lib.db_layout import Layout, LayoutError
+from lib.db_tuning import Tuning, TuningError, parse_size, format_size
+
+
+class Handle(object):
+    """
+    Database handle recording options set.
+    """
+
+    def __init__(self):
+        self.options = {}
+
+    def __getattr__(self, name):
+        if not name.startswith("set_"):
+            raise AttributeError(name)
+        return lambda value: self.options.__setitem__(name[4:], value)
+
+
+def applied(layout, tuning, dbname):
+    db = Handle()
+    layout.apply_db(dbname, db)
+    tuning.apply_db(dbname, db)
+    return db.options
+
+
+class SizeTest(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("16K"), 16384)
+        self.assertEqual(parse_size(" 2m"), 2 << 20)
+        self.assertEqual(parse_size(512), 512)
+        self.assertRaises(TuningError, parse_size, "big")
+
+    def test_format_size(self):
+        self.assertEqual(format_size(32768), "32K")
+        self.assertEqual(format_size(1000), "1000")
+
+
+class PagesizeTest(unittest.TestCase):
+    def test_database_pagesize_rejected(self):
+        self.assertRaises(TuningError, Tuning,
+                          {"databases": {"action": {"pagesize": "32K"}}})
+        self.assertRaises(TuningError, Tuning,
+                          {"groups": {"journal": {"h_ffactor": 10}}})
+
+    def test_unknown_group(self):
+        tuning = Tuning({"groups": {"unknown": {"pagesize": "8K"}}})
+        self.assertRaises(LayoutError, Layout, None, "dlz.db", tuning)
+
+    def test_group_pagesize(self):
+        tuning = Tuning({"profile": "replication-heavy",
+                         "databases": {"action": {"bt_minkey": 4}}})
+        layout = Layout({"mode": "grouped"}, "dlz.db", tuning)
+        self.assertEqual(applied(layout, tuning, "action"),
+                         {"pagesize": 32768, "bt_minkey": 4})
+        self.assertEqual(applied(layout, tuning, "action_index"),
+                         {"pagesize": 32768})
+        self.assertEqual(applied(layout, tuning, "session"), {})
+
+    def test_layout_overrides_tuning(self):
+        tuning = Tuning({"groups": {"journal": {"pagesize": "32K"}}})
+        layout = Layout({"mode": "per-database",
+                         "groups": {"journal": {"pagesize": "8K", "bt_minkey": 4}}},
+                        "dlz.db", tuning)
+        self.assertEqual(applied(layout, tuning, "action"),
+                         {"pagesize": 8192, "bt_minkey": 4})
+
+    def test_shared_file_takes_dlz_pagesize(self):
+        tuning = Tuning({"profile": "large-zone",
+                         "groups": {"journal": {"pagesize": "32K"}}})
+        layout = Layout(None, "dlz.db", tuning)
+        # every database is in dbfile in single mode
+        for dbname in ("dns_data", "action", "session"):
+            self.assertEqual(applied(layout, tuning, dbname).get("pagesize"), 16384)
+
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            layout.report()
+        finally:
+            log.removeObserver(observer)
+        warnings = [msg for msg in messages if msg.startswith("Warning")]
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue("'journal'" in warnings[0])
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from lib.action import ActionError
+from lib.actions import *
+from lib.bdb_helpers import get_all
+from lib.dbstate import Dbstate, DbstateError, FORMATS, supported_versions, \
+                        state_version
+from tests.unit.base import DatabaseTestCase
+
+
+class DbstateTestCase(DatabaseTestCase):
+    """
+    Database with arena "ar" holding segments "s1", "s2"
+      and zones "a.com", "b.com" in "s1", "c.com" in "s2".
+    States are kept in FORMAT (format 1 by default).
+    """
+
+    FORMAT = None
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.dbstate = Dbstate()
+        if not self.FORMAT is None:
+            self.dbstate.convert(self.database, self.FORMAT)
+        self.apply(AddArena(arena="ar", key="secret"),
+                   AddSegment(arena="ar", segment="s1"),
+                   AddSegment(arena="ar", segment="s2"),
+                   AddZone(arena="ar", segment="s1", zone="a.com"),
+                   AddZone(arena="ar", segment="s1", zone="b.com"),
+                   AddZone(arena="ar", segment="s2", zone="c.com"))
+
+    def apply(self, *acts):
+        """
+        Apply actions in one transaction.
+        """
+
+        with self.database.transaction() as txn:
+            for act in acts:
+                act.apply(self.database, txn)
+
+    def add_a(self, zone, host, ip):
+        return AddRecord_A(zone=zone, host=host, ip=ip)
+
+    def del_a(self, zone, host, ip):
+        return DelRecord_A(zone=zone, host=host, ip=ip)
+
+    def states(self):
+        d = self.dbstate
+        return (d.get_global(self.database),
+                d.get_arena("ar", self.database),
+                d.get_segment("ar", "s1", self.database),
+                d.get_segment("ar", "s2", self.database),
+                d.get_zone("a.com", self.database),
+                d.get_zone("b.com", self.database),
+                d.get_zone("c.com", self.database))
+
+
+class LegacyDbstateTest(DbstateTestCase):
+    """
+    States of format 1 are computed as by nodes
+      without dbstate format negotiation.
+    """
+
+    def md5(self, acc):
+        return hashlib.md5(str(acc)).hexdigest()
+
+    def zone_state(self, zone):
+        dbpool = self.dbpool()
+        ddb = dbpool.dns_data.dbhandle()
+        zone_acc = set()
+        for dkey in get_all(dbpool.zone_dns_data.dbhandle(), zone):
+            zone_acc.add(str(set([rec[rec.find(' '):] for rec in get_all(ddb, dkey)])))
+        zone_acc.add(str(set(get_all(dbpool.dns_client.dbhandle(), zone))))
+        zone_acc.add(str(set(get_all(dbpool.dns_xfr.dbhandle(), zone))))
+        return self.md5(zone_acc)
+
+    def test_states(self):
+        self.apply(self.add_a("a.com", "www", "10.0.0.1"),
+                   self.add_a("a.com", "www", "10.0.0.2"),
+                   AddRecord_NS(zone="c.com", domain="ns.c.com"))
+
+        states = self.states()
+        gstate, astate, s1state, s2state = states[:4]
+        zstates = states[4:]
+        self.assertEqual(zstates, tuple(self.zone_state(zone)
+                                        for zone in ("a.com", "b.com", "c.com")))
+        self.assertEqual(zstates[1], self.md5(set(["set([])"])))
+        self.assertEqual(s1state, self.md5(set(zstates[:2])))
+        self.assertEqual(s2state, self.md5(set(zstates[2:])))
+        self.assertEqual(astate, self.md5(set([s1state, s2state])))
+        self.assertEqual(gstate, self.md5(set([astate])))
+
+        sdb = self.dbpool().dbstate.dbhandle()
+        self.assertEqual(sdb.get("z_a.com"), zstates[0])
+        self.assertEqual(sdb.get("global"), gstate)
+
+    def test_changes_equal_recompute(self):
+        self.apply(self.add_a("a.com", "www", "10.0.0.1"),
+                   self.add_a("c.com", "mail", "10.0.0.3"))
+        self.apply(self.del_a("a.com", "www", "10.0.0.1"),
+                   AddSegment(arena="ar", segment="s3"),
+                   AddZone(arena="ar", segment="s3", zone="d.com"))
+        self.apply(DelZone(zone="d.com"), DelSegment(arena="ar", segment="s3"))
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+
+
+class IncrementalDbstateTest(DbstateTestCase):
+    FORMAT = 2
+
+    def test_incremental_equals_recompute(self):
+        self.apply(self.add_a("a.com", "www", "10.0.0.1"),
+                   self.add_a("a.com", "www", "10.0.0.2"),
+                   self.add_a("c.com", "mail", "10.0.0.3"))
+        self.apply(self.del_a("a.com", "www", "10.0.0.1"))
+
+        states = self.states()
+        total, changed, stale = self.dbstate.recompute_all(self.database)
+        self.assertEqual((changed, stale), (0, 0))
+        self.assertEqual(self.states(), states)
+
+    def test_order_independent(self):
+        initial = self.states()
+        self.apply(self.add_a("a.com", "x", "10.0.0.1"),
+                   self.add_a("a.com", "y", "10.0.0.2"))
+        first = self.states()
+
+        self.apply(self.del_a("a.com", "x", "10.0.0.1"),
+                   self.del_a("a.com", "y", "10.0.0.2"))
+        self.assertEqual(self.states(), initial)
+
+        self.apply(self.add_a("a.com", "y", "10.0.0.2"))
+        self.apply(self.add_a("a.com", "x", "10.0.0.1"))
+        self.assertEqual(self.states(), first)
+
+    def test_change_propagated(self):
+        initial = self.states()
+        self.apply(self.add_a("b.com", "www", "10.0.0.1"))
+        changed = [old != new for old, new in zip(initial, self.states())]
+        # global, arena, s1 and b.com are changed, s2, a.com and c.com are not
+        self.assertEqual(changed, [True, True, True, False, False, True, False])
+
+    def test_zone_removal(self):
+        initial = self.states()
+        self.apply(AddZone(arena="ar", segment="s2", zone="d.com"),
+                   self.add_a("d.com", "www", "10.0.0.1"))
+        self.assertNotEqual(self.states(), initial)
+
+        self.apply(self.del_a("d.com", "www", "10.0.0.1"),
+                   DelZone(arena="ar", segment="s2", zone="d.com"))
+        self.assertEqual(self.states(), initial)
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+
+
+class DbstateFormatTest(DbstateTestCase):
+    def test_v2_supported(self):
+        self.assertEqual(supported_versions(), [1, 2])
+
+    def test_v2_encoding_canonical(self):
+        v2 = FORMATS[2]
+        self.assertNotEqual(v2.digest(("a b", "c")), v2.digest(("a", "b c")))
+        self.assertTrue(0 <= v2.digest(("a",)) < v2.MODULUS)
+
+    def test_convert(self):
+        self.apply(self.add_a("a.com", "www", "10.0.0.1"))
+        v1_states = self.states()
+
+        self.dbstate.convert(self.database, 2)
+        self.assertEqual(self.dbstate.format_version(self.database), (2, [2]))
+        v2_states = self.states()
+        for state in v2_states:
+            self.assertTrue(state.startswith("2:"))
+
+        # only states of active format are kept
+        sdb = self.dbpool().dbstate.dbhandle()
+        self.assertFalse(sdb.exists(self.dbstate._global_key()))
+
+        self.apply(self.add_a("b.com", "www", "10.0.0.2"))
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+        self.apply(self.del_a("b.com", "www", "10.0.0.2"))
+        self.assertEqual(self.states(), v2_states)
+
+        self.dbstate.convert(self.database, 1)
+        self.assertEqual(self.states(), v1_states)
+
+    def test_state_version(self):
+        self.assertEqual(state_version(self.dbstate.get_zone("a.com", self.database)), 1)
+        self.dbstate.convert(self.database, 2)
+        self.assertEqual(state_version(self.dbstate.get_zone("a.com", self.database)), 2)
+
+    def test_activate_unprepared(self):
+        with self.database.transaction() as txn:
+            self.assertRaises(DbstateError, self.dbstate.activate, self.database, 2, txn)
+        self.assertRaises(DbstateError, self.dbstate.prepare, self.database, 3)
+
+    def stamped_a(self, host, version):
+        zstate = self.dbstate.get_zone("a.com", self.database, version=version)
+        return AddRecord_A(zone="a.com", host=host, ip="10.0.0.1", dbstate=zstate)
+
+    def test_actions_of_both_formats(self):
+        self.dbstate.prepare(self.database, 2)
+        self.assertEqual(self.dbstate.format_version(self.database), (1, [1, 2]))
+        self.assertEqual(self.dbstate.ready_versions(self.database), [1, 2])
+        self.apply(self.stamped_a("w1", 1))
+        self.apply(self.stamped_a("w2", 2))
+
+        with self.database.transaction() as txn:
+            self.dbstate.activate(self.database, 2, txn)
+        self.assertEqual(self.dbstate.format_version(self.database), (2, [2, 1]))
+        # actions of peers not switched yet are applied
+        self.apply(self.stamped_a("w3", 1))
+        act = AddRecord_A(zone="a.com", host="w4", ip="10.0.0.1")
+        self.apply(act)
+        self.assertEqual(state_version(act.dbstate), 2)
+
+        act = self.stamped_a("w5", 1)
+        self.dbstate.retire(self.database)
+        self.assertEqual(self.dbstate.format_version(self.database), (2, [2]))
+        self.assertRaises(ActionError, self.apply, act)
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from lib.dbstate_cache import StateCache
+from tests.unit.test_dbstate import DbstateTestCase
+
+
+class StateCacheTest(DbstateTestCase):
+    DATABASE_CFG = {"deadlock_retries": 1000, "deadlock_backoff": 0.001}
+
+    def setUp(self):
+        DbstateTestCase.setUp(self)
+        self.cache = StateCache.instance(self.database)
+        self.cache.clear()
+        self.sdb = self.dbpool().dbstate.dbhandle()
+
+    def cached(self):
+        return self.cache._values
+
+    def test_committed_reads_cached(self):
+        key = self.dbstate._global_key()
+        state = self.cache.get(self.sdb, key)
+        self.assertEqual(self.cached(), {key: state})
+
+        with self.database.read_transaction() as txn:
+            self.assertEqual(self.cache.get(self.sdb, key, txn), state)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_write_transaction_reads_cached(self):
+        key = self.dbstate._global_key()
+        state = self.sdb.get(key)
+        with self.database.transaction() as txn:
+            self.assertEqual(self.cache.get(self.sdb, key, txn), state)
+        self.assertEqual(self.cached(), {key: state})
+
+        with self.database.transaction() as txn:
+            self.assertEqual(self.cache.get(self.sdb, key, txn), state)
+            self.assertEqual(self.cache.get(self.sdb, "missing", txn), None)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cached()["missing"], None)
+
+    def test_write_transaction_stale_entry(self):
+        key = self.dbstate._global_key()
+        state = self.sdb.get(key)
+        self.cache._values[key] = None
+        with self.database.transaction() as txn:
+            self.assertEqual(self.cache.get(self.sdb, key, txn), state)
+
+    def test_snapshot_reads_not_cached(self):
+        self.close_database(self.database)
+        self.database = self.open_database(tuning={"multiversion": 1})
+        self.sdb = self.dbpool().dbstate.dbhandle()
+
+        key = self.dbstate._global_key()
+        with self.database.read_transaction() as txn:
+            self.cache.get(self.sdb, key, txn)
+        self.assertEqual(self.cached(), {})
+
+    def test_invalidated_before_commit(self):
+        key = self.dbstate._global_key()
+        state = self.cache.get(self.sdb, key)
+
+        with self.database.transaction() as txn:
+            self.cache.put(self.sdb, key, "new", txn)
+            self.assertEqual(self.cache.get(self.sdb, key, txn), "new")
+            self.assertEqual(self.cached(), {key: state})
+            txn_generation = self.cache._generation_file.get()
+        self.assertEqual(self.cache._generation_file.get(), txn_generation + 1)
+        self.assertEqual(self.cached(), {})
+        self.assertEqual(self.cache.get(self.sdb, key), "new")
+
+    def test_aborted_write_not_visible(self):
+        key = self.dbstate._global_key()
+        state = self.cache.get(self.sdb, key)
+        try:
+            with self.database.transaction() as txn:
+                self.cache.put(self.sdb, key, "new", txn)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.cache.get(self.sdb, key), state)
+
+    def test_another_process_write(self):
+        key = self.dbstate._global_key()
+        self.cache.get(self.sdb, key)
+
+        other = StateCache(self.homedir)
+        with self.database.transaction() as txn:
+            other.put(self.sdb, key, "new", txn)
+        self.assertEqual(self.cache.get(self.sdb, key), "new")
+
+    def test_concurrent_changes(self):
+        # zones of several threads share segment, arena and global states
+        zones = ["a.com", "b.com", "c.com"]
+        errors = []
+
+        def add_records(zone):
+            def add(txn, i):
+                self.add_a(zone, "h{0}".format(i), "10.0.0.1").apply(self.database, txn)
+            try:
+                for i in xrange(20):
+                    self.database.run_transaction(add, i)
+                    # committed reads fill the cache between writes
+                    self.dbstate.get_global(self.database)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=add_records, args=(zone,))
+                   for zone in zones]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        states = self.states()
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+        self.assertEqual(self.states(), states)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
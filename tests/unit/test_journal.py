@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import lib.action
+
+from lib.action import Action
+from lib.actions import *
+from tests.unit.base import DatabaseTestCase
+
+
+class JournalTestCase(DatabaseTestCase):
+    SERVICES = ("action_journal",)
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.journal = self.sp.get("action_journal")
+
+    def record(self, number, zone="example.com"):
+        """
+        Journal number of actions in separate transactions.
+        Returns list of their positions.
+        """
+
+        res = []
+        for i in xrange(number):
+            act = AddRecord_A(zone=zone, host="h{0}".format(i), ip="10.0.0.1")
+            with self.database.transaction() as txn:
+                self.journal.record_action(act, txn)
+            res.append(self.journal.get_position())
+        return res
+
+    def positions(self, records):
+        return [rec["position"] for rec in records]
+
+    def hosts(self, records):
+        return [Action.unserialize(rec["action"]).host for rec in records]
+
+
+class JournalKeysTest(JournalTestCase):
+    def test_positions_are_consecutive(self):
+        self.assertEqual(self.record(5), range(1, 6))
+
+    def test_get_since_position(self):
+        self.record(300)
+        records = self.journal.get_since_position(10)
+        self.assertEqual(self.positions(records), range(11, 301))
+        self.assertEqual(self.hosts(records)[:2], ["h10", "h11"])
+
+    def test_get_since_position_number(self):
+        self.record(20)
+        records = self.journal.get_since_position(5, 3)
+        self.assertEqual(self.positions(records), [6, 7, 8])
+        self.assertEqual(self.journal.get_since_position(20), [])
+
+    def test_legacy_keys_migrated(self):
+        adb = self.journal.dbpool().action.dbhandle()
+        acts = [AddRecord_A(zone="legacy.com", host="h{0}".format(i), ip="10.0.0.1")
+                for i in xrange(12)]
+        with self.database.transaction() as txn:
+            adb.delete(self.journal.KEY_FORMAT_KEY, txn)
+            for pos, act in enumerate(acts, 1):
+                adb.put(str(pos), act.serialize(), txn)
+            self.journal.dbpool().action.reset_sequence(13, txn=txn)
+
+        # several batches
+        self.patch(lib.action.journal, "MIGRATION_BATCH_SIZE", 5)
+        journal = lib.action.journal(self.sp)
+
+        records = journal.get_since_position(0)
+        self.assertEqual(self.positions(records), range(1, 13))
+        self.assertEqual(self.hosts(records), ["h{0}".format(i) for i in xrange(12)])
+        self.assertEqual(adb.get(journal.KEY_FORMAT_KEY), journal.KEY_FORMAT_VERSION)
+
+
+class JournalTruncateTest(JournalTestCase):
+    def test_truncate_below_position(self):
+        self.record(10)
+        with self.database.transaction() as txn:
+            self.assertEqual(self.journal.truncate(6, txn=txn), 5)
+
+        self.assertEqual(self.journal.get_first_position(), 6)
+        self.assertFalse(self.journal.position_exists(5))
+        self.assertEqual(self.positions(self.journal.get_since_position(5)),
+                         range(6, 11))
+
+    def test_truncate_by_batches(self):
+        self.record(10)
+        with self.database.transaction() as txn:
+            self.assertEqual(self.journal.truncate(8, 3, txn), 3)
+        self.assertEqual(self.journal.get_first_position(), 4)
+
+    def test_truncate_keeps_head(self):
+        self.record(3)
+        with self.database.transaction() as txn:
+            self.journal.truncate(4, txn=txn)
+        self.assertEqual(self.journal.get_first_position(), None)
+        self.assertEqual(self.record(1), [4])
+
+
+class JournalPositionTest(JournalTestCase):
+    def test_position_advanced_on_commit(self):
+        self.assertEqual(self.journal.get_position(), 0)
+        act = AddRecord_A(zone="example.com", host="h", ip="10.0.0.1")
+        with self.database.transaction() as txn:
+            self.journal.record_action(act, txn)
+            self.assertEqual(self.journal.get_position(), 0)
+        self.assertEqual(self.journal.get_position(), 1)
+
+    def test_position_kept_on_abort(self):
+        self.record(2)
+        act = AddRecord_A(zone="example.com", host="h", ip="10.0.0.1")
+        try:
+            with self.database.transaction() as txn:
+                self.journal.record_action(act, txn)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.journal.get_position(), 2)
+        self.assertEqual(self.record(1), [3])
+
+    def test_refresh_position(self):
+        # another process writing the same journal
+        other = lib.action.journal(self.sp)
+        act = AddRecord_A(zone="example.com", host="h", ip="10.0.0.1")
+        with self.database.transaction() as txn:
+            other.record_action(act, txn)
+
+        self.assertEqual(self.journal.get_position(), 0)
+        self.assertEqual(self.journal.refresh_position(), 1)
+        self.assertEqual(self.journal.get_position(), 1)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
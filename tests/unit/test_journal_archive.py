@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.journal_archive import JournalArchive, JournalArchiveError, Segment
+from tests.unit.test_journal import JournalTestCase
+
+
+def make_records(first, last):
+    return [(pos, "record-{0}".format(pos) * (pos % 3 + 1))
+            for pos in xrange(first, last + 1)]
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="dns_cluster_test_")
+        self.archive = JournalArchive(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_segment_round_trip(self):
+        records = make_records(5, 14)
+        seg = Segment.write(self.path, records)
+        self.assertEqual((seg.first, seg.last), (5, 14))
+        self.assertEqual(seg.get(9), records[4][1])
+        self.assertEqual(seg.get(15), None)
+        self.assertEqual(seg.get_range(0, 100), records)
+        self.assertEqual(seg.get_range(7, 9), records[2:5])
+        self.assertEqual(seg.get_range(7, 100, 2), records[2:4])
+        seg.close()
+
+    def test_archive_round_trip(self):
+        self.archive.append(make_records(1, 10))
+        self.archive.append(make_records(11, 20))
+        self.assertEqual(self.archive.first_position(), 1)
+        self.assertEqual(self.archive.last_position(), 20)
+        self.assertEqual(self.archive.get(15), make_records(15, 15)[0][1])
+        self.assertEqual(self.archive.get_range(8, 12), make_records(8, 12))
+        self.assertEqual(self.archive.get_range(8, 20, 4), make_records(8, 11))
+
+    def test_append_overlap(self):
+        self.archive.append(make_records(1, 10))
+        self.assertRaises(JournalArchiveError,
+                          self.archive.append, make_records(10, 12))
+
+    def test_drop_below(self):
+        for first in (1, 11, 21):
+            self.archive.append(make_records(first, first + 9))
+        self.assertEqual(self.archive.segments_below(15), [(1, 10)])
+        self.assertEqual(self.archive.drop_below(21), 2)
+        self.assertEqual(self.archive.first_position(), 21)
+        self.assertEqual(self.archive.get(5), None)
+
+    def test_changes_of_another_instance(self):
+        other = JournalArchive(self.path)
+        self.assertEqual(self.archive.last_position(), None)
+
+        # several changes within directory mtime resolution
+        other.append(make_records(1, 10))
+        self.assertEqual(self.archive.last_position(), 10)
+        other.append(make_records(11, 20))
+        self.assertEqual(self.archive.last_position(), 20)
+        other.drop_below(11)
+        self.assertEqual(self.archive.first_position(), 11)
+        self.assertEqual(self.archive.get(5), None)
+
+
+class JournalArchiveTest(JournalTestCase):
+    SEGMENT_SIZE = 10
+
+    def services_cfg(self):
+        return {"action_journal": {"archive_dir": "archive",
+                                   "archive_live_window": 5,
+                                   "archive_segment_size": self.SEGMENT_SIZE}}
+
+    def segments_number(self):
+        return len([name for name in os.listdir(os.path.join(self.homedir, "archive"))
+                    if not Segment.parse_name(name) is None])
+
+    def test_archived_records_readable(self):
+        self.record(30)
+        self.assertEqual(self.journal.archive(), 10)
+        self.assertEqual(self.journal.archive(), 10)
+        self.assertEqual(self.journal.archive(), 0)
+
+        records = self.journal.get_since_position(0)
+        self.assertEqual(self.positions(records), range(1, 31))
+        self.assertEqual(self.hosts(records)[:12],
+                         ["h{0}".format(i) for i in xrange(12)])
+        self.assertTrue(self.journal.position_exists(3))
+
+    def test_segments_removed_on_commit(self):
+        self.record(30)
+        self.journal.archive()
+        self.journal.archive()
+
+        try:
+            with self.database.transaction() as txn:
+                self.journal.truncate(15, txn=txn)
+                # removal is deferred until commit
+                self.assertEqual(self.segments_number(), 2)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.journal.get_first_position(), 1)
+        self.assertEqual(self.positions(self.journal.get_since_position(0)),
+                         range(1, 31))
+
+        with self.database.transaction() as txn:
+            self.journal.truncate(15, txn=txn)
+        self.assertEqual(self.journal.get_first_position(), 11)
+        self.assertFalse(self.journal.position_exists(10))
+        self.assertEqual(self.segments_number(), 1)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
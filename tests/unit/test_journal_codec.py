@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from lib.actions import *
+from lib.journal_codec import JournalCodec, JournalCodecError
+from tests.unit.test_journal import JournalTestCase
+
+
+def make_dump(i, dbstate=None):
+    return AddRecord_A(zone="example.com", host="host{0}".format(i),
+                       ip="10.0.0.{0}".format(i % 256), ttl=600,
+                       dbstate=dbstate).serialize()
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        codec = JournalCodec(compress=True)
+        for i in xrange(10):
+            dump = make_dump(i)
+            record = codec.encode(dump)
+            self.assertTrue(codec.is_encoded(record))
+            self.assertTrue(len(record) < len(dump))
+            self.assertEqual(codec.decode(record), dump)
+
+    def test_uncompressed_passed_as_is(self):
+        dump = make_dump(1)
+        codec = JournalCodec()
+        self.assertEqual(codec.encode(dump), dump)
+        self.assertFalse(codec.is_encoded(dump))
+
+        # records written before compression was enabled
+        self.assertEqual(JournalCodec(compress=True).decode(dump), dump)
+        self.assertEqual(codec.decode(None), None)
+
+    def test_decoded_without_compression(self):
+        record = JournalCodec(compress=True, level=9).encode(make_dump(1))
+        self.assertEqual(JournalCodec().decode(record), make_dump(1))
+
+    def test_dbstate_formats(self):
+        md5_state = "0123456789abcdef" * 2
+        codec = JournalCodec(compress=True)
+        for dbstate in (md5_state, "2:" + md5_state):
+            dump = make_dump(1, dbstate)
+            self.assertEqual(codec.decode(codec.encode(dump)), dump)
+
+        # format 2 states match only the second dictionary
+        dump = make_dump(1, "2:" + md5_state)
+        self.assertTrue(len(codec.encode(dump)) <
+                        len(JournalCodec(compress=True, dictionary=1).encode(dump)))
+
+    def test_old_dictionary(self):
+        record = JournalCodec(compress=True, dictionary=1).encode(make_dump(1))
+        self.assertEqual(record[3], chr(1))
+        self.assertEqual(JournalCodec(compress=True).decode(record), make_dump(1))
+
+    def test_unknown_dictionary(self):
+        self.assertRaises(JournalCodecError, JournalCodec, dictionary=100)
+
+        record = JournalCodec(compress=True).encode(make_dump(1))
+        record = record[:3] + chr(100) + record[4:]
+        self.assertRaises(JournalCodecError, JournalCodec().decode, record)
+
+
+class CompressedJournalTest(JournalTestCase):
+    def services_cfg(self):
+        return {"action_journal": {"compress": True}}
+
+    def test_records_compressed(self):
+        self.record(3)
+        adb = self.journal.dbpool().action.dbhandle()
+        record = adb.get(self.journal._make_key(2))
+        self.assertTrue(JournalCodec().is_encoded(record))
+
+        records = self.journal.get_since_position(0)
+        self.assertEqual(self.positions(records), [1, 2, 3])
+        self.assertEqual(self.hosts(records), ["h0", "h1", "h2"])
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
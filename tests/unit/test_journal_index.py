@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from lib.action import Action
+from lib.actions import *
+from tests.unit.test_journal import JournalTestCase
+
+
+class JournalIndexTest(JournalTestCase):
+    def record_zones(self, zones):
+        for i, zone in enumerate(zones):
+            act = AddRecord_A(zone=zone, host="h{0}".format(i), ip="10.0.0.1")
+            with self.database.transaction() as txn:
+                self.journal.record_action(act, txn)
+
+    def zone_positions(self, zone, from_pos=0, to_pos=None):
+        return self.journal.get_index_positions(self.journal.zone_index_key(zone),
+                                                from_pos, to_pos)
+
+    def test_zone_history(self):
+        self.record_zones(["a.com", "b.com", "a.com", "b.com", "a.com"])
+        self.assertEqual(self.zone_positions("a.com"), [1, 3, 5])
+        self.assertEqual(self.zone_positions("a.com", 1, 4), [3])
+        self.assertEqual(self.zone_positions("c.com"), [])
+
+        history = self.journal.get_zone_history("b.com")
+        self.assertEqual(self.positions(history), [2, 4])
+        self.assertEqual(self.hosts(history), ["h1", "h3"])
+
+    def test_structural_actions_indexed(self):
+        acts = [AddArena(arena="ar", key="secret"),
+                AddSegment(arena="ar", segment="sg"),
+                AddZone(arena="ar", segment="sg", zone="z.com")]
+        for act in acts:
+            with self.database.transaction() as txn:
+                self.journal.record_action(act, txn)
+
+        keys = (self.journal.arena_index_key("ar"),
+                self.journal.segment_index_key("ar", "sg"),
+                self.journal.zone_index_key("z.com"))
+        self.assertEqual([self.journal.get_index_positions(key) for key in keys],
+                         [[1, 2], [2, 3], [3]])
+
+    def test_zone_diff(self):
+        acts = [AddRecord_A(zone="a.com", host="x", ip="10.0.0.1"),
+                AddRecord_A(zone="a.com", host="y", ip="10.0.0.2"),
+                DelRecord_A(zone="a.com", host="x", ip="10.0.0.1")]
+        for act in acts:
+            with self.database.transaction() as txn:
+                self.journal.record_action(act, txn)
+
+        diff = self.journal.get_zone_diff("a.com")
+        self.assertEqual([d["data"]["host"] for d in diff["added"]], ["y"])
+        self.assertEqual(diff["deleted"], [])
+
+    def test_truncate_unindexes(self):
+        self.record_zones(["a.com"] * 10)
+        with self.database.transaction() as txn:
+            self.journal.truncate(6, txn=txn)
+        self.assertEqual(self.zone_positions("a.com"), range(6, 11))
+
+
+class ArchivedJournalIndexTest(JournalIndexTest):
+    def services_cfg(self):
+        return {"action_journal": {"archive_dir": "archive",
+                                   "archive_live_window": 2,
+                                   "archive_segment_size": 4}}
+
+    def test_archived_segment_unindexed(self):
+        self.record_zones(["a.com", "b.com"] * 6)
+        self.assertEqual(self.journal.archive(), 4)
+        self.assertEqual(self.journal.archive(), 4)
+
+        # segment [1, 4] is removed, segment [5, 8] holds the bound
+        with self.database.transaction() as txn:
+            self.journal.truncate(6, txn=txn)
+        self.assertEqual(self.zone_positions("a.com"), [5, 7, 9, 11])
+        self.assertEqual(self.zone_positions("b.com"), [6, 8, 10, 12])
+
+    def test_segment_without_keys_unindexed(self):
+        self.record_zones(["a.com", "b.com"] * 6)
+        self.journal.archive()
+        os.remove(os.path.join(self.homedir, "archive",
+                               "{0:020d}-{1:020d}.key".format(1, 4)))
+
+        with self.database.transaction() as txn:
+            self.journal.truncate(5, txn=txn)
+        self.assertEqual(self.zone_positions("a.com"), [5, 7, 9, 11])
+        self.assertEqual(self.zone_positions("b.com"), [6, 8, 10, 12])
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
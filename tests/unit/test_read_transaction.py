@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from lib.common import reorder
+from lib.database import Transaction, transactional
+from lib.operation import OperationError
+from lib.operations.operation_helpers import OperationHelpersMixin
+from tests.unit.test_dbstate import DbstateTestCase
+
+
+class Reader(object):
+    def __init__(self, database_srv):
+        self.database_srv = database_srv
+
+    @transactional(read_only=True)
+    def wrapper(self, **kwargs):
+        return Transaction.lookup(kwargs['txn'])
+
+
+class ReadTransactionTest(DbstateTestCase):
+    """
+    Read-only operations helpers read in read transactions,
+      they wait for writers unless environment is multiversion.
+    """
+
+    MULTIVERSION = 0
+
+    def setUp(self):
+        DbstateTestCase.setUp(self)
+        self.close_database(self.database)
+        self.database = self.open_database(tuning={"multiversion": self.MULTIVERSION})
+        self.helpers = OperationHelpersMixin()
+
+    def check_with_locked_zone(self):
+        """
+        Returns True if check of zone "a.com" finished while
+          its dns_zone record is locked by writer.
+        """
+
+        zdb = self.dbpool().dns_zone.dbhandle()
+        key = reorder("a.com")
+        errors = []
+
+        def check():
+            try:
+                self.helpers.check_zone_exists(self.database, "a.com")
+            except Exception as e:
+                errors.append(e)
+
+        with self.database.transaction() as txn:
+            zdb.put(key, zdb.get(key, None, txn), txn)
+            thread = threading.Thread(target=check)
+            thread.start()
+            thread.join(0.2)
+            finished = not thread.is_alive()
+        thread.join()
+
+        self.assertEqual(errors, [])
+        return finished
+
+    def test_read_only(self):
+        t = Reader(self.database).wrapper()
+        self.assertTrue(t.read_only())
+        self.assertEqual(t.snapshot(), bool(self.MULTIVERSION))
+
+        with self.database.transaction() as txn:
+            self.assertFalse(Transaction.lookup(txn).read_only())
+
+    def test_helpers_read(self):
+        self.helpers.check_zone_exists(self.database, "a.com")
+        self.assertRaises(OperationError, self.helpers.check_zone_exists,
+                          self.database, "none.com")
+
+    def test_writer_lock(self):
+        self.assertEqual(self.check_with_locked_zone(), bool(self.MULTIVERSION))
+
+
+class SnapshotReadTest(ReadTransactionTest):
+    MULTIVERSION = 1
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from lib import record_index
+from lib.actions import *
+from lib.operation import OperationError
+from lib.operations import GetRecordOp, DelRecordByIdOp, ModRecordOp
+from lib.operations.operation_helpers import OperationHelpersMixin
+from tests.unit.test_dbstate import DbstateTestCase
+
+
+class RecordIndexTest(DbstateTestCase):
+    def setUp(self):
+        DbstateTestCase.setUp(self)
+        self.helpers = OperationHelpersMixin()
+        self.ridb = self.dbpool().dns_data_id.dbhandle()
+
+    def add(self, act):
+        self.apply(act)
+        return act.record_id
+
+    def lookup(self, recid):
+        with self.database.read_transaction() as txn:
+            return record_index.lookup(self.database, recid, txn)
+
+    def test_lookup(self):
+        recid = self.add(self.add_a("a.com", "www", "10.0.0.1"))
+        dkey, rec = self.lookup(recid)
+        self.assertEqual(dkey, "a.com www")
+        self.assertTrue(rec.startswith("{0} ".format(recid)))
+
+        self.apply(self.del_a("a.com", "www", "10.0.0.1"))
+        self.assertEqual(self.lookup(recid), None)
+        self.assertEqual(self.ridb.get(str(recid)), None)
+
+    def test_record_spec_of_zone(self):
+        recid = self.add(self.add_a("a.com", "www", "10.0.0.1"))
+        spec = self.helpers.get_record_spec(self.database, recid, "a.com")
+        self.assertEqual((spec["id"], spec["host"], spec["ip"]),
+                         (recid, "www", "10.0.0.1"))
+        self.assertEqual(self.helpers.get_record_spec(self.database, recid,
+                                                      "A.com", "WWW"), spec)
+
+        # id of record of another zone or host is not found
+        self.assertEqual(self.helpers.get_record_spec(self.database, recid,
+                                                      "b.com"), None)
+        self.assertEqual(self.helpers.get_record_spec(self.database, recid,
+                                                      "a.com", "mail"), None)
+        self.assertEqual(self.helpers.get_record_spec(self.database, recid + 100,
+                                                      "a.com"), None)
+
+    def test_apex_record_spec(self):
+        recid = self.add(AddRecord_MX(zone="a.com", domain="mx.a.com", priority=10))
+        spec = self.helpers.get_record_spec(self.database, recid, "a.com", "@")
+        self.assertEqual((spec["type"], spec["domain"]), ("MX", "mx.a.com"))
+        self.assertEqual(self.helpers.get_record_spec(self.database, recid,
+                                                      "a.com", "www"), None)
+
+    def test_build(self):
+        ids = [self.add(self.add_a("a.com", "h{0}".format(i), "10.0.0.1"))
+               for i in xrange(5)]
+        # records stored before the index
+        with self.database.transaction() as txn:
+            self.ridb.truncate(txn)
+
+        record_index.build(self.database)
+        self.assertEqual(self.ridb.get(record_index.INDEX_VERSION_KEY),
+                         record_index.INDEX_VERSION)
+        for i, recid in enumerate(ids):
+            self.assertEqual(self.lookup(recid)[0], "a.com h{0}".format(i))
+
+    def test_build_count_mismatch(self):
+        self.add(self.add_a("a.com", "www", "10.0.0.1"))
+        with self.database.transaction() as txn:
+            self.ridb.truncate(txn)
+            # stale entry of record missing in dns_data
+            self.ridb.put("999999", "a.com gone", txn)
+
+        record_index.build(self.database)
+        self.assertEqual(self.ridb.get(record_index.INDEX_VERSION_KEY), None)
+
+
+class RecordIdOperationsTest(DbstateTestCase):
+    def test_zone_required(self):
+        auth = {"auth_arena": "ar", "auth_key": "secret"}
+        for op_cls, kwargs in ((GetRecordOp, {}), (DelRecordByIdOp, {}),
+                               (ModRecordOp, {"rec_spec": {"ttl": 10}})):
+            kwargs = dict(kwargs, id=1, **auth)
+            self.assertRaises(OperationError, op_cls, **kwargs)
+            op = op_cls(zone="a.com", **kwargs)
+            self.assertEqual((op.id, op.zone), (1, "a.com"))
+
+        op = GetRecordOp(zone="a.com", host="www", id="1", **auth)
+        self.assertEqual(op.host, "www")
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from lib.database import bdb, transactional
+from tests.unit.test_dbstate import DbstateTestCase
+
+
+class Deadlocks(object):
+    """
+    Callable raising deadlock error on the first count calls.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.count:
+            raise bdb.DBLockDeadlockError(-30994, "deadlock")
+
+
+class Counter(object):
+    def __init__(self, database_srv, deadlocks):
+        self.database_srv = database_srv
+        self.deadlocks = deadlocks
+
+    @transactional()
+    def count(self, value, **kwargs):
+        self.deadlocks()
+        return value
+
+
+class RetryTest(DbstateTestCase):
+    DATABASE_CFG = {"deadlock_retries": 3, "deadlock_backoff": 0.001}
+
+    def test_retried(self):
+        deadlocks = Deadlocks(2)
+        self.assertEqual(self.database.run_transaction(lambda txn: deadlocks() or 5), 5)
+        self.assertEqual(deadlocks.calls, 3)
+        self.assertEqual(self.database.retry_stats(),
+                         {"deadlocks": 2, "retries": 2, "failures": 0})
+
+    def test_gives_up(self):
+        deadlocks = Deadlocks(10)
+        self.assertRaises(bdb.DBLockDeadlockError,
+                          self.database.run_transaction, lambda txn: deadlocks())
+        self.assertEqual(deadlocks.calls, 4)
+        self.assertEqual(self.database.retry_stats(),
+                         {"deadlocks": 4, "retries": 3, "failures": 1})
+
+    def test_transactional(self):
+        deadlocks = Deadlocks(1)
+        self.assertEqual(Counter(self.database, deadlocks).count(7), 7)
+        self.assertEqual(deadlocks.calls, 2)
+
+    def test_action_state_reset(self):
+        act = self.add_a("a.com", "www", "10.0.0.1")
+        deadlocks = Deadlocks(1)
+        ids = []
+        zone_states = []
+
+        def apply(txn):
+            if deadlocks.calls:
+                # zone is changed by other writer before retry,
+                #   action must not keep dbstate of the aborted try
+                self.apply(self.add_a("a.com", "mail", "10.0.0.2"))
+                zone_states.append(self.dbstate.get_zone("a.com", self.database))
+            act.apply(self.database, txn)
+            ids.append(act.record_id)
+            deadlocks()
+
+        self.database.run_transaction(apply)
+        self.assertEqual(deadlocks.calls, 2)
+        self.assertEqual(act.dbstate, zone_states[-1])
+        self.assertEqual(act.record_id, ids[-1])
+        self.assertEqual(self.dbstate.recompute_all(self.database)[1:], (0, 0))
+
+    def test_aborted_action_state(self):
+        act = self.add_a("a.com", "www", "10.0.0.1")
+        try:
+            with self.database.transaction() as txn:
+                act.apply(self.database, txn)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual((act.dbstate, act.record_id), (None, None))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
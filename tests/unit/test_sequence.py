@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from lib import database
+from lib.database import bdb
+from tests.unit.base import DatabaseTestCase
+
+
+class Abort(Exception): pass
+
+
+class SequenceTest(DatabaseTestCase):
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.db = database.Database(self.database.dbenv(), "seq.db", "seq",
+                                    bdb.DB_HASH, 0, bdb.DB_CREATE,
+                                    seq_cachesize={"cached": 10})
+        self.db.init_sequence("plain", 1)
+        self.db.init_sequence("cached", 1)
+
+    def allocate(self, seqkey, number=1):
+        with self.database.transaction() as txn:
+            return self.db.allocate(seqkey, number, txn)
+
+    def test_allocate_consecutive(self):
+        self.assertEqual(self.allocate("plain"), 1)
+        self.assertEqual(self.allocate("plain", 5), 2)
+        self.assertEqual(self.allocate("plain"), 7)
+
+    def test_allocate_cached(self):
+        ids = [self.allocate("cached") for _ in xrange(25)]
+        self.assertEqual(ids, range(1, 26))
+
+    def test_aborted_allocation_is_reused(self):
+        try:
+            with self.database.transaction() as txn:
+                self.db.allocate("plain", 3, txn)
+                raise Abort()
+        except Abort:
+            pass
+        self.assertEqual(self.allocate("plain"), 1)
+
+    def test_reset_committed(self):
+        self.allocate("plain", 3)
+        with self.database.transaction() as txn:
+            self.db.reset_sequence(100, "plain", txn)
+            self.assertEqual(self.db.allocate("plain", txn=txn), 100)
+        self.assertEqual(self.allocate("plain"), 101)
+
+    def test_reset_aborted(self):
+        self.allocate("plain", 3)
+        try:
+            with self.database.transaction() as txn:
+                self.db.reset_sequence(100, "plain", txn)
+                self.db.allocate("plain", txn=txn)
+                raise Abort()
+        except Abort:
+            pass
+        # handle of aborted reset is dropped and reopened
+        self.assertFalse("plain" in self.db._sequences)
+        self.assertEqual(self.allocate("plain"), 4)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+from twisted.python import log
+
+from lib.action import ActionError
+from lib.actions import *
+from lib.app.sync.sync import SyncApp, SyncAppError
+from lib.dbstate import Dbstate
+from tests.unit.test_journal import JournalTestCase
+
+
+class SyncTestCase(JournalTestCase):
+    PEERS = ("beta", "gamma")
+
+    def make_sync_app(self, **kwargs):
+        cfg = {
+            "server": {"name": "alpha", "interface": "127.0.0.1", "port": 0},
+            "transport-encrypt": False,
+            "peers": dict((name, {"host": "127.0.0.1", "port": 0, "key": name})
+                          for name in self.PEERS)
+        }
+        cfg.update(kwargs)
+        return SyncApp(cfg, self.database, self.journal)
+
+    def ack(self, app, **positions):
+        padb = app._dbpool.peer_ack.dbhandle()
+        with self.database.transaction() as txn:
+            for name, pos in positions.iteritems():
+                padb.put(name, str(pos), txn)
+
+
+class RetentionTest(SyncTestCase):
+    def setUp(self):
+        SyncTestCase.setUp(self)
+        self.app = self.make_sync_app(journal_retention={
+            "enabled": True,
+            "window": 5,
+            "batch_size": 4
+        })
+        self.record(30)
+
+    def test_not_all_peers_acknowledged(self):
+        self.ack(self.app, beta=30)
+        self.assertEqual(self.app._do_truncate_journal(), 0)
+        self.assertEqual(self.journal.get_first_position(), 1)
+
+    def test_truncate_below_slowest_peer(self):
+        self.ack(self.app, beta=30, gamma=20)
+        # records below 20 - window are deleted in batches
+        self.assertEqual(self.app._do_truncate_journal(), 14)
+        self.assertEqual(self.journal.get_first_position(), 15)
+
+    def test_window_not_passed(self):
+        self.ack(self.app, beta=30, gamma=5)
+        self.assertEqual(self.app._do_truncate_journal(), 0)
+
+
+class DbstateNegotiationTest(SyncTestCase):
+    def setUp(self):
+        SyncTestCase.setUp(self)
+        self.app = self.make_sync_app(dbstate_format=2)
+        self.dbstate = Dbstate()
+        self.record(3)
+
+    def advertise(self, **infos):
+        pddb = self.app._dbpool.peer_dbstate.dbhandle()
+        with self.database.transaction() as txn:
+            for name, info in infos.iteritems():
+                pddb.put(name, self.app._format_dbstate_info(info), txn)
+
+    def pulled(self, **positions):
+        pdb = self.app._dbpool.peer.dbhandle()
+        with self.database.transaction() as txn:
+            for name, pos in positions.iteritems():
+                pdb.put(name, str(pos), txn)
+
+    def format_version(self):
+        return self.dbstate.format_version(self.database)
+
+    def test_config(self):
+        self.assertRaises(SyncAppError, self.make_sync_app, dbstate_format=3)
+
+    def test_old_peers(self):
+        self.advertise(beta=None)
+        self.assertEqual(self.app._do_negotiate_dbstate(), None)
+        self.assertEqual(self.format_version(), (1, [1, 2]))
+        self.assertEqual(self.app._get_dbstate_info(),
+                         {"active": 1, "maintained": [1, 2], "position": None})
+
+        # peer gamma never sent pull request
+        self.advertise(beta={"active": 1, "maintained": [1, 2]})
+        self.assertEqual(self.app._do_negotiate_dbstate(), None)
+        self.assertEqual(self.format_version(), (1, [1, 2]))
+
+    def test_switch(self):
+        self.app._do_negotiate_dbstate()
+        self.advertise(beta={"active": 1, "maintained": [1, 2]},
+                       gamma={"active": 1, "maintained": [1, 2]})
+        self.assertEqual(self.app._do_negotiate_dbstate(), 2)
+        self.assertEqual(self.format_version(), (2, [2, 1]))
+        self.assertEqual(self.app._get_dbstate_info(),
+                         {"active": 2, "maintained": [2, 1], "position": 3})
+
+        # actions of old format are not pulled from all peers yet
+        self.advertise(beta={"active": 2, "maintained": [2, 1], "position": 10},
+                       gamma={"active": 2, "maintained": [2, 1], "position": 5})
+        self.pulled(beta=10, gamma=4)
+        self.app._do_negotiate_dbstate()
+        self.assertEqual(self.format_version(), (2, [2, 1]))
+
+        self.pulled(gamma=5)
+        self.assertEqual(self.app._do_negotiate_dbstate(), 2)
+        self.assertEqual(self.format_version(), (2, [2]))
+        self.assertEqual(self.app._get_dbstate_info()["position"], 3)
+
+    def test_disabled(self):
+        app = self.make_sync_app()
+        self.assertEqual(app._dbstate_format, None)
+        # negotiation is not scheduled
+        app.start_dbstate_negotiation()
+        self.assertEqual(self.format_version(), (1, [1]))
+
+
+class StatsReportTest(SyncTestCase):
+    def test_retries(self):
+        app = self.make_sync_app()
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            app.report_stats()
+        finally:
+            log.removeObserver(observer)
+
+        self.assertTrue("Transaction retries: deadlocks=0, failures=0, retries=0"
+                        in messages)
+        # profiler is disabled
+        self.assertFalse([msg for msg in messages
+                          if msg.startswith("Transaction profile")])
+
+
+class ProfileReportTest(SyncTestCase):
+    DATABASE_CFG = {"txn_profiler": {}}
+
+    def test_profile(self):
+        app = self.make_sync_app()
+        with self.database.transaction("op") as txn:
+            pass
+
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            app.report_stats()
+        finally:
+            log.removeObserver(observer)
+
+        self.assertTrue([msg for msg in messages
+                         if msg.startswith("Transaction profile: ")])
+        self.assertTrue([msg for msg in messages if msg.startswith("  op: count=1 ")])
+
+
+class Peer(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class ApplyActionsTest(SyncTestCase):
+    def setUp(self):
+        SyncTestCase.setUp(self)
+        self.app = self.make_sync_app()
+        self.peer = Peer("beta")
+
+    def actions(self, *acts):
+        return [{"action": act if isinstance(act, str) else act.serialize(),
+                 "position": pos}
+                for pos, act in enumerate(acts, 1)]
+
+    def peer_position(self):
+        return self.app._dbpool.peer.dbhandle().get(self.peer.name)
+
+    def arena_exists(self, arena):
+        return self.dbpool().arena.dbhandle().exists(arena)
+
+    def test_batch_applied(self):
+        actions = self.actions(AddArena(arena="ar", key="secret"),
+                               AddSegment(arena="ar", segment="sg"))
+        self.app._do_apply_actions(actions, self.peer)
+        self.assertEqual(self.peer_position(), "2")
+        self.assertTrue(self.arena_exists("ar"))
+
+    def test_progress_kept_on_action_error(self):
+        actions = self.actions(AddArena(arena="ar1", key="secret"),
+                               AddSegment(arena="none", segment="sg"),
+                               AddArena(arena="ar2", key="secret"))
+        self.assertRaises(ActionError, self.app._do_apply_actions, actions,
+                          self.peer)
+        self.assertEqual(self.peer_position(), "1")
+        self.assertTrue(self.arena_exists("ar1"))
+        self.assertFalse(self.arena_exists("ar2"))
+
+    def test_progress_kept_on_other_error(self):
+        # undecodable action
+        actions = self.actions(AddArena(arena="ar1", key="secret"),
+                               "\x10\x00\x00\x00garbage",
+                               AddArena(arena="ar2", key="secret"))
+        self.assertRaises(Exception, self.app._do_apply_actions, actions,
+                          self.peer)
+        self.assertEqual(self.peer_position(), "1")
+        self.assertTrue(self.arena_exists("ar1"))
+        self.assertFalse(self.arena_exists("ar2"))
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
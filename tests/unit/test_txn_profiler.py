@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from twisted.python import log
+
+from lib.database import bdb
+from lib.txn_profiler import Histogram
+from tests.unit.base import DatabaseTestCase
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        hist = Histogram()
+        for value in (0.0005, 0.0015, 0.003, 0.003, 20.0):
+            hist.add(value)
+        self.assertEqual(hist.count, 5)
+        self.assertEqual(hist.max, 20.0)
+        self.assertEqual(hist.as_dict()["buckets"],
+                         {"<=1ms": 1, "<=2ms": 1, "<=5ms": 2, ">10000ms": 1})
+        self.assertEqual(hist.percentile(50), 5)
+        self.assertEqual(hist.percentile(99), None)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().percentile(50), 0)
+
+
+class ProfilerTest(DatabaseTestCase):
+    DATABASE_CFG = {"txn_profiler": {"slow_threshold": 0.05, "sample_stats": True}}
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.profiler = self.database.profiler()
+        self.profiler.reset()
+
+    def test_named(self):
+        for i in xrange(3):
+            with self.database.transaction("op") as txn:
+                pass
+        try:
+            with self.database.transaction("op") as txn:
+                raise ValueError()
+        except ValueError:
+            pass
+
+        stats = self.profiler.stats()
+        self.assertEqual(stats["op"]["count"], 4)
+        self.assertEqual(stats["op"]["aborts"], {"ValueError": 1})
+        self.assertEqual(self.profiler.slow_count(), 0)
+
+    def test_caller_name(self):
+        with self.database.transaction() as txn:
+            pass
+        self.assertEqual(self.profiler.stats().keys(),
+                         ["test_txn_profiler:test_caller_name"])
+
+    def test_retried(self):
+        calls = []
+
+        def deadlocked(txn):
+            calls.append(txn)
+            if len(calls) == 1:
+                raise bdb.DBLockDeadlockError(-30994, "deadlock")
+
+        self.database.run_transaction(deadlocked, name="retried")
+        stats = self.profiler.stats()["retried"]
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["aborts"], {"DBLockDeadlockError": 1})
+
+    def test_slow(self):
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            with self.database.transaction("slow") as txn:
+                time.sleep(0.06)
+        finally:
+            log.removeObserver(observer)
+
+        self.assertEqual(self.profiler.slow_count(), 1)
+        slow = [msg for msg in messages if msg.startswith("Slow transaction 'slow'")]
+        self.assertEqual(len(slow), 1)
+        # environment statistics deltas are sampled
+        self.assertTrue("txn_commits=" in slow[0])
+
+
+    def test_report(self):
+        for name in ("short", "long"):
+            with self.database.transaction(name) as txn:
+                if name == "long":
+                    time.sleep(0.01)
+
+        messages = []
+        observer = lambda event: messages.append(log.textFromEventDict(event))
+        log.addObserver(observer)
+        try:
+            self.profiler.report()
+        finally:
+            log.removeObserver(observer)
+
+        self.assertEqual(messages[0], "Transaction profile: 2 names, 0 slow transactions")
+        # sorted by total time
+        self.assertTrue(messages[1].startswith("  long: count=1 "))
+        self.assertTrue(messages[2].startswith("  short: count=1 "))
+        self.assertTrue(messages[2].endswith(" aborts=0"))
+
+
+class DisabledProfilerTest(DatabaseTestCase):
+    def test_disabled(self):
+        self.assertEqual(self.database.profiler(), None)
+        with self.database.transaction("op") as txn:
+            pass
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Online backup of the database environment and seeding of new nodes.
+Usage: PYTHONPATH=. python tools/backup.py [-c config.module] command [args]
+Commands:
+  take [name]           take backup into backup directory
+  list                  list backups
+  seed path peer        copy backup from path into empty environment home
+                          directory and start pulling from peer after
+                          backup position, backup must be taken with
+                          configured dbfile and layout
+  peer-position peer N  set position to pull from peer (e.g. position
+                          of the source backup on the seeded node)
+"""
+
+import os
+import sys
+import shutil
+import getopt
+
+# Initiate adding services
+import lib.database
+import lib.action
+import lib.backup
+
+from lib.service import ServiceProvider
+from lib.db_layout import Layout
+from lib.app.sync.sync import SyncApp
+
+
+cfg = {
+    "database": {
+        "dbenv_homedir": "/var/lib/bind",
+        "dbfile": "dlz.db"
+    }
+}
+
+
+def usage():
+    print __doc__
+    sys.exit(1)
+
+def init_services():
+    return ServiceProvider(init_srv=True, cfg=cfg)
+
+def sync_dbpool(database):
+    return lib.database.DatabasePool(SyncApp.DATABASES,
+                                     database.dbenv(),
+                                     database.dbfile(),
+                                     layout=database.layout())
+
+def take(name=None):
+    sp = init_services()
+    info = sp.get("backup").backup(name)
+    print "Backup '{0}' taken at journal position {1}".format(info["name"],
+                                                             info["position"])
+
+def list_backups():
+    sp = init_services()
+    for info in sp.get("backup").list_backups():
+        print "{0}\tposition {1}".format(info["name"], info["position"])
+
+def check_config(info):
+    """
+    Exit if backup files are placed not as configured database expects.
+    """
+
+    dbcfg = cfg["database"]
+    layout = Layout(dbcfg.get("layout", None), dbcfg["dbfile"]).signature()
+    if info["layout"] != layout:
+        print "Backup '{0}' is taken with database layout '{1}', " \
+              "configured layout is '{2}'".format(info["name"], info["layout"], layout)
+        sys.exit(1)
+
+def seed(path, peer):
+    info = lib.backup.manager.read_info(path)
+    check_config(info)
+
+    homedir = cfg["database"]["dbenv_homedir"]
+    if [fname for fname in os.listdir(homedir) if not fname.startswith('.')]:
+        print "Environment home directory '{0}' is not empty".format(homedir)
+        sys.exit(1)
+
+    archive_src = os.path.join(path, lib.backup.manager.JOURNAL_ARCHIVE_DIRNAME)
+    archive_dir = cfg.get("action_journal", {}).get("archive_dir", None)
+    for fname in os.listdir(path):
+        src = os.path.join(path, fname)
+        if src == archive_src:
+            if not archive_dir is None:
+                shutil.copytree(src, os.path.join(homedir, archive_dir))
+        elif fname != lib.backup.manager.INFO_FILENAME:
+            shutil.copy2(src, os.path.join(homedir, fname))
+
+    sp = init_services()
+    database = sp.get("database")
+    dbpool = sync_dbpool(database)
+    with database.transaction() as txn:
+        # peers of the source node know nothing about the new one
+        for dbname in ("peer_ack", "peer_dbstate"):
+            getattr(dbpool, dbname).dbhandle().truncate(txn)
+        dbpool.peer.dbhandle().put(peer, str(info["position"]), txn)
+
+    print "Seeded from backup '{0}' at journal position {1}".format(info["name"],
+                                                                   info["position"])
+    print "Set position of this node on '{0}' with: " \
+          "tools/backup.py peer-position <this node> {1}".format(peer, info["position"])
+
+def peer_position(peer, position):
+    sp = init_services()
+    database = sp.get("database")
+    dbpool = sync_dbpool(database)
+    with database.transaction() as txn:
+        dbpool.peer.dbhandle().put(peer, str(int(position)), txn)
+
+
+if __name__ == "__main__":
+    optlist, args = getopt.getopt(sys.argv[1:], "c:")
+    options = dict(optlist)
+
+    if options.has_key("-c"):
+        cfg_path = options["-c"]
+        top_mod = __import__(cfg_path)
+
+        for mod in cfg_path.split('.')[1:]:
+            top_mod = getattr(top_mod, mod)
+
+        cfg = top_mod.cfg
+
+    commands = {
+        "take": (take, (0, 1)),
+        "list": (list_backups, (0,)),
+        "seed": (seed, (2,)),
+        "peer-position": (peer_position, (2,))
+    }
+
+    if not args or not commands.has_key(args[0]):
+        usage()
+
+    func, nargs = commands[args[0]]
+    if not len(args) - 1 in nargs:
+        usage()
+
+    func(*args[1:])
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
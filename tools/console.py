@@ -125,7 +125,8 @@ session = sp.get("session")
 
 _sync_app_dbpool = lib.database.DatabasePool(SyncApp.DATABASES,
                                              database.dbenv(),
-                                             database.dbfile())
+                                             database.dbfile(),
+                                             layout=database.layout())
 
 
 adb  = database.dbpool().arena.dbhandle()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+Recompute all dbstate records from database contents.
+Required after changing dbstate format and to repair states.
+Usage: PYTHONPATH=. python tools/dbstate_recompute.py [-c config.module]
+"""
+
+import sys
+import getopt
+
+# Initiate adding services
+import lib.database
+
+from lib.service import ServiceProvider
+from lib.dbstate import Dbstate
+
+
+cfg = {
+    "database": {
+        "dbenv_homedir": "/var/lib/bind",
+        "dbfile": "dlz.db"
+    }
+}
+
+
+if __name__ == "__main__":
+    optlist, _ = getopt.getopt(sys.argv[1:], "c:")
+    options = dict(optlist)
+
+    if options.has_key("-c"):
+        cfg_path = options["-c"]
+        top_mod = __import__(cfg_path)
+
+        for mod in cfg_path.split('.')[1:]:
+            top_mod = getattr(top_mod, mod)
+
+        cfg = top_mod.cfg
+
+    sp = ServiceProvider(init_srv=True, cfg=cfg)
+    total, changed, stale = Dbstate().recompute_all(sp.get("database"))
+    print "Recomputed {0} states: {1} changed, {2} stale removed".format(
+          total, changed, stale)
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
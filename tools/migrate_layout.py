@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Move logical databases between files after change of database file layout.
+All processes using the environment must be stopped.
+Usage: PYTHONPATH=. python tools/migrate_layout.py [-c config.module] [-f mode]
+  -f mode   layout mode databases are moved from (single by default),
+              target layout is configured in database section
+Records are moved in batches, one transaction per batch, so interrupted
+  migration may be run again.
+"""
+
+import sys
+import getopt
+
+from lib import database
+from lib.db_tuning import Tuning
+from lib.db_layout import Layout, MODE_SINGLE
+from lib.cursor import open_cursor
+
+import lib.lock
+import lib.action
+import lib.session
+from lib.app.sync.sync import SyncApp
+
+
+BATCH_SIZE = 1000
+
+cfg = {
+    "database": {
+        "dbenv_homedir": "/var/lib/bind",
+        "dbfile": "dlz.db"
+    }
+}
+
+
+def all_databases():
+    res = {}
+    for spec in (database.manager.DATABASES,
+                 lib.action.journal.DATABASES,
+                 lib.lock.manager.DATABASES,
+                 lib.session.manager.JOURNAL_DATABASES,
+                 SyncApp.DATABASES):
+        res.update(spec)
+    return res
+
+def open_source(dbenv, fname, dbname):
+    """
+    Returns handle of existing database or None.
+    """
+
+    db = database.bdb.DB(dbenv)
+    try:
+        with database.Transaction(dbenv) as txn:
+            db.open(fname, dbname, database.bdb.DB_UNKNOWN, 0, 0, txn)
+    except (database.bdb.DBNoSuchFileError, database.bdb.DBNotFoundError):
+        db.close()
+        return None
+    return db
+
+def move_batch(dbenv, src, dst):
+    """
+    Move up to BATCH_SIZE records from src to dst.
+    Returns number of moved records.
+    """
+
+    moved = 0
+    with database.Transaction(dbenv) as txn:
+        with open_cursor(src, txn) as c:
+            rec = c.first()
+            while not rec is None and moved < BATCH_SIZE:
+                try:
+                    dst.put(rec[0], rec[1], txn)
+                except database.bdb.DBKeyExistError:
+                    pass
+                c.delete()
+                moved += 1
+                rec = c.next()
+    return moved
+
+def migrate_database(dbenv, dbname, spec, src_file, dst_file, tuning, layout):
+    src = open_source(dbenv, src_file, dbname)
+    if src is None:
+        return 0
+
+    dst = database.Database(dbenv, dst_file, dbname,
+                            spec["type"], spec["flags"], spec["open_flags"],
+                            tuning=tuning, layout=layout).dbhandle()
+
+    total = 0
+    while True:
+        moved = move_batch(dbenv, src, dst)
+        if not moved:
+            break
+        total += moved
+
+    src.close()
+    dst.close()
+    with database.Transaction(dbenv) as txn:
+        dbenv.dbremove(src_file, dbname, txn)
+    return total
+
+
+if __name__ == "__main__":
+    optlist, _ = getopt.getopt(sys.argv[1:], "c:f:")
+    options = dict(optlist)
+
+    if options.has_key("-c"):
+        cfg_path = options["-c"]
+        top_mod = __import__(cfg_path)
+
+        for mod in cfg_path.split('.')[1:]:
+            top_mod = getattr(top_mod, mod)
+
+        cfg = top_mod.cfg
+
+    dbcfg = cfg["database"]
+    dst_cfg = dbcfg.get("layout", {})
+    # group file names are kept, only placement mode differs
+    src_cfg = dict(dst_cfg, mode=options.get("-f", MODE_SINGLE))
+
+    tuning = Tuning(dbcfg.get("tuning", None))
+    src_layout = Layout(src_cfg, dbcfg["dbfile"], tuning)
+    dst_layout = Layout(dst_cfg, dbcfg["dbfile"], tuning)
+
+    dbenv = database.bdb.DBEnv()
+    tuning.apply_env(dbenv)
+    dbenv.open(dbcfg["dbenv_homedir"],
+               dbcfg.get("dbenv_flags", database.manager.ENV_FLAGS_DEFAULT))
+
+    try:
+        for dbname, spec in sorted(all_databases().iteritems()):
+            src_file = src_layout.file(dbname)
+            dst_file = dst_layout.file(dbname)
+            if src_file == dst_file:
+                continue
+
+            total = migrate_database(dbenv, dbname, spec, src_file, dst_file,
+                                     tuning, dst_layout)
+            print "{0}: {1} records moved from {2} to {3}".format(
+                  dbname, total, src_file, dst_file)
+    finally:
+        dbenv.close()
+
+
+# vim:sts=4:ts=4:sw=4:expandtab:
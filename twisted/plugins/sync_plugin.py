@@ -12,6 +12,7 @@ from twisted.application.service import IServiceMaker
 from lib.app.sync.sync import SyncApp
 from lib.service import ServiceProvider
 from lib.actions import *
+from lib import checkpoint
 
 
 CONFIG_DEFAULT = {
@@ -101,6 +102,11 @@ class SyncServiceMaker(object):
 
             signal.signal(signal.SIGUSR2, self._sighandler)
             self._sa.start_pull()
+            self._sa.start_truncate()
+            self._sa.start_archive()
+            self._sa.start_dbstate_negotiation()
+            self._sa.start_stats_report()
+            sp.get('checkpoint').start()
             return self._sa.make_service()
 
         except Exception, e: